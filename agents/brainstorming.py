@@ -1,10 +1,98 @@
-from openai import OpenAI
-from config import OPENAI_API_KEY, OPENAI_MODEL
+import time
+import json
+import asyncio
+import threading
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+from tenacity import retry, wait_random_exponential, stop_after_attempt, retry_if_exception_type
+from config import OPENAI_MODEL
+from agents.openai_client import client, create_async_client
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Numero massimo di richieste concorrenti verso OpenAI nelle chiamate batch
+MAX_CONCURRENT_REQUESTS = 50
 
-def generate_questions(prompt: str) -> list:
-    system_prompt = """
+# Sotto questa soglia la Batch API non conviene: si usano chiamate concorrenti
+BATCH_API_MIN_SIZE = 16
+BATCH_POLL_INTERVAL = 30  # secondi tra un controllo e l'altro dello stato del batch
+
+# Limiti di rate del tier OpenAI (richieste e token al minuto)
+MAX_REQUESTS_PER_MINUTE = 500
+MAX_TOKENS_PER_MINUTE = 200000
+
+# Errori transitori per cui ha senso ritentare la chiamata
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+_retry_policy = retry(
+    wait=wait_random_exponential(min=1, max=60),
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    reraise=True
+)
+
+
+class _RateLimiter:
+    """
+    Token bucket che rispetta i limiti di richieste e token al minuto.
+    La capacità viene ricaricata in modo continuo in base al tempo trascorso.
+    """
+
+    def __init__(self, max_requests_per_minute: int, max_tokens_per_minute: int):
+        self.max_requests = max_requests_per_minute
+        self.max_tokens = max_tokens_per_minute
+        self.available_requests = float(max_requests_per_minute)
+        self.available_tokens = float(max_tokens_per_minute)
+        self.last_update = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _try_consume(self, tokens: int) -> float:
+        """Consuma la capacità se disponibile; altrimenti restituisce i secondi da attendere."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self.last_update
+            self.last_update = now
+            self.available_requests = min(self.max_requests, self.available_requests + elapsed * self.max_requests / 60)
+            self.available_tokens = min(self.max_tokens, self.available_tokens + elapsed * self.max_tokens / 60)
+
+            tokens = min(tokens, self.max_tokens)
+            if self.available_requests >= 1 and self.available_tokens >= tokens:
+                self.available_requests -= 1
+                self.available_tokens -= tokens
+                return 0.0
+
+            missing_requests = max(0.0, 1 - self.available_requests) * 60 / self.max_requests
+            missing_tokens = max(0.0, tokens - self.available_tokens) * 60 / self.max_tokens
+            return max(missing_requests, missing_tokens)
+
+    def acquire(self, tokens: int) -> None:
+        while (wait := self._try_consume(tokens)) > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int) -> None:
+        while (wait := self._try_consume(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+
+_rate_limiter = _RateLimiter(MAX_REQUESTS_PER_MINUTE, MAX_TOKENS_PER_MINUTE)
+
+
+def _estimate_tokens(kwargs: dict) -> int:
+    # Stima grossolana (~4 caratteri per token) più il budget di completamento
+    prompt_chars = sum(len(m.get("content", "")) for m in kwargs.get("messages", []))
+    return prompt_chars // 4 + kwargs.get("max_tokens", 1024)
+
+
+@_retry_policy
+def _create(**kwargs):
+    _rate_limiter.acquire(_estimate_tokens(kwargs))
+    return client.chat.completions.create(**kwargs)
+
+
+@_retry_policy
+async def _acreate(aclient: AsyncOpenAI, **kwargs):
+    await _rate_limiter.aacquire(_estimate_tokens(kwargs))
+    return await aclient.chat.completions.create(**kwargs)
+
+
+QUESTIONS_SYSTEM_PROMPT = """
 Agisci come un esperto stratega e problem solver. Hai il compito di aiutare un utente a chiarire e raffinare una richiesta che al momento è troppo generica, vaga o poco focalizzata.
 
 Il tuo obiettivo è ottenere rapidamente le informazioni minime necessarie per trasformare quella richiesta in un compito chiaro, mirato, e direttamente azionabile.
@@ -17,44 +105,166 @@ Genera esattamente 3 domande che ti servono per capire:
 Evita domande teoriche, aperte o speculative. Sii diretto, concreto, essenziale. Le tue domande devono avere un chiaro valore operativo.
 """
 
+REFINE_SYSTEM_PROMPT = """
+Agisci come un esperto che trasforma richieste vaghe in istruzioni operative chiare e realizzabili.
+
+Hai ricevuto una richiesta iniziale seguita da alcune risposte a domande di chiarimento. Il tuo obiettivo è scrivere una nuova versione della richiesta che sia precisa, focalizzata sull’obiettivo, e utile per passare direttamente all’azione.
+
+Ignora ridondanze, vai dritto al punto, mantieni il tono professionale e pragmatico.
+"""
+
+
+def _questions_messages(prompt: str) -> list:
     user_prompt = f"""Richiesta iniziale dell’utente: "{prompt}" """
+    return [
+        {"role": "system", "content": QUESTIONS_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def _parse_questions(content: str) -> list:
+    return [q.strip("- ").strip() for q in content.split("\n") if q.strip()]
+
+
+def _refined_messages(original_prompt: str, answers: dict) -> list:
+    keys = sorted(answers)
+    question_answer_pairs = "\n".join([f"{i+1}. {answers[key]}" for i, key in enumerate(keys)])
+
+    user_prompt = f"""Richiesta iniziale: "{original_prompt}"\n\nRisposte fornite:\n{question_answer_pairs}\n\nGenera una versione migliorata e operativa della richiesta."""
 
-    response = client.chat.completions.create(
+    return [
+        {"role": "system", "content": REFINE_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def _async_client() -> AsyncOpenAI:
+    # Il client asincrono è legato all'event loop che lo usa: ne creiamo uno per ogni
+    # esecuzione, condividendo un unico pool httpx tra tutte le richieste concorrenti
+    return create_async_client(MAX_CONCURRENT_REQUESTS)
+
+
+def generate_questions(prompt: str) -> list:
+    response = _create(
         model=OPENAI_MODEL,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
+        messages=_questions_messages(prompt),
         temperature=0.7
     )
 
-    content = response.choices[0].message.content
-    questions = [q.strip("- ").strip() for q in content.split("\n") if q.strip()]
-    return questions
+    return _parse_questions(response.choices[0].message.content)
 
 
 def generate_refined_prompt(original_prompt: str, answers: dict) -> str:
-    question_answer_pairs = "\n".join(
-        f"{i+1}. {answers[key]}" for i, key in enumerate(sorted(answers))
+    response = _create(
+        model=OPENAI_MODEL,
+        messages=_refined_messages(original_prompt, answers),
+        temperature=0.7
     )
 
-    system_prompt = """
-Agisci come un esperto che trasforma richieste vaghe in istruzioni operative chiare e realizzabili.
+    return response.choices[0].message.content.strip()
 
-Hai ricevuto una richiesta iniziale seguita da alcune risposte a domande di chiarimento. Il tuo obiettivo è scrivere una nuova versione della richiesta che sia precisa, focalizzata sull’obiettivo, e utile per passare direttamente all’azione.
 
-Ignora ridondanze, vai dritto al punto, mantieni il tono professionale e pragmatico.
-"""
+async def agenerate_questions(prompt: str, aclient: AsyncOpenAI) -> list:
+    response = await _acreate(
+        aclient,
+        model=OPENAI_MODEL,
+        messages=_questions_messages(prompt),
+        temperature=0.7
+    )
 
-    user_prompt = f"""Richiesta iniziale: "{original_prompt}"\n\nRisposte fornite:\n{question_answer_pairs}\n\nGenera una versione migliorata e operativa della richiesta."""
+    return _parse_questions(response.choices[0].message.content)
 
-    response = client.chat.completions.create(
+
+async def agenerate_refined_prompt(original_prompt: str, answers: dict, aclient: AsyncOpenAI) -> str:
+    response = await _acreate(
+        aclient,
         model=OPENAI_MODEL,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
+        messages=_refined_messages(original_prompt, answers),
         temperature=0.7
     )
 
     return response.choices[0].message.content.strip()
+
+
+async def generate_questions_batch(prompts: list[str], max_concurrency: int = MAX_CONCURRENT_REQUESTS) -> list[list]:
+    """
+    Genera le domande per più prompt in parallelo, limitando le richieste concorrenti.
+    I risultati sono restituiti nello stesso ordine dei prompt.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async with _async_client() as aclient:
+        async def _bounded(prompt: str) -> list:
+            async with semaphore:
+                return await agenerate_questions(prompt, aclient)
+
+        return await asyncio.gather(*[_bounded(p) for p in prompts])
+
+
+async def _generate_refined_prompts_concurrently(pairs: list[tuple[str, dict]],
+                                                 max_concurrency: int = MAX_CONCURRENT_REQUESTS) -> list[str]:
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async with _async_client() as aclient:
+        async def _bounded(original_prompt: str, answers: dict) -> str:
+            async with semaphore:
+                return await agenerate_refined_prompt(original_prompt, answers, aclient)
+
+        return await asyncio.gather(*[_bounded(p, a) for p, a in pairs])
+
+
+def generate_refined_prompts_batch(pairs: list[tuple[str, dict]], poll_interval: int = BATCH_POLL_INTERVAL) -> list[str]:
+    """
+    Genera i prompt raffinati per molte coppie (prompt originale, risposte) tramite la Batch API
+    di OpenAI. Per pochi elementi ripiega su chiamate concorrenti, più rapide da completare.
+    I risultati sono restituiti nello stesso ordine delle coppie.
+    """
+    if len(pairs) < BATCH_API_MIN_SIZE:
+        return asyncio.run(_generate_refined_prompts_concurrently(pairs))
+
+    lines = [
+        json.dumps({
+            "custom_id": f"refine-{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": OPENAI_MODEL,
+                "messages": _refined_messages(original_prompt, answers),
+                "temperature": 0.7
+            }
+        }, ensure_ascii=False)
+        for i, (original_prompt, answers) in enumerate(pairs)
+    ]
+
+    batch_file = client.files.create(
+        file=("refine_batch.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"Batch {batch.id} terminato con stato {batch.status}")
+
+    # Demultiplexa le risposte in base al custom_id
+    refined = {}
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        response = item.get("response") or {}
+        if response.get("status_code") == 200:
+            refined[item["custom_id"]] = response["body"]["choices"][0]["message"]["content"].strip()
+
+    # Le richieste fallite all'interno del batch vengono ripetute singolarmente
+    return [
+        refined.get(f"refine-{i}") or generate_refined_prompt(original_prompt, answers)
+        for i, (original_prompt, answers) in enumerate(pairs)
+    ]
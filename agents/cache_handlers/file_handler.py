@@ -2,28 +2,224 @@
 # agents/cache_handlers/file_handler.py
 
 import os
-import json
+import glob
 import time
-import hashlib
+import asyncio
 import logging
+import sqlite3
+import tempfile
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import List, Dict, Any, Optional
+import orjson
+from blake3 import blake3
 
 logger = logging.getLogger('content_cache.file_handler')
 
+try:
+    import aiofiles
+except ImportError:
+    aiofiles = None
+    logger.warning("aiofiles non è installato, la cache verrà letta in un thread separato. Esegui 'pip install aiofiles'")
+
+# Indice SQLite con i metadati delle pagine in cache
+INDEX_FILE = 'cache_index.sqlite'
+
+# Thread usati per leggere/rimuovere in parallelo i file della cache
+SCAN_MAX_WORKERS = 16
+
+# Numero massimo di percorsi di cache memorizzati per istanza
+CACHE_PATH_LRU_SIZE = 4096
+
+# Numero massimo di nomi di file di cache memorizzati a livello di processo,
+# condivisi tra la cache delle pagine e gli indici RAG
+CACHE_FILE_NAME_LRU_SIZE = 16384
+
+def hash_url(url: str) -> str:
+    """
+    Calcola la chiave di cache di un URL (32 caratteri esadecimali).
+    
+    Args:
+        url (str): URL della pagina web
+        
+    Returns:
+        str: Hash BLAKE3 troncato a 128 bit
+    """
+    return blake3(url.encode()).hexdigest(16)
+
+@functools.lru_cache(maxsize=CACHE_FILE_NAME_LRU_SIZE)
+def cache_file_name(url: str) -> str:
+    """
+    Calcola il nome del file di cache di un URL relativo alla directory della cache.
+    I file sono suddivisi in sottodirectory in base ai primi due caratteri dell'hash,
+    così nessuna directory contiene più di qualche migliaio di file.
+    
+    Args:
+        url (str): URL della pagina web
+        
+    Returns:
+        str: Percorso relativo del file di cache (es. 'ab/cdef....json')
+    """
+    url_hash = hash_url(url)
+    return os.path.join(url_hash[:2], url_hash[2:] + '.json')
+
 class FileHandler:
     """
     Gestore delle operazioni di file per la cache.
     """
     
-    def __init__(self, cache_dir: str):
+    def __init__(self, cache_dir: str, durable_writes: bool = False):
         """
         Inizializza il gestore dei file.
         
         Args:
             cache_dir (str): Directory per la cache dei contenuti scaricati
+            durable_writes (bool): Se True, esegue fsync di ogni file scritto nella cache
         """
         self.cache_dir = cache_dir
+        self.durable_writes = durable_writes
         os.makedirs(self.cache_dir, exist_ok=True)
+        
+        # Memoizza i percorsi per istanza: cache_dir è stato dell'istanza, quindi
+        # la cache LRU vive nella closure e non viene condivisa tra directory diverse
+        self._cached_path = functools.lru_cache(maxsize=CACHE_PATH_LRU_SIZE)(
+            lambda url: os.path.join(self.cache_dir, cache_file_name(url))
+        )
+        migrated = self._migrate_legacy_cache()
+        
+        # Percorsi già cercati senza successo: evita di ripetere la stat su disco per gli URL
+        # non ancora scaricati. Una voce viene rimossa quando il file viene salvato
+        self._missing = set()
+        self._shards = set()
+        
+        # Inizializza l'indice dei metadati, ricostruendolo se non esisteva ancora
+        self.index_path = os.path.join(self.cache_dir, INDEX_FILE)
+        index_exists = os.path.exists(self.index_path)
+        with self._index_connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "cache_file TEXT PRIMARY KEY, url TEXT, timestamp REAL, size INTEGER)"
+            )
+        if migrated or not index_exists:
+            self.rebuild_index()
+    
+    @contextmanager
+    def _index_connection(self):
+        """
+        Apre una connessione all'indice SQLite, esegue il commit all'uscita
+        dal blocco with e chiude la connessione.
+        """
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def rebuild_index(self) -> int:
+        """
+        Ricostruisce l'indice dei metadati leggendo tutti i file di cache presenti.
+        L'operazione è idempotente e serve per migrare le cache create prima dell'indice.
+        
+        Returns:
+            int: Numero di pagine indicizzate
+        """
+        def _read_row(item: tuple) -> Optional[tuple]:
+            cache_file, entry = item
+            cache_data = self._read_meta(entry.path)
+            if cache_data is None:
+                return None
+            return (
+                cache_file,
+                cache_data.get('url', ''),
+                cache_data.get('timestamp', 0),
+                cache_data.get('size', len(cache_data.get('content', '')))
+            )
+        
+        with ThreadPoolExecutor(max_workers=SCAN_MAX_WORKERS) as executor:
+            rows = [row for row in executor.map(_read_row, self._scan_cache_files()) if row is not None]
+        
+        with self._index_connection() as conn:
+            conn.execute("DELETE FROM pages")
+            conn.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)", rows)
+        
+        logger.info(f"Indice della cache ricostruito: {len(rows)} pagine")
+        return len(rows)
+    
+    def _scan_cache_files(self) -> List[tuple]:
+        """
+        Elenca i file di metadati della cache visitando in parallelo le sottodirectory.
+        
+        Returns:
+            List[tuple]: Coppie (percorso relativo, os.DirEntry) dei file JSON di cache
+        """
+        def _scan_shard(shard: os.DirEntry) -> List[tuple]:
+            try:
+                return [
+                    (os.path.join(shard.name, entry.name), entry)
+                    for entry in os.scandir(shard.path) if entry.name.endswith('.json')
+                ]
+            except OSError as e:
+                logger.error(f"Errore nella lettura della directory di cache {shard.name}: {e}")
+                return []
+        
+        shards = [entry for entry in os.scandir(self.cache_dir) if entry.is_dir() and len(entry.name) == 2]
+        with ThreadPoolExecutor(max_workers=SCAN_MAX_WORKERS) as executor:
+            return [item for items in executor.map(_scan_shard, shards) for item in items]
+    
+    def _read_meta(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """
+        Legge i metadati di un file di cache.
+        
+        Args:
+            file_path (str): Percorso del file JSON di cache
+            
+        Returns:
+            Optional[Dict[str, Any]]: Metadati del file o None se non leggibile
+        """
+        try:
+            with open(file_path, 'rb') as f:
+                return orjson.loads(f.read())
+        except Exception as e:
+            logger.error(f"Errore nella lettura del file cache {os.path.basename(file_path)}: {e}")
+            return None
+    
+    def _migrate_legacy_cache(self) -> int:
+        """
+        Sposta nelle sottodirectory i file di cache salvati direttamente nella directory
+        principale (vecchie chiavi MD5 o BLAKE3 non suddivise), ricalcolando il percorso
+        a partire dall'URL salvato in ciascun file. Dopo la prima esecuzione nella
+        directory principale non restano file JSON e la migrazione non fa nulla.
+        
+        Returns:
+            int: Numero di file migrati
+        """
+        migrated = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.json') or not entry.is_file():
+                continue
+            file_name = entry.name
+            file_path = os.path.join(self.cache_dir, file_name)
+            try:
+                with open(file_path, 'rb') as f:
+                    url = orjson.loads(f.read()).get('url', '')
+                if not url:
+                    continue
+                new_path = self.get_cache_path(url)
+                if new_path != file_path:
+                    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                    os.replace(file_path, new_path)
+                    if os.path.exists(self.get_content_path(file_path)):
+                        os.replace(self.get_content_path(file_path), self.get_content_path(new_path))
+                    migrated += 1
+            except Exception as e:
+                logger.error(f"Errore nella migrazione del file cache {file_name}: {e}")
+        
+        if migrated:
+            logger.info(f"Migrati {migrated} file di cache nelle sottodirectory")
+        
+        return migrated
     
     def get_cache_path(self, url: str) -> str:
         """
@@ -35,28 +231,150 @@ class FileHandler:
         Returns:
             str: Percorso del file di cache
         """
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        return os.path.join(self.cache_dir, f"{url_hash}.json")
+        return self._cached_path(url)
+    
+    def get_content_path(self, cache_path: str) -> str:
+        """
+        Ottiene il percorso del file con il contenuto testuale associato a un file di cache.
+        Il file JSON contiene solo i metadati, il contenuto è salvato come testo UTF-8.
+        
+        Args:
+            cache_path (str): Percorso del file di cache (metadati)
+            
+        Returns:
+            str: Percorso del file di contenuto
+        """
+        return os.path.splitext(cache_path)[0] + '.txt'
+    
+    def get_clean_content_path(self, cache_path: str, search_query: str) -> str:
+        """
+        Ottiene il percorso del file con il contenuto già ripulito associato a un file di cache.
+        La pulizia dipende dalla query di ricerca, quindi ogni query ha un proprio file.
+        
+        Args:
+            cache_path (str): Percorso del file di cache (metadati)
+            search_query (str): Query di ricerca usata per ripulire il contenuto
+            
+        Returns:
+            str: Percorso del file di contenuto ripulito
+        """
+        return f"{os.path.splitext(cache_path)[0]}.clean.{blake3(search_query.encode()).hexdigest(8)}.txt"
+    
+    def _clean_content_paths(self, cache_path: str) -> List[str]:
+        """
+        Elenca i file di contenuto ripulito associati a un file di cache, per tutte le query.
+        
+        Args:
+            cache_path (str): Percorso del file di cache (metadati)
+            
+        Returns:
+            List[str]: Percorsi dei file di contenuto ripulito esistenti
+        """
+        return glob.glob(glob.escape(os.path.splitext(cache_path)[0]) + '.clean.*.txt')
+    
+    def _is_cached(self, cache_path: str) -> bool:
+        """
+        Verifica se esiste il file di metadati di una voce di cache, ricordando i percorsi mancanti.
+        
+        Args:
+            cache_path (str): Percorso del file di cache
+            
+        Returns:
+            bool: True se la voce è presente su disco
+        """
+        if cache_path in self._missing:
+            return False
+        if os.path.exists(cache_path):
+            return True
+        self._missing.add(cache_path)
+        return False
+    
+    def _is_expired(self, path: str, max_age: Optional[float]) -> bool:
+        """
+        Verifica se un file di cache è più vecchio dell'età massima indicata.
+        
+        Args:
+            path (str): Percorso del file
+            max_age (Optional[float]): Età massima in secondi (None per nessun limite)
+            
+        Returns:
+            bool: True se il file è scaduto o non più presente
+        """
+        if max_age is None:
+            return False
+        try:
+            return time.time() - os.stat(path).st_mtime > max_age
+        except OSError:
+            return True
     
-    def load_from_cache(self, url: str, cache_path: str) -> Optional[str]:
+    def load_from_cache(self, url: str, cache_path: str, max_age: Optional[float] = None) -> Optional[str]:
         """
         Carica il contenuto dalla cache se disponibile.
         
         Args:
             url (str): URL della pagina web
             cache_path (str): Percorso del file di cache
+            max_age (Optional[float]): Età massima in secondi oltre la quale il contenuto
+                                       va scaricato di nuovo (None per nessun limite)
             
         Returns:
             Optional[str]: Contenuto dalla cache o None se non disponibile
         """
-        if not os.path.exists(cache_path):
+        if not self._is_cached(cache_path):
+            return None
+        
+        # I metadati sono scritti per ultimi: la loro data di modifica è quella del salvataggio
+        if self._is_expired(cache_path, max_age):
+            logger.info(f"Contenuto in cache scaduto per: {url}")
             return None
             
         logger.info(f"Caricamento contenuto dalla cache per: {url}")
         try:
-            with open(cache_path, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-            return cache_data.get('content', '')
+            try:
+                with open(self.get_content_path(cache_path), 'r', encoding='utf-8') as f:
+                    return f.read()
+            except FileNotFoundError:
+                # Formato precedente: il contenuto è incluso nel file JSON
+                with open(cache_path, 'rb') as f:
+                    cache_data = orjson.loads(f.read())
+                return cache_data.get('content', '')
+        except Exception as e:
+            logger.error(f"Errore nel caricamento della cache per {url}: {e}")
+            return None
+    
+    async def aload_from_cache(self, url: str, cache_path: str, max_age: Optional[float] = None) -> Optional[str]:
+        """
+        Versione asincrona di load_from_cache: legge il file senza bloccare l'event loop.
+        
+        Args:
+            url (str): URL della pagina web
+            cache_path (str): Percorso del file di cache
+            max_age (Optional[float]): Età massima in secondi oltre la quale il contenuto
+                                       va scaricato di nuovo (None per nessun limite)
+            
+        Returns:
+            Optional[str]: Contenuto dalla cache o None se non disponibile
+        """
+        if aiofiles is None:
+            return await asyncio.to_thread(self.load_from_cache, url, cache_path, max_age)
+        
+        if not self._is_cached(cache_path):
+            return None
+        
+        if self._is_expired(cache_path, max_age):
+            logger.info(f"Contenuto in cache scaduto per: {url}")
+            return None
+        
+        logger.info(f"Caricamento contenuto dalla cache per: {url}")
+        try:
+            try:
+                async with aiofiles.open(self.get_content_path(cache_path), 'r', encoding='utf-8') as f:
+                    return await f.read()
+            except FileNotFoundError:
+                # Formato precedente: il contenuto è incluso nel file JSON
+                async with aiofiles.open(cache_path, 'rb') as f:
+                    cache_data = orjson.loads(await f.read())
+                return cache_data.get('content', '')
         except Exception as e:
             logger.error(f"Errore nel caricamento della cache per {url}: {e}")
             return None
@@ -71,40 +389,131 @@ class FileHandler:
             content (str): Contenuto da salvare
         """
         try:
-            with open(cache_path, 'w', encoding='utf-8') as f:
-                json.dump({
-                    'url': url,
-                    'timestamp': time.time(),
-                    'content': content
-                }, f, ensure_ascii=False, indent=2)
+            timestamp = time.time()
+            
+            # Crea la sottodirectory solo la prima volta che viene usata
+            shard_dir = os.path.dirname(cache_path)
+            if shard_dir not in self._shards:
+                os.makedirs(shard_dir, exist_ok=True)
+                self._shards.add(shard_dir)
+            
+            # Scrive prima il contenuto e poi i metadati: la presenza del file JSON
+            # indica che la voce di cache è completa
+            self._atomic_write(self.get_content_path(cache_path), content.encode('utf-8'))
+            self._atomic_write(cache_path, orjson.dumps({
+                'url': url,
+                'timestamp': timestamp,
+                'size': len(content)
+            }))
+            self._missing.discard(cache_path)
+            
+            # Aggiorna l'indice dei metadati
+            with self._index_connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)",
+                    (os.path.relpath(cache_path, self.cache_dir), url, timestamp, len(content))
+                )
         except Exception as e:
             logger.error(f"Errore nel salvataggio della cache per {url}: {e}")
     
-    def list_cached_pages(self) -> List[Dict[str, Any]]:
+    def load_clean_content(self, url: str, cache_path: str, search_query: str,
+                           max_age: Optional[float] = None) -> Optional[str]:
+        """
+        Carica il contenuto ripulito dalla cache se disponibile.
+        
+        Args:
+            url (str): URL della pagina web
+            cache_path (str): Percorso del file di cache
+            search_query (str): Query di ricerca usata per ripulire il contenuto
+            max_age (Optional[float]): Età massima in secondi del contenuto (None per nessun limite)
+            
+        Returns:
+            Optional[str]: Contenuto ripulito o None se non disponibile
+        """
+        clean_path = self.get_clean_content_path(cache_path, search_query)
+        if self._is_expired(clean_path, max_age):
+            return None
+        
+        try:
+            with open(clean_path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Errore nel caricamento del contenuto ripulito per {url}: {e}")
+            return None
+    
+    def save_clean_content(self, url: str, cache_path: str, search_query: str, content: str) -> None:
+        """
+        Salva nella cache il contenuto ripulito di una pagina.
+        
+        Args:
+            url (str): URL della pagina web
+            cache_path (str): Percorso del file di cache
+            search_query (str): Query di ricerca usata per ripulire il contenuto
+            content (str): Contenuto ripulito da salvare
+        """
+        try:
+            shard_dir = os.path.dirname(cache_path)
+            if shard_dir not in self._shards:
+                os.makedirs(shard_dir, exist_ok=True)
+                self._shards.add(shard_dir)
+            
+            self._atomic_write(self.get_clean_content_path(cache_path, search_query), content.encode('utf-8'))
+        except Exception as e:
+            logger.error(f"Errore nel salvataggio del contenuto ripulito per {url}: {e}")
+    
+    def _atomic_write(self, path: str, data: bytes) -> None:
+        """
+        Scrive un file in modo atomico: i dati vanno in un file temporaneo nella stessa
+        directory che poi sostituisce quello di destinazione, così un lettore non vede
+        mai un file scritto a metà.
+        
+        Args:
+            path (str): Percorso del file di destinazione
+            data (bytes): Dati da scrivere
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                if self.durable_writes:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    
+    def list_cached_pages(self, max_age: Optional[float] = None) -> List[Dict[str, Any]]:
         """
         Ottiene l'elenco di tutte le pagine nella cache.
         
+        Args:
+            max_age (Optional[float]): Se specificato, esclude le pagine salvate più di
+                                       max_age secondi fa (None per nessun limite)
+            
         Returns:
             List[Dict[str, Any]]: Lista di metadati delle pagine nella cache
         """
-        cached_pages = []
-        
-        if os.path.exists(self.cache_dir):
-            for file_name in os.listdir(self.cache_dir):
-                if (file_name.endswith('.json')):
-                    file_path = os.path.join(self.cache_dir, file_name)
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            cache_data = json.load(f)
-                            
-                            cached_pages.append({
-                                'url': cache_data.get('url', ''),
-                                'timestamp': cache_data.get('timestamp', 0),
-                                'size': len(cache_data.get('content', '')),
-                                'cache_file': file_name
-                            })
-                    except Exception as e:
-                        logger.error(f"Errore nella lettura del file cache {file_name}: {e}")
+        min_timestamp = 0 if max_age is None else time.time() - max_age
+        try:
+            with self._index_connection() as conn:
+                rows = conn.execute(
+                    "SELECT url, timestamp, size, cache_file FROM pages WHERE timestamp >= ?",
+                    (min_timestamp,)
+                ).fetchall()
+        except Exception as e:
+            logger.error(f"Errore nella lettura dell'indice della cache: {e}")
+            return []
+        
+        cached_pages = [
+            {'url': url, 'timestamp': timestamp, 'size': size, 'cache_file': cache_file}
+            for url, timestamp, size, cache_file in rows
+        ]
         
         return cached_pages
     
@@ -122,35 +531,45 @@ class FileHandler:
         if not os.path.exists(self.cache_dir):
             return 0
             
-        files_removed = 0
         current_time = time.time()
         
-        for file_name in os.listdir(self.cache_dir):
-            if file_name.endswith('.json'):
-                file_path = os.path.join(self.cache_dir, file_name)
-                
-                # Se older_than_days è specificato, controlla l'età del file
-                if older_than_days is not None:
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            cache_data = json.load(f)
-                            timestamp = cache_data.get('timestamp', 0)
-                            
-                            # Calcola l'età in giorni
-                            age_days = (current_time - timestamp) / (60 * 60 * 24)
-                            
-                            # Salta i file che non sono abbastanza vecchi
-                            if age_days < older_than_days:
-                                continue
-                    except Exception:
-                        # Se non riesce a leggere il file, lo rimuove comunque
-                        pass
-                
-                # Rimuove il file
+        def _remove_entry(item: tuple) -> Optional[str]:
+            cache_file, entry = item
+            # Se older_than_days è specificato, controlla l'età del file usando la data
+            # di modifica: i metadati sono scritti per ultimi in save_to_cache, quindi
+            # st_mtime coincide con il timestamp salvato senza dover leggere il JSON
+            if older_than_days is not None:
                 try:
-                    os.remove(file_path)
-                    files_removed += 1
-                except Exception as e:
-                    logger.error(f"Errore nella rimozione del file cache {file_name}: {e}")
+                    # Calcola l'età in giorni
+                    age_days = (current_time - entry.stat().st_mtime) / (60 * 60 * 24)
+                    
+                    # Salta i file che non sono abbastanza vecchi
+                    if age_days < older_than_days:
+                        return None
+                except OSError:
+                    # Se non riesce a leggere le informazioni del file, lo rimuove comunque
+                    pass
+            
+            # Rimuove il file dei metadati e quelli del contenuto
+            try:
+                os.remove(entry.path)
+                for content_path in [self.get_content_path(entry.path)] + self._clean_content_paths(entry.path):
+                    if os.path.exists(content_path):
+                        os.remove(content_path)
+                return cache_file
+            except Exception as e:
+                logger.error(f"Errore nella rimozione del file cache {cache_file}: {e}")
+                return None
+        
+        with ThreadPoolExecutor(max_workers=SCAN_MAX_WORKERS) as executor:
+            removed_files = [(name,) for name in executor.map(_remove_entry, self._scan_cache_files()) if name]
+        files_removed = len(removed_files)
+        
+        # Rimuove dall'indice le pagine cancellate
+        try:
+            with self._index_connection() as conn:
+                conn.executemany("DELETE FROM pages WHERE cache_file = ?", removed_files)
+        except Exception as e:
+            logger.error(f"Errore nell'aggiornamento dell'indice della cache: {e}")
         
         return files_removed
\ No newline at end of file
@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+# agents/cache_handlers/http_client.py
+
+import httpx
+
+# Client HTTP condiviso per i download diretti (PDF, sonde HEAD): mantiene le
+# connessioni aperte tra le richieste e usa HTTP/2 quando il server lo supporta
+http_client = httpx.Client(
+    http2=True,
+    timeout=30,
+    follow_redirects=True,
+    limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+)
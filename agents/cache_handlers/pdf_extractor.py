@@ -1,13 +1,67 @@
 #!/usr/bin/env python3
 # agents/cache_handlers/pdf_extractor.py
 
-import os
-import tempfile
+import io
 import logging
-import requests
+import threading
+from typing import List
+
+from .http_client import http_client
+from ..process_pool import get_process_pool, PROCESS_POOL_WORKERS
 
 logger = logging.getLogger('content_cache.pdf_extractor')
 
+# Sotto questo numero di pagine inviare il PDF ai processi del pool condiviso (già avviati
+# dopo il primo utilizzo) costa più dell'estrazione seriale
+PARALLEL_MIN_PAGES = 4
+
+# PDFium non è thread-safe, nemmeno tra documenti diversi: nel processo principale
+# ogni chiamata alla libreria avviene sotto questo lock
+_pdfium_lock = threading.Lock()
+
+# Alcuni endpoint dinamici servono i PDF compressi: httpx li decomprime in streaming
+PDF_REQUEST_HEADERS = {'Accept-Encoding': 'gzip, br'}
+
+def _page_text(pdf, page_num: int) -> str:
+    """
+    Estrae il testo di una singola pagina di un documento PDFium.
+    
+    Args:
+        pdf (pypdfium2.PdfDocument): Documento PDF aperto
+        page_num (int): Indice della pagina
+        
+    Returns:
+        str: Testo della pagina
+    """
+    page = pdf[page_num]
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_range()
+    finally:
+        textpage.close()
+        page.close()
+
+def _extract_pages(pdf_bytes: bytes, start: int, end: int) -> List[str]:
+    """
+    Estrae il testo da un intervallo di pagine. Eseguita nei processi worker:
+    riceve i byte del PDF perché i documenti PDFium non sono serializzabili.
+    
+    Args:
+        pdf_bytes (bytes): Contenuto del file PDF
+        start (int): Indice della prima pagina (incluso)
+        end (int): Indice dell'ultima pagina (escluso)
+        
+    Returns:
+        List[str]: Testo di ciascuna pagina dell'intervallo
+    """
+    import pypdfium2 as pdfium
+    
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        return [_page_text(pdf, page_num) for page_num in range(start, end)]
+    finally:
+        pdf.close()
+
 class PDFExtractor:
     """
     Classe specializzata per l'estrazione di testo dai file PDF.
@@ -24,56 +78,82 @@ class PDFExtractor:
             str: Testo estratto dal PDF o stringa vuota in caso di errore
         """
         try:
-            import pypdf
+            import pypdfium2 as pdfium
             
             logger.info(f"Scaricamento del PDF da: {url}")
             
-            # Scarica il file PDF
-            response = requests.get(url, stream=True, timeout=30)
-            if response.status_code != 200:
-                logger.error(f"Errore nel download del PDF da {url}: status code {response.status_code}")
-                return ""
+            # Scarica il file PDF direttamente in memoria
+            pdf_buffer = io.BytesIO()
+            with http_client.stream("GET", url, headers=PDF_REQUEST_HEADERS) as response:
+                if response.status_code != 200:
+                    logger.error(f"Errore nel download del PDF da {url}: status code {response.status_code}")
+                    return ""
                 
-            # Salva temporaneamente il PDF
-            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp_file:
-                tmp_path = tmp_file.name
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        tmp_file.write(chunk)
+                for chunk in response.iter_bytes(chunk_size=65536):
+                    pdf_buffer.write(chunk)
+            pdf_buffer.seek(0)
             
             # Estrai il testo dal PDF
             extracted_text = ""
             try:
-                with open(tmp_path, 'rb') as pdf_file:
-                    reader = pypdf.PdfReader(pdf_file)
-                    num_pages = len(reader.pages)
-                    
-                    logger.info(f"Estrazione del testo da PDF con {num_pages} pagine")
-                    
-                    # Estrai il testo da ogni pagina
-                    for page_num in range(num_pages):
-                        page = reader.pages[page_num]
-                        page_text = page.extract_text()
-                        if page_text:
-                            extracted_text += page_text + "\n\n"
+                pdf_bytes = pdf_buffer.getvalue()
+                with _pdfium_lock:
+                    pdf = pdfium.PdfDocument(pdf_bytes)
+                    try:
+                        num_pages = len(pdf)
+                        
+                        logger.info(f"Estrazione del testo da PDF con {num_pages} pagine")
+                        
+                        if num_pages < PARALLEL_MIN_PAGES:
+                            # Estrai il testo da ogni pagina
+                            page_texts = [_page_text(pdf, page_num) for page_num in range(num_pages)]
+                        else:
+                            page_texts = None
+                    finally:
+                        pdf.close()
+                
+                # I worker hanno ciascuno la propria istanza di PDFium: il lock non serve
+                if page_texts is None:
+                    page_texts = self._extract_pages_parallel(pdf_bytes, num_pages)
+                
+                extracted_text = "".join(page_text + "\n\n" for page_text in page_texts if page_text)
                 
                 logger.info(f"Estrazione completata: {len(extracted_text)} caratteri estratti")
                 
             except Exception as e:
                 logger.error(f"Errore nell'estrazione del testo dal PDF: {e}")
                 return ""
-            finally:
-                # Rimuovi il file temporaneo
-                try:
-                    os.unlink(tmp_path)
-                except Exception as e:
-                    logger.warning(f"Errore nella rimozione del file temporaneo: {e}")
             
             return extracted_text.strip()
             
         except ImportError:
-            logger.error("Libreria pypdf non disponibile per l'estrazione di testo dai PDF")
+            logger.error("Libreria pypdfium2 non disponibile per l'estrazione di testo dai PDF")
             return ""
         except Exception as e:
             logger.error(f"Errore generale nell'estrazione del testo dal PDF {url}: {e}")
-            return ""
\ No newline at end of file
+            return ""
+    
+    def _extract_pages_parallel(self, pdf_bytes: bytes, num_pages: int) -> List[str]:
+        """
+        Estrae il testo delle pagine in parallelo nel pool di processi condiviso, mantenendo
+        l'ordine. Le pagine sono divise in intervalli contigui, uno per worker, così che ogni
+        processo analizzi il PDF una sola volta.
+        
+        Args:
+            pdf_bytes (bytes): Contenuto del file PDF
+            num_pages (int): Numero di pagine del PDF
+            
+        Returns:
+            List[str]: Testo di ciascuna pagina
+        """
+        workers = min(PROCESS_POOL_WORKERS, num_pages)
+        step = -(-num_pages // workers)
+        ranges = [(start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+        
+        chunks = get_process_pool().map(
+            _extract_pages,
+            [pdf_bytes] * len(ranges),
+            [start for start, _ in ranges],
+            [end for _, end in ranges]
+        )
+        return [page_text for chunk in chunks for page_text in chunk]
@@ -1,16 +1,40 @@
 #!/usr/bin/env python3
 # agents/cache_handlers/url_detector.py
 
+import re
 import logging
-from urllib.parse import urlparse
+import threading
+from typing import Optional
+
+import httpx
+from cachetools import LRUCache
+
+from .http_client import http_client
 
 logger = logging.getLogger('content_cache.url_detector')
 
+# Un URL punta a un PDF se il percorso termina con .pdf oppure se la query
+# contiene pdf=true (URL dinamici che generano PDF)
+_PDF_URL_RE = re.compile(r'^[^?#]*\.pdf(?:[?#]|$)|\?[^#]*pdf=true', re.IGNORECASE)
+
+# Timeout (in secondi) della richiesta HEAD usata per scoprire i PDF senza estensione
+PDF_PROBE_TIMEOUT = 5
+
+# Numero massimo di esiti delle sonde HEAD memorizzati
+PDF_PROBE_CACHE_SIZE = 4096
+
 class URLDetector:
     """
     Classe per identificare il tipo di URL (PDF, HTML, ecc).
     """
     
+    def __init__(self):
+        """
+        Inizializza il rilevatore con la cache degli esiti delle sonde HEAD.
+        """
+        self._probe_cache = LRUCache(maxsize=PDF_PROBE_CACHE_SIZE)
+        self._probe_lock = threading.Lock()
+    
     def is_pdf_url(self, url: str) -> bool:
         """
         Verifica se un URL punta a un file PDF.
@@ -21,13 +45,38 @@ class URLDetector:
         Returns:
             bool: True se l'URL punta a un PDF, False altrimenti
         """
-        # Controlla l'estensione nell'URL
-        parsed_url = urlparse(url)
-        path = parsed_url.path.lower()
+        return _PDF_URL_RE.search(url) is not None
+    
+    def is_pdf_url_with_probe(self, url: str, session: Optional[httpx.Client] = None) -> bool:
+        """
+        Verifica se un URL punta a un file PDF. Se l'euristica sul percorso non basta
+        (es. link /doi/abs/... che reindirizzano a un PDF) esegue una richiesta HEAD e
+        controlla il Content-Type. L'esito della sonda viene memorizzato per URL.
         
-        # Se il percorso termina con .pdf, è probabilmente un PDF
-        if path.endswith('.pdf'):
-            return True
+        Args:
+            url (str): URL da verificare
+            session (Optional[httpx.Client]): Client HTTP da usare per la richiesta HEAD;
+                                              se non specificato usa il client condiviso
             
-        # Controlla anche i parametri (per URL dinamici che generano PDF)
-        return 'pdf' in parsed_url.query.lower() and 'pdf=true' in parsed_url.query.lower()
\ No newline at end of file
+        Returns:
+            bool: True se l'URL punta a un PDF, False altrimenti
+        """
+        if self.is_pdf_url(url):
+            return True
+        
+        with self._probe_lock:
+            cached = self._probe_cache.get(url)
+        if cached is not None:
+            return cached
+        
+        try:
+            response = (session or http_client).head(url, follow_redirects=True, timeout=PDF_PROBE_TIMEOUT)
+            is_pdf = response.headers.get('content-type', '').lower().startswith('application/pdf')
+        except Exception as e:
+            # In caso di errore l'URL viene trattato come pagina HTML
+            logger.debug(f"Sonda HEAD non riuscita per {url}: {e}")
+            is_pdf = False
+        
+        with self._probe_lock:
+            self._probe_cache[url] = is_pdf
+        return is_pdf
\ No newline at end of file
@@ -3,7 +3,7 @@
 
 import sys
 import argparse
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Union
 
 # Import formattatori
 from agents.formatter import format_search_results, format_rag_query_result, format_rag_indices
@@ -50,12 +50,18 @@ def create_argument_parser() -> argparse.ArgumentParser:
     
     return parser
 
-def handle_cli_commands(args: Dict[str, Any], orchestrator) -> Optional[str]:
+# Opzioni della CLI lette da handle_cli_commands, nell'ordine in cui vengono estratte
+CLI_OPTIONS = (
+    'list_cache', 'clear_cache', 'clear_old_cache', 'list_indices', 'query_rag',
+    'task', 'summarize', 'no_rag', 'max_results', 'max_cycles'
+)
+
+def handle_cli_commands(args: Union[Dict[str, Any], argparse.Namespace], orchestrator) -> Optional[str]:
     """
     Gestisce i comandi della CLI eseguendo le azioni appropriate.
     
     Args:
-        args (Dict[str, Any]): Argomenti della riga di comando
+        args (Union[Dict[str, Any], argparse.Namespace]): Argomenti della riga di comando
         orchestrator: Istanza di SearchOrchestrator
         
     Returns:
@@ -63,36 +69,42 @@ def handle_cli_commands(args: Dict[str, Any], orchestrator) -> Optional[str]:
     """
     output = None
     
+    # Estrae tutte le opzioni una sola volta, accettando sia un dict sia un Namespace
+    if not isinstance(args, dict):
+        args = vars(args)
+    (list_cache, clear_cache, clear_old_cache, list_indices, query_rag,
+     task, summarize, no_rag, max_results, max_cycles) = (args.get(key) for key in CLI_OPTIONS)
+    
     # Gestione delle opzioni della cache
-    if args.get('list_cache'):
+    if list_cache:
         cached_pages = orchestrator.get_cached_pages()
         from agents.formatter import format_cached_pages
         output = format_cached_pages(cached_pages)
     
-    elif args.get('clear_cache'):
+    elif clear_cache:
         from agents.content_cache import ContentCache
         cache = ContentCache()
         files_removed = cache.clear_cache()
         output = f"Cache cancellata: {files_removed} file rimossi."
     
-    elif args.get('clear_old_cache') is not None:
-        days = args.get('clear_old_cache')
+    elif clear_old_cache is not None:
+        days = clear_old_cache
         from agents.content_cache import ContentCache
         cache = ContentCache()
         files_removed = cache.clear_cache(older_than_days=days)
         output = f"File vecchi rimossi dalla cache: {files_removed} file più vecchi di {days} giorni."
     
     # Gestione delle opzioni RAG
-    elif args.get('list_indices'):
+    elif list_indices:
         if orchestrator.rag_storage and orchestrator.rag_storage.is_initialized:
             indices = orchestrator.rag_storage.list_rag_indices()
             output = format_rag_indices(indices)
         else:
             output = "Sistema RAG non inizializzato. Impossibile elencare gli indici."
     
-    elif args.get('query_rag') and args.get('task'):
-        rag_id = args.get('query_rag')
-        query = args.get('task')
+    elif query_rag and task:
+        rag_id = query_rag
+        query = task
         if orchestrator.rag_storage and orchestrator.rag_storage.is_initialized:
             result = orchestrator.rag_storage.query_rag_index(rag_id, query)
             if result:
@@ -103,29 +115,24 @@ def handle_cli_commands(args: Dict[str, Any], orchestrator) -> Optional[str]:
             output = "Sistema RAG non inizializzato. Impossibile eseguire query."
     
     # Gestione dell'opzione di riassunto
-    elif args.get('summarize'):
-        url = args.get('summarize')
+    elif summarize:
+        url = summarize
         summary = orchestrator.summarize_content(url)
         output = f"Riassunto di {url}:\n\n{summary}"
     
     # Gestione della ricerca normale
-    elif args.get('task'):
-        task = args.get('task')
-        save_as_rag = not args.get('no_rag', False)
+    elif task:
+        save_as_rag = not no_rag
         
         # Imposta i parametri opzionali se forniti
         kwargs = {}
-        if args.get('max_results') is not None:
-            kwargs['max_relevant_results'] = args.get('max_results')
-        if args.get('max_cycles') is not None:
-            kwargs['max_search_cycles'] = args.get('max_cycles')
+        if max_results is not None:
+            kwargs['max_relevant_results'] = max_results
+        if max_cycles is not None:
+            kwargs['max_search_cycles'] = max_cycles
         
         # Esegui la ricerca con i parametri specificati
-        if kwargs:
-            temp_orchestrator = type(orchestrator)(**kwargs)
-            results = temp_orchestrator.search(task, save_as_rag=save_as_rag)
-        else:
-            results = orchestrator.search(task, save_as_rag=save_as_rag)
+        results = orchestrator.search(task, save_as_rag=save_as_rag, **kwargs)
         
         # Formatta i risultati
         output = format_search_results(results)
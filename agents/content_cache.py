@@ -2,12 +2,13 @@
 # agents/content_cache.py
 
 import os
-import json
 import time
-import hashlib
+import asyncio
 import logging
+import threading
 from typing import List, Dict, Any, Optional
 from urllib.parse import urlparse
+from cachetools import LRUCache, TTLCache
 
 # Importo i moduli specializzati
 from .cache_handlers.file_handler import FileHandler
@@ -17,18 +18,30 @@ from .cache_handlers.pdf_extractor import PDFExtractor
 # Configure logging
 logger = logging.getLogger('content_cache')
 
+# Dimensione massima (in caratteri) dei contenuti tenuti in memoria
+MEMORY_CACHE_MAX_CHARS = 64 * 1024 * 1024
+
+# Età massima (in secondi) dei contenuti nella cache in memoria: oltre, la pagina viene
+# riletta dal disco. La cache su disco è persistente e scade solo se richiesto (disk_ttl)
+CACHE_TTL = 24 * 3600
+
 class ContentCache:
     """
     Gestore della cache per i contenuti delle pagine web scaricate.
     Classe principale che coordina le operazioni di cache.
     """
     
-    def __init__(self, cache_dir="cache"):
+    def __init__(self, cache_dir="cache", max_memory_chars: int = MEMORY_CACHE_MAX_CHARS,
+                 ttl: Optional[float] = CACHE_TTL, disk_ttl: Optional[float] = None):
         """
         Inizializza il gestore della cache.
         
         Args:
             cache_dir (str): Directory per la cache dei contenuti scaricati
+            max_memory_chars (int): Dimensione massima (in caratteri) dei contenuti tenuti in memoria
+            ttl (Optional[float]): Età massima in secondi dei contenuti in memoria (None per nessun limite)
+            disk_ttl (Optional[float]): Età massima in secondi dei contenuti su disco, oltre la quale la
+                                        pagina viene scaricata di nuovo (None per nessun limite)
         """
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.cache_dir = os.path.join(base_dir, cache_dir)
@@ -38,7 +51,29 @@ class ContentCache:
         self.url_detector = URLDetector()
         self.pdf_extractor = PDFExtractor()
         
-        os.makedirs(self.cache_dir, exist_ok=True)
+        # Cache LRU in memoria, limitata dalla dimensione totale dei contenuti
+        # così che pochi PDF molto grandi non occupino tutta la memoria
+        self.max_memory_chars = max_memory_chars
+        self.ttl = ttl
+        self.disk_ttl = disk_ttl
+        if ttl is None:
+            self._memory_cache = LRUCache(maxsize=max_memory_chars, getsizeof=len)
+        else:
+            self._memory_cache = TTLCache(maxsize=max_memory_chars, ttl=ttl, getsizeof=len)
+        self._memory_lock = threading.Lock()
+    
+    def _remember(self, url: str, content: str) -> None:
+        """
+        Memorizza un contenuto nella cache in memoria, se non supera la dimensione massima.
+        
+        Args:
+            url (str): URL della pagina web
+            content (str): Contenuto da memorizzare
+        """
+        if len(content) > self.max_memory_chars:
+            return
+        with self._memory_lock:
+            self._memory_cache[url] = content
     
     def get_cache_path(self, url: str) -> str:
         """
@@ -63,19 +98,27 @@ class ContentCache:
         Returns:
             str: Contenuto estratto
         """
+        # Prova prima la cache in memoria
+        with self._memory_lock:
+            cached_content = self._memory_cache.get(url)
+        if cached_content is not None:
+            return cached_content
+        
         cache_path = self.get_cache_path(url)
         
         # Prova a caricare dalla cache
-        cached_content = self.file_handler.load_from_cache(url, cache_path)
+        cached_content = self.file_handler.load_from_cache(url, cache_path, self.disk_ttl)
         if cached_content is not None:
+            self._remember(url, cached_content)
             return cached_content
         
         # Se non è in cache, verifica se è un PDF
-        if self.url_detector.is_pdf_url(url):
+        if self.url_detector.is_pdf_url_with_probe(url):
             logger.info(f"Rilevato URL di tipo PDF: {url}")
             content = self.pdf_extractor.extract_pdf_text(url)
             # Salva nella cache
             self.file_handler.save_to_cache(url, cache_path, content)
+            self._remember(url, content)
             return content
         
         # Se non è un PDF, usa il normale scraper
@@ -88,17 +131,88 @@ class ContentCache:
         
         # Salva nella cache
         self.file_handler.save_to_cache(url, cache_path, content)
+        self._remember(url, content)
+        
+        return content
+    
+    async def get_content_async(self, url: str, async_scraper_func=None) -> str:
+        """
+        Versione asincrona di get_content: le pagine non in cache vengono scaricate con
+        async_scraper_func e la cache su disco viene letta con aiofiles, mentre i salvataggi
+        e i PDF vengono gestiti in un thread.
+        
+        Args:
+            url (str): URL della pagina web o del PDF
+            async_scraper_func (callable): Coroutine che riceve l'URL e ne restituisce il contenuto
+            
+        Returns:
+            str: Contenuto estratto
+        """
+        # Prova prima la cache in memoria
+        with self._memory_lock:
+            cached_content = self._memory_cache.get(url)
+        if cached_content is not None:
+            return cached_content
+        
+        cache_path = self.get_cache_path(url)
+        
+        # Prova a caricare dalla cache
+        cached_content = await self.file_handler.aload_from_cache(url, cache_path, self.disk_ttl)
+        if cached_content is not None:
+            self._remember(url, cached_content)
+            return cached_content
+        
+        # Se non è in cache, verifica se è un PDF
+        if await asyncio.to_thread(self.url_detector.is_pdf_url_with_probe, url):
+            logger.info(f"Rilevato URL di tipo PDF: {url}")
+            content = await asyncio.to_thread(self.pdf_extractor.extract_pdf_text, url)
+        elif not async_scraper_func:
+            logger.error(f"URL non in cache e nessuna funzione di scraping fornita: {url}")
+            return ""
+        else:
+            logger.info(f"Scaricamento contenuto per: {url}")
+            content = await async_scraper_func(url)
+        
+        # Salva nella cache (il salvataggio aggiorna anche l'indice SQLite, quindi resta in un thread)
+        await asyncio.to_thread(self.file_handler.save_to_cache, url, cache_path, content)
+        self._remember(url, content)
         
         return content
     
+    def get_clean_content(self, url: str, search_query: str) -> Optional[str]:
+        """
+        Ottiene il contenuto già ripulito di una pagina, se è stato salvato in precedenza
+        per la stessa query di ricerca.
+        
+        Args:
+            url (str): URL della pagina web o del PDF
+            search_query (str): Query di ricerca usata per ripulire il contenuto
+            
+        Returns:
+            Optional[str]: Contenuto ripulito o None se non disponibile
+        """
+        return self.file_handler.load_clean_content(url, self.get_cache_path(url), search_query, self.disk_ttl)
+    
+    def save_clean_content(self, url: str, search_query: str, content: str) -> None:
+        """
+        Salva il contenuto ripulito di una pagina, così che non debba essere ripulito di nuovo
+        per la stessa query di ricerca.
+        
+        Args:
+            url (str): URL della pagina web o del PDF
+            search_query (str): Query di ricerca usata per ripulire il contenuto
+            content (str): Contenuto ripulito
+        """
+        self.file_handler.save_clean_content(url, self.get_cache_path(url), search_query, content)
+    
     def list_cached_pages(self) -> List[Dict[str, Any]]:
         """
-        Ottiene l'elenco di tutte le pagine nella cache.
+        Ottiene l'elenco di tutte le pagine nella cache, escluse quelle scadute se è impostato disk_ttl.
         
         Returns:
             List[Dict[str, Any]]: Lista di metadati delle pagine nella cache
         """
-        return self.file_handler.list_cached_pages()
+        return self.file_handler.list_cached_pages(self.disk_ttl)
     
     def clear_cache(self, older_than_days: Optional[int] = None) -> int:
         """
@@ -111,4 +225,6 @@ class ContentCache:
         Returns:
             int: Numero di file rimossi dalla cache
         """
+        with self._memory_lock:
+            self._memory_cache.clear()
         return self.file_handler.clear_cache(older_than_days)
\ No newline at end of file
@@ -1,53 +1,301 @@
 #!/usr/bin/env python3
 # agents/content_cleaner.py
 
+import io
 import re
+import html
+import json
 import time
+import asyncio
 import openai
 import logging
-import concurrent.futures
-from typing import List, Dict, Any
-from bs4 import BeautifulSoup
+import threading
+import functools
+from typing import List, Dict, Any, Optional, TYPE_CHECKING
+from blake3 import blake3
+from cachetools import LRUCache
+from tenacity import retry, retry_if_exception_type, wait_random_exponential, stop_after_attempt
 
 # Importa configurazioni
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import OPENAI_API_KEY, OPENAI_MODEL
+from config import OPENAI_MODEL
+from agents.openai_client import client, create_async_client
 
-# Configurazione del logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger('content_cleaner')
+# bs4 e tiktoken sono importati solo quando servono: caricarli costa all'avvio
+# e non sono necessari a chi importa il modulo senza pulire contenuti
+if TYPE_CHECKING:
+    import tiktoken
+    from bs4 import BeautifulSoup
 
-# Configurazione OpenAI
-openai.api_key = OPENAI_API_KEY
+# Il logging è configurato dal punto di ingresso dell'applicazione
+logger = logging.getLogger('content_cleaner')
 
 # Configurazione predefinita
-DEFAULT_MAX_THREADS = 5
+DEFAULT_MAX_THREADS = 5   # richieste concorrenti verso OpenAI
 DEFAULT_BLOCK_SIZE = 5000  # caratteri per blocco
 DEFAULT_OVERLAP = 150      # caratteri di sovrapposizione tra blocchi consecutivi
+DEFAULT_BLOCK_TOKENS = 3000  # token per blocco, misurati con il tokenizer del modello
+
+# Budget di completamento per blocco: almeno 2048 token, o la dimensione del blocco se maggiore
+MIN_COMPLETION_TOKENS = 2048
+MAX_COMPLETION_TOKENS = 16384  # limite di output dei modelli OpenAI correnti
+
+# Espressioni regolari usate nella suddivisione in blocchi
+# Linee vuote multiple e spazi ripetuti, normalizzati in un solo passaggio
+_RE_WHITESPACE = re.compile(r'\n\s*\n| +')
+_RE_PARAGRAPHS = re.compile(r'\n\n+')
+_RE_SENTENCE_END = re.compile(r'[.!?]')
+
+# Elementi HTML di navigazione, pubblicità, ecc. rimossi prima dell'estrazione del testo
+STRIP_TAGS = ['script', 'style', 'nav', 'header', 'footer', 'aside']
+STRIP_CLASSES = ['ads', 'ad', 'advertisement', 'menu']
+STRIP_CLASSES_EXTENDED = STRIP_CLASSES + ['popup', 'cookie']
+
+# Percorso veloce senza albero DOM: elimina con le regex i blocchi da scartare e i tag
+_RE_STRIP_BLOCKS = re.compile(r'<(' + '|'.join(STRIP_TAGS) + r')\b[^>]*>.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_RE_LEFTOVER_STRIP_TAGS = re.compile(r'</?(?:' + '|'.join(STRIP_TAGS) + r')\b', re.IGNORECASE)
+_RE_HTML_MARKER = re.compile(r'<(?:html|body)', re.IGNORECASE)
+_RE_COMMENTS = re.compile(r'<!--.*?-->', re.DOTALL)
+_RE_BODY = re.compile(r'<body\b[^>]*>(.*)</body\s*>', re.IGNORECASE | re.DOTALL)
+_RE_TAGS = re.compile(r'<[^>]+>')
+
+def _class_pattern(classes: List[str]) -> re.Pattern:
+    # Riconosce un attributo class che contiene una delle classi indicate
+    return re.compile(r'class\s*=\s*["\']?[^"\'>]*\b(?:' + '|'.join(map(re.escape, classes)) + r')\b', re.IGNORECASE)
+
+_RE_STRIP_CLASSES = _class_pattern(STRIP_CLASSES)
+_RE_STRIP_CLASSES_EXTENDED = _class_pattern(STRIP_CLASSES_EXTENDED)
+
+# Dimensione massima (in caratteri) dei blocchi puliti memorizzati tra una pagina e l'altra
+CLEANED_BLOCKS_CACHE_MAX_CHARS = 16 * 1024 * 1024
+
+# Blocchi già puliti, indicizzati per modello, query e contenuto del blocco:
+# il boilerplate ripetuto tra pagine dello stesso sito viene pulito una volta sola
+_cleaned_blocks = LRUCache(maxsize=CLEANED_BLOCKS_CACHE_MAX_CHARS, getsizeof=len)
+_cleaned_blocks_lock = threading.Lock()
+
+# Riprova le chiamate quando OpenAI segnala il superamento dei limiti di rate (429),
+# con attesa esponenziale e jitter: il ritmo è dettato dalle risposte del server
+_retry_on_rate_limit = retry(
+    retry=retry_if_exception_type(openai.RateLimitError),
+    wait=wait_random_exponential(min=1, max=30),
+    stop=stop_after_attempt(6),
+    reraise=True
+)
+
+# Più blocchi vengono inviati nella stessa richiesta fino a questo numero di token,
+# così il prompt di sistema è pagato una volta sola per gruppo
+PACK_MAX_TOKENS = 6000
+
+PACKED_INSTRUCTIONS = """Il testo è diviso in blocchi delimitati da <<<BLOCCO n>>> e <<<FINE n>>>.
+Ripulisci ogni blocco separatamente e rispondi con un oggetto JSON che associa il numero
+di ciascun blocco al suo testo ripulito, ad esempio {"0": "...", "1": "..."}."""
+
+# Batch API: sotto questa soglia di blocchi si usano chiamate dirette
+BATCH_API_MIN_SIZE = 16
+BATCH_POLL_INTERVAL = 30  # secondi tra un controllo e l'altro dello stato del batch
+
+# Prompt di sistema fisso, identico per tutti i blocchi
+CLEAN_SYSTEM_PROMPT = """
+            Sei un'IA specializzata nel ripulire il testo estratto da pagine web.
+            Il tuo compito è rimuovere elementi non informativi come:
+            - Menu di navigazione
+            - Link non pertinenti
+            - Elementi di interfaccia
+            - Testo ripetitivo di intestazioni/piè di pagina
+            - Pubblicità
+            - Cookie banner
+            - Notifiche
+            
+            Mantieni SOLO il contenuto informativo principale, come:
+            - Paragrafi del corpo del testo
+            - Intestazioni pertinenti all'argomento
+            - Elementi informativi come elenchi e citazioni
+            
+            Restituisci il testo pulito in formato semplice, mantenendo la struttura a paragrafi.
+            NON aggiungere commenti o spiegazioni aggiuntive.
+            """
+
+def _suffix_prefix_overlap(text: str, pattern: str) -> int:
+    """
+    Calcola la lunghezza del più lungo prefisso di pattern che è anche suffisso di text,
+    in tempo lineare con la funzione di fallimento di Knuth-Morris-Pratt.
+    
+    Args:
+        text (str): Testo di cui considerare i suffissi
+        pattern (str): Testo di cui considerare i prefissi
+        
+    Returns:
+        int: Lunghezza della sovrapposizione (0 se assente)
+    """
+    # Funzione di fallimento del pattern
+    failure = [0] * len(pattern)
+    k = 0
+    for i in range(1, len(pattern)):
+        while k and pattern[i] != pattern[k]:
+            k = failure[k - 1]
+        if pattern[i] == pattern[k]:
+            k += 1
+        failure[i] = k
+    
+    # Scorre il testo mantenendo la lunghezza del prefisso del pattern riconosciuto
+    k = 0
+    for char in text:
+        while k and (k == len(pattern) or char != pattern[k]):
+            k = failure[k - 1]
+        if k < len(pattern) and char == pattern[k]:
+            k += 1
+    return k
+
+@functools.lru_cache(maxsize=32)
+def _prompt_parts(search_query: str = None) -> tuple:
+    """
+    Costruisce il prompt di sistema e l'inizio del messaggio utente per una query.
+    Il risultato è memorizzato, così tutti i blocchi di una pagina condividono le stesse
+    stringhe; la parte che dipende dalla query segue sempre il prompt fisso, in modo che
+    le richieste abbiano il prefisso più lungo possibile in comune (prefix caching di OpenAI).
+    
+    Args:
+        search_query (str, optional): Query di ricerca o task per cui si sta pulendo il testo
+        
+    Returns:
+        tuple: (messaggio di sistema, prefisso del messaggio utente)
+    """
+    system_message = CLEAN_SYSTEM_PROMPT
+    user_message = f"Ecco il testo da ripulire, mantenendo solo il contenuto informativo"
+    
+    # Se è presente una query di ricerca, include istruzioni specifiche per filtrare in base a essa
+    if search_query:
+        system_message += f"""
+                Inoltre, considera che sto cercando informazioni su: "{search_query}"
+                Concentrati particolarmente sul contenuto rilevante per questa ricerca.
+                Mantieni prioritariamente i paragrafi e le sezioni che si riferiscono a questo argomento.
+                Se ci sono sezioni che sembrano completamente irrilevanti per la ricerca, puoi rimuoverle.
+                """
+        user_message += f", con particolare attenzione alle informazioni relative a: {search_query}"
+    
+    return system_message, user_message + ":\n\n"
+
+def _fast_html_to_text(html_content: str, class_pattern: re.Pattern, body_only: bool) -> Optional[str]:
+    """
+    Estrae il testo da una pagina HTML con le sole espressioni regolari, senza costruire
+    l'albero DOM. Restituisce None quando il risultato non sarebbe equivalente a quello
+    di BeautifulSoup: elementi con classi da rimuovere (non gestibili con le regex) o
+    tag da scartare annidati/malformati, che lasciano aperture o chiusure orfane.
+    
+    Args:
+        html_content (str): Contenuto HTML della pagina
+        class_pattern (re.Pattern): Attributi class che richiedono l'uso di BeautifulSoup
+        body_only (bool): Se True, considera solo il contenuto del body quando presente
+        
+    Returns:
+        Optional[str]: Testo estratto, una riga per nodo di testo, oppure None
+    """
+    if class_pattern.search(html_content):
+        return None
+    
+    text = _RE_COMMENTS.sub(' ', html_content)
+    if body_only:
+        body = _RE_BODY.search(text)
+        if body:
+            text = body.group(1)
+    
+    text = _RE_STRIP_BLOCKS.sub(' ', text)
+    if _RE_LEFTOVER_STRIP_TAGS.search(text):
+        return None
+    
+    text = html.unescape(_RE_TAGS.sub('\n', text))
+    return '\n'.join(line for line in map(str.strip, text.split('\n')) if line)
+
+@functools.lru_cache(maxsize=8)
+def _encoding(model: str) -> 'tiktoken.Encoding':
+    """
+    Restituisce il tokenizer del modello, o quello dei modelli recenti se il nome non è noto.
+    
+    Args:
+        model (str): Nome del modello OpenAI
+        
+    Returns:
+        tiktoken.Encoding: Tokenizer da usare per contare i token
+    """
+    import tiktoken
+    
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def _parse_html(content: str) -> 'BeautifulSoup':
+    """
+    Costruisce l'albero HTML con il parser lxml (in C), ripiegando sul parser
+    html.parser della libreria standard se lxml non è disponibile o fallisce.
+    
+    Args:
+        content (str): Contenuto HTML della pagina
+        
+    Returns:
+        BeautifulSoup: Documento HTML analizzato
+    """
+    from bs4 import BeautifulSoup
+    
+    try:
+        return BeautifulSoup(content, 'lxml')
+    except Exception as e:
+        logger.debug(f"Parser lxml non utilizzabile, uso html.parser: {e}")
+        return BeautifulSoup(content, 'html.parser')
+
+def _normalize_whitespace(match: re.Match) -> str:
+    return '\n\n' if match.group()[0] == '\n' else ' '
+
+def _strip_elements(soup: 'BeautifulSoup', classes: List[str]) -> None:
+    """
+    Rimuove dall'albero HTML i tag di STRIP_TAGS e gli elementi con una delle classi indicate.
+    Usa find_all invece dei selettori CSS per evitarne il parsing a ogni chiamata.
+    
+    Args:
+        soup (BeautifulSoup): Documento HTML da modificare
+        classes (List[str]): Classi CSS degli elementi da rimuovere
+    """
+    for element in soup.find_all(STRIP_TAGS):
+        element.extract()
+    for element in soup.find_all(class_=classes):
+        element.extract()
 
 class ContentCleaner:
     """
     Agente per pulire il contenuto di una pagina web dividendolo in blocchi
-    e processandolo con OpenAI in modalità multithread.
+    e processandolo con OpenAI tramite richieste asincrone concorrenti.
     """
     
-    def __init__(self, max_threads=DEFAULT_MAX_THREADS, model=OPENAI_MODEL):
+    def __init__(self, max_threads=DEFAULT_MAX_THREADS, model=OPENAI_MODEL, use_batch_api=False,
+                 pack_max_tokens=PACK_MAX_TOKENS, block_tokens=DEFAULT_BLOCK_TOKENS):
         """
         Inizializza il pulitore di contenuti.
         
         Args:
-            max_threads (int): Numero massimo di thread paralleli
+            max_threads (int): Numero massimo di richieste concorrenti verso OpenAI
             model (str): Modello OpenAI da utilizzare
+            use_batch_api (bool): Se True, i contenuti con molti blocchi vengono puliti
+                                  con un unico job della Batch API (più economico ma
+                                  con tempi di completamento non interattivi)
+            pack_max_tokens (int): Token massimi dei blocchi raggruppati in una sola
+                                   richiesta (0 per inviare ogni blocco separatamente)
+            block_tokens (int): Dimensione dei blocchi in token; se 0 o None i blocchi
+                                sono misurati in caratteri con block_size
         """
         self.max_threads = max_threads
         self.model = model
+        self.use_batch_api = use_batch_api
+        self.pack_max_tokens = pack_max_tokens
+        self.block_tokens = block_tokens
         
-    def clean_content(self, content: str, block_size=DEFAULT_BLOCK_SIZE, overlap=DEFAULT_OVERLAP, search_query: str = None) -> str:
+        # Il testo pulito può essere lungo quanto il blocco: il budget di output ne tiene conto
+        self.completion_tokens = min(MAX_COMPLETION_TOKENS, max(MIN_COMPLETION_TOKENS, block_tokens or 0))
+        
+    def clean_content(self, content: str, block_size=DEFAULT_BLOCK_SIZE, overlap=DEFAULT_OVERLAP, search_query: str = None,
+                      already_html_cleaned: bool = False) -> str:
         """
         Pulisce il contenuto di una pagina web rimuovendo menu, pubblicità, ecc.
         
@@ -56,12 +304,13 @@ class ContentCleaner:
             block_size (int): Dimensione massima (in caratteri) di ciascun blocco
             overlap (int): Sovrapposizione tra blocchi consecutivi
             search_query (str, optional): Query di ricerca o task per cui si sta pulendo il testo
+            already_html_cleaned (bool): Se True, il contenuto è già testo estratto dall'HTML
             
         Returns:
             str: Contenuto pulito con solo le parti informative
         """
         # Se il contenuto sembra essere HTML, lo pre-elabora con BeautifulSoup
-        if '<html' in content.lower() or '<body' in content.lower():
+        if not already_html_cleaned and _RE_HTML_MARKER.search(content):
             logger.info("Il contenuto sembra essere HTML, eseguendo pre-elaborazione.")
             content = self._preprocess_html(content)
         
@@ -88,11 +337,14 @@ class ContentCleaner:
             str: Testo estratto dalla pagina HTML
         """
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
+            text = _fast_html_to_text(html_content, _RE_STRIP_CLASSES, body_only=True)
+            if text is not None:
+                return text
+            
+            soup = _parse_html(html_content)
             
             # Rimuove elementi tipici di navigazione, pubblicità, ecc.
-            for element in soup.select('script, style, nav, header, footer, aside, .ads, .ad, .advertisement, .menu'):
-                element.extract()
+            _strip_elements(soup, STRIP_CLASSES)
             
             # Estrai solo il testo dal body
             if soup.body:
@@ -108,6 +360,8 @@ class ContentCleaner:
     def _split_into_blocks(self, content: str, block_size: int, overlap: int) -> List[str]:
         """
         Divide il contenuto in blocchi di testo sovrapposti con una strategia migliorata.
+        Se block_tokens è impostato i blocchi sono misurati in token del modello,
+        altrimenti in caratteri.
         
         Args:
             content (str): Contenuto testuale della pagina
@@ -121,45 +375,96 @@ class ContentCleaner:
             return []
         
         # Rimuove linee vuote multiple e spazi extra
-        content = re.sub(r'\n\s*\n', '\n\n', content)
-        content = re.sub(r' +', ' ', content)
+        content = _RE_WHITESPACE.sub(_normalize_whitespace, content)
         
         # Verifica se il contenuto è abbastanza corto da essere gestito in un unico blocco
+        # (controllo sui caratteri, che evita il tokenizer per i contenuti piccoli)
         if len(content) <= block_size * 1.5:
             logger.info("Contenuto breve, elaborato come blocco unico")
             return [content]
         
-        # Dividi il contenuto in paragrafi
-        paragraphs = re.split(r'\n\n+', content)
+        if self.block_tokens:
+            encoding = _encoding(self.model)
+            measure = lambda text: len(encoding.encode(text, disallowed_special=()))
+            limit = self.block_tokens
+            if measure(content) <= limit * 1.5:
+                logger.info("Contenuto breve, elaborato come blocco unico")
+                return [content]
+        else:
+            measure = len
+            limit = block_size
+        
+        # Dividi il contenuto in paragrafi, come intervalli di offset: dopo la
+        # normalizzazione i paragrafi sono separati esattamente da "\n\n", quindi un
+        # blocco di paragrafi consecutivi è una sola slice del contenuto
+        paragraph_spans = []
+        position = 0
+        for separator in _RE_PARAGRAPHS.finditer(content):
+            paragraph_spans.append((position, separator.start()))
+            position = separator.end()
+        paragraph_spans.append((position, len(content)))
         
-        # Strategia migliorata: raggruppa i paragrafi in blocchi più grandi
+        # Strategia migliorata: raggruppa i paragrafi in blocchi più grandi.
+        # Il blocco corrente è overlap_text + content[block_start:block_end] e viene
+        # costruito solo quando è completo
         blocks = []
-        current_block = ""
+        overlap_text = ""
+        block_start = block_end = 0
+        current_size = 0
+        separator_size = measure("\n\n")
         
-        for para in paragraphs:
-            # Se aggiungere il paragrafo supererebbe block_size, inizia un nuovo blocco
-            if len(current_block) + len(para) > block_size and current_block:
+        for start, end in paragraph_spans:
+            para_size = measure(content[start:end]) if self.block_tokens else end - start
+            has_content = bool(overlap_text) or block_end > block_start
+            
+            # Se aggiungere il paragrafo supererebbe il limite, inizia un nuovo blocco
+            if current_size + para_size > limit and has_content:
+                current_block = overlap_text + content[block_start:block_end]
                 blocks.append(current_block.strip())
                 # Mantieni parte della sovrapposizione se necessario
-                last_sentences = re.findall(r'[^.!?]*[.!?]', current_block)
-                overlap_text = "".join(last_sentences[-2:]) if len(last_sentences) >= 2 else ""
-                current_block = overlap_text + para
+                # (le ultime due frasi vanno dalla fine della terzultima a quella dell'ultima)
+                sentence_ends = [m.end() for m in _RE_SENTENCE_END.finditer(current_block)]
+                if len(sentence_ends) >= 2:
+                    overlap_start = sentence_ends[-3] if len(sentence_ends) >= 3 else 0
+                    overlap_text = current_block[overlap_start:sentence_ends[-1]]
+                else:
+                    overlap_text = ""
+                block_start, block_end = start, end
+                current_size = measure(overlap_text) + para_size
             else:
-                if current_block:
-                    current_block += "\n\n" + para
+                if has_content:
+                    current_size += separator_size
                 else:
-                    current_block = para
+                    block_start = start
+                block_end = end
+                current_size += para_size
         
         # Aggiungi l'ultimo blocco se non è vuoto
+        current_block = overlap_text + content[block_start:block_end]
         if current_block.strip():
             blocks.append(current_block.strip())
         
-        logger.info(f"Contenuto diviso in {len(blocks)} blocchi (invece di potenzialmente {len(content) // block_size + 1})")
+        logger.info(f"Contenuto diviso in {len(blocks)} blocchi")
         return blocks
     
+    def _block_key(self, block: str, search_query: str = None) -> bytes:
+        """
+        Calcola la chiave di un blocco per la deduplicazione: il risultato della pulizia
+        dipende dal modello, dalla query e dal testo del blocco.
+        
+        Args:
+            block (str): Blocco di testo
+            search_query (str, optional): Query di ricerca o task per cui si sta pulendo il testo
+            
+        Returns:
+            bytes: Digest BLAKE3 della chiave
+        """
+        return blake3(f"{self.model}\0{search_query or ''}\0{block}".encode()).digest()
+    
     def _clean_blocks_parallel(self, text_blocks: List[str], search_query: str = None) -> List[str]:
         """
-        Pulisce i blocchi di testo in parallelo usando OpenAI.
+        Pulisce i blocchi di testo in parallelo usando OpenAI. I blocchi identici vengono
+        inviati una sola volta e quelli già puliti in precedenza sono letti dalla cache.
         
         Args:
             text_blocks (List[str]): Lista di blocchi di testo da pulire
@@ -168,42 +473,200 @@ class ContentCleaner:
         Returns:
             List[str]: Lista di blocchi di testo puliti
         """
-        clean_blocks = []
-        
         # Se non ci sono blocchi da elaborare
         if not text_blocks:
-            return clean_blocks
+            return []
+        
+        keys = [self._block_key(block, search_query) for block in text_blocks]
+        with _cleaned_blocks_lock:
+            cleaned = {key: _cleaned_blocks[key] for key in keys if key in _cleaned_blocks}
+        
+        pending = {}
+        for key, block in zip(keys, text_blocks):
+            if key not in cleaned:
+                pending.setdefault(key, block)
+        
+        if len(pending) < len(text_blocks):
+            logger.info(f"{len(text_blocks) - len(pending)} blocchi duplicati o già puliti non verranno inviati")
+        
+        if pending:
+            results = self._clean_unique_blocks(list(pending.values()), search_query)
+            with _cleaned_blocks_lock:
+                for (key, block), clean_text in zip(pending.items(), results):
+                    cleaned[key] = clean_text
+                    # In caso di errore il blocco torna invariato: non lo memorizza
+                    if clean_text != block and len(clean_text) <= CLEANED_BLOCKS_CACHE_MAX_CHARS:
+                        _cleaned_blocks[key] = clean_text
+        
+        return [cleaned[key] for key in keys]
+    
+    def _clean_unique_blocks(self, text_blocks: List[str], search_query: str = None) -> List[str]:
+        """
+        Invia a OpenAI i blocchi da pulire, con la Batch API se abilitata oppure con
+        chiamate parallele.
+        
+        Args:
+            text_blocks (List[str]): Lista di blocchi di testo da pulire
+            search_query (str, optional): Query di ricerca o task per cui si sta pulendo il testo
             
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_threads) as executor:
-            # Sottomette tutti i blocchi per l'elaborazione
-            future_to_index = {
-                executor.submit(self._clean_text_block, block, i, search_query): i 
-                for i, block in enumerate(text_blocks)
-            }
+        Returns:
+            List[str]: Lista di blocchi di testo puliti, nello stesso ordine
+        """
+        if self.use_batch_api and len(text_blocks) >= BATCH_API_MIN_SIZE:
+            return self._clean_blocks_batch(text_blocks, search_query)
+        
+        return asyncio.run(self._clean_blocks_async(text_blocks, search_query))
+    
+    async def _clean_blocks_async(self, text_blocks: List[str], search_query: str = None) -> List[str]:
+        """
+        Pulisce i blocchi con richieste asincrone concorrenti, limitate a max_threads.
+        
+        Args:
+            text_blocks (List[str]): Lista di blocchi di testo da pulire
+            search_query (str, optional): Query di ricerca o task per cui si sta pulendo il testo
+            
+        Returns:
+            List[str]: Lista di blocchi di testo puliti, nello stesso ordine
+        """
+        semaphore = asyncio.Semaphore(self.max_threads)
+        groups = self._pack_blocks(text_blocks)
+        
+        # Il client asincrono è legato all'event loop: ne viene creato uno per esecuzione
+        async with create_async_client(self.max_threads) as aclient:
+            results = await asyncio.gather(*[
+                self._clean_packed_async(aclient, group, text_blocks, search_query, semaphore)
+                for group in groups
+            ])
+        
+        clean_blocks = [""] * len(text_blocks)
+        for group_result in results:
+            for i, clean_text in group_result.items():
+                clean_blocks[i] = clean_text
+        
+        logger.info(f"Elaborazione: {len(text_blocks)}/{len(text_blocks)} blocchi completati in {len(groups)} richieste")
+        return clean_blocks
+    
+    def _pack_blocks(self, text_blocks: List[str]) -> List[List[int]]:
+        """
+        Raggruppa in modo greedy i blocchi consecutivi finché la somma dei loro token
+        non supera pack_max_tokens. I blocchi vuoti sono esclusi.
+        
+        Args:
+            text_blocks (List[str]): Lista di blocchi di testo da pulire
+            
+        Returns:
+            List[List[int]]: Indici dei blocchi di ciascun gruppo
+        """
+        indices = [i for i, block in enumerate(text_blocks) if block.strip()]
+        if self.pack_max_tokens <= 0 or len(indices) < 2:
+            return [[i] for i in indices]
+        
+        encoding = _encoding(self.model)
+        groups = []
+        current, current_tokens = [], 0
+        for i in indices:
+            tokens = len(encoding.encode(text_blocks[i], disallowed_special=()))
+            if current and current_tokens + tokens > self.pack_max_tokens:
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            groups.append(current)
+        
+        return groups
+    
+    async def _clean_packed_async(self, aclient: openai.AsyncOpenAI, group: List[int], text_blocks: List[str],
+                                  search_query: str, semaphore: asyncio.Semaphore) -> Dict[int, str]:
+        """
+        Pulisce un gruppo di blocchi con una sola richiesta che restituisce un oggetto JSON.
+        I blocchi mancanti o non interpretabili nella risposta vengono puliti singolarmente.
+        
+        Args:
+            aclient (openai.AsyncOpenAI): Client asincrono condiviso dai blocchi della pagina
+            group (List[int]): Indici dei blocchi del gruppo
+            text_blocks (List[str]): Lista di tutti i blocchi di testo
+            search_query (str): Query di ricerca o task per cui si sta pulendo il testo
+            semaphore (asyncio.Semaphore): Limite alle richieste concorrenti
+            
+        Returns:
+            Dict[int, str]: Testo pulito di ciascun blocco del gruppo, per indice
+        """
+        cleaned = {}
+        if len(group) > 1:
+            try:
+                async with semaphore:
+                    response = await self._acomplete(aclient, self._packed_request(group, text_blocks, search_query))
+                packed = json.loads(response.choices[0].message.content)
+                for i in group:
+                    clean_text = packed.get(str(i))
+                    if isinstance(clean_text, str):
+                        cleaned[i] = clean_text.strip()
+            except Exception as e:
+                logger.error(f"Errore durante la pulizia del gruppo di blocchi {group}: {e}")
+        
+        missing = [i for i in group if i not in cleaned]
+        if missing:
+            results = await asyncio.gather(*[
+                self._clean_text_block_async(aclient, text_blocks[i], i, search_query, semaphore)
+                for i in missing
+            ])
+            cleaned.update(zip(missing, results))
+        
+        return cleaned
+    
+    def _packed_request(self, group: List[int], text_blocks: List[str], search_query: str = None) -> Dict[str, Any]:
+        """
+        Costruisce i parametri della richiesta che pulisce più blocchi insieme.
+        
+        Args:
+            group (List[int]): Indici dei blocchi da includere
+            text_blocks (List[str]): Lista di tutti i blocchi di testo
+            search_query (str, optional): Query di ricerca o task per cui si sta pulendo il testo
             
-            # Elabora i risultati man mano che diventano disponibili
-            completed = 0
-            total = len(text_blocks)
+        Returns:
+            Dict[str, Any]: Parametri per chat.completions.create
+        """
+        system_message, user_prefix = _prompt_parts(search_query)
+        packed_text = "\n\n".join([f"<<<BLOCCO {i}>>>\n{text_blocks[i]}\n<<<FINE {i}>>>" for i in group])
+        
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": PACKED_INSTRUCTIONS + "\n\n" + user_prefix + packed_text}
+            ],
+            "temperature": 0.3,
+            "response_format": {"type": "json_object"},
+            "max_tokens": min(MAX_COMPLETION_TOKENS, self.completion_tokens * len(group))
+        }
+    
+    async def _clean_text_block_async(self, aclient: openai.AsyncOpenAI, text: str, block_index: int,
+                                      search_query: str, semaphore: asyncio.Semaphore) -> str:
+        """
+        Pulisce un singolo blocco di testo con il client asincrono di OpenAI.
+        
+        Args:
+            aclient (openai.AsyncOpenAI): Client asincrono condiviso dai blocchi della pagina
+            text (str): Blocco di testo da pulire
+            block_index (int): Indice del blocco (per il logging)
+            search_query (str): Query di ricerca o task per cui si sta pulendo il testo
+            semaphore (asyncio.Semaphore): Limite alle richieste concorrenti
             
-            for future in concurrent.futures.as_completed(future_to_index):
-                try:
-                    index = future_to_index[future]
-                    clean_text = future.result()
-                    completed += 1
-                    
-                    # Aggiorna lo stato di avanzamento
-                    if completed % 5 == 0 or completed == total:
-                        logger.info(f"Elaborazione: {completed}/{total} blocchi completati")
-                    
-                    # Mantieni l'ordine originale dei blocchi
-                    clean_blocks.append((index, clean_text))
-                    
-                except Exception as e:
-                    logger.error(f"Errore durante la pulizia di un blocco: {e}")
-        
-        # Riordina i blocchi puliti in base all'indice originale
-        clean_blocks.sort(key=lambda x: x[0])
-        return [block for _, block in clean_blocks]
+        Returns:
+            str: Blocco di testo pulito
+        """
+        if not text.strip():
+            return ""
+        
+        try:
+            async with semaphore:
+                response = await self._acomplete(aclient, self._completion_request(text, search_query))
+            return response.choices[0].message.content.strip()
+        except Exception as e:
+            logger.error(f"Errore durante la pulizia del blocco {block_index}: {e}")
+            # In caso di errore, restituisci il testo originale
+            return text
     
     def _clean_text_block(self, text: str, block_index: int, search_query: str = None) -> str:
         """
@@ -221,62 +684,108 @@ class ContentCleaner:
             return ""
             
         try:
-            system_message = """
-            Sei un'IA specializzata nel ripulire il testo estratto da pagine web.
-            Il tuo compito è rimuovere elementi non informativi come:
-            - Menu di navigazione
-            - Link non pertinenti
-            - Elementi di interfaccia
-            - Testo ripetitivo di intestazioni/piè di pagina
-            - Pubblicità
-            - Cookie banner
-            - Notifiche
-            
-            Mantieni SOLO il contenuto informativo principale, come:
-            - Paragrafi del corpo del testo
-            - Intestazioni pertinenti all'argomento
-            - Elementi informativi come elenchi e citazioni
-            
-            Restituisci il testo pulito in formato semplice, mantenendo la struttura a paragrafi.
-            NON aggiungere commenti o spiegazioni aggiuntive.
-            """
+            # Usa l'API di OpenAI per pulire il testo
+            response = self._complete(self._completion_request(text, search_query))
             
-            user_message = f"Ecco il testo da ripulire, mantenendo solo il contenuto informativo"
+            return response.choices[0].message.content.strip()
             
-            # Se è presente una query di ricerca, include istruzioni specifiche per filtrare in base a essa
-            if search_query:
-                system_message += f"""
-                Inoltre, considera che sto cercando informazioni su: "{search_query}"
-                Concentrati particolarmente sul contenuto rilevante per questa ricerca.
-                Mantieni prioritariamente i paragrafi e le sezioni che si riferiscono a questo argomento.
-                Se ci sono sezioni che sembrano completamente irrilevanti per la ricerca, puoi rimuoverle.
-                """
-                user_message += f", con particolare attenzione alle informazioni relative a: {search_query}"
+        except Exception as e:
+            logger.error(f"Errore durante la pulizia del blocco {block_index}: {e}")
+            # In caso di errore, restituisci il testo originale
+            return text
+    
+    @_retry_on_rate_limit
+    def _complete(self, request: Dict[str, Any]):
+        """Esegue una richiesta di completamento, riprovando in caso di errore 429."""
+        return client.chat.completions.create(**request)
+    
+    @_retry_on_rate_limit
+    async def _acomplete(self, aclient: openai.AsyncOpenAI, request: Dict[str, Any]):
+        """Versione asincrona di _complete."""
+        return await aclient.chat.completions.create(**request)
+    
+    def _completion_request(self, text: str, search_query: str = None) -> Dict[str, Any]:
+        """
+        Costruisce i parametri della richiesta di pulizia per un blocco di testo.
+        
+        Args:
+            text (str): Blocco di testo da pulire
+            search_query (str, optional): Query di ricerca o task per cui si sta pulendo il testo
             
-            user_message += f":\n\n{text}"
+        Returns:
+            Dict[str, Any]: Parametri per chat.completions.create
+        """
+        system_message, user_prefix = _prompt_parts(search_query)
+        
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": user_prefix + text}
+            ],
+            "temperature": 0.3,
+            "max_tokens": self.completion_tokens
+        }
+    
+    def _clean_blocks_batch(self, text_blocks: List[str], search_query: str = None,
+                            poll_interval: int = BATCH_POLL_INTERVAL) -> List[str]:
+        """
+        Pulisce tutti i blocchi con un unico job della Batch API di OpenAI.
+        I blocchi che falliscono all'interno del batch vengono ripuliti singolarmente.
+        
+        Args:
+            text_blocks (List[str]): Lista di blocchi di testo da pulire
+            search_query (str, optional): Query di ricerca o task per cui si sta pulendo il testo
+            poll_interval (int): Secondi tra un controllo e l'altro dello stato del batch
             
-            # Usa l'API di OpenAI per pulire il testo
-            response = openai.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.3,
-                max_tokens=2048
+        Returns:
+            List[str]: Lista di blocchi di testo puliti, nello stesso ordine
+        """
+        jsonl = io.BytesIO()
+        for i, block in enumerate(text_blocks):
+            if not block.strip():
+                continue
+            request = {
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self._completion_request(block, search_query)
+            }
+            jsonl.write(json.dumps(request, ensure_ascii=False).encode('utf-8') + b"\n")
+        
+        try:
+            batch_file = client.files.create(file=("clean_batch.jsonl", jsonl.getvalue()), purpose="batch")
+            batch = client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
             )
+            logger.info(f"Batch {batch.id} inviato con {len(text_blocks)} blocchi")
             
-            clean_text = response.choices[0].message.content.strip()
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                time.sleep(poll_interval)
+                batch = client.batches.retrieve(batch.id)
             
-            # Piccolo ritardo per evitare di raggiungere i limiti di rate dell'API
-            time.sleep(0.5)
-            
-            return clean_text
+            if batch.status != "completed" or not batch.output_file_id:
+                raise RuntimeError(f"Batch {batch.id} terminato con stato {batch.status}")
             
+            # Ricompone le risposte in base al custom_id
+            cleaned = {}
+            for line in client.files.content(batch.output_file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                if response.get("status_code") == 200:
+                    cleaned[int(item["custom_id"])] = response["body"]["choices"][0]["message"]["content"].strip()
         except Exception as e:
-            logger.error(f"Errore durante la pulizia del blocco {block_index}: {e}")
-            # In caso di errore, restituisci il testo originale
-            return text
+            logger.error(f"Errore durante la pulizia dei blocchi con la Batch API: {e}")
+            cleaned = {}
+        
+        return [
+            cleaned[i] if i in cleaned else self._clean_text_block(block, i, search_query)
+            for i, block in enumerate(text_blocks)
+        ]
     
     def _reassemble_blocks(self, clean_blocks: List[str]) -> str:
         """
@@ -305,19 +814,13 @@ class ContentCleaner:
                 prev_end = assembled_text[-overlap_size:]
                 curr_start = current_block[:overlap_size]
                 
-                # Cerca la più lunga sottostringa comune
-                max_overlap = 0
-                best_pos = 0
-                
-                for j in range(1, overlap_size):
-                    if prev_end[-j:] == curr_start[:j]:
-                        if j > max_overlap:
-                            max_overlap = j
-                            best_pos = j
+                # Cerca il più lungo suffisso del testo precedente che è anche
+                # prefisso del blocco corrente (al massimo overlap_size - 1 caratteri)
+                max_overlap = _suffix_prefix_overlap(prev_end, curr_start[:overlap_size - 1])
                 
                 # Se c'è una sovrapposizione significativa, unisci i blocchi
                 if max_overlap > 10:  # Sovrapposizione minima per essere significativa
-                    assembled_text = assembled_text[:-best_pos] + current_block
+                    assembled_text = assembled_text[:-max_overlap] + current_block
                 else:
                     # Altrimenti, aggiungi un separatore di paragrafo
                     assembled_text += "\n\n" + current_block
@@ -327,45 +830,73 @@ class ContentCleaner:
         return assembled_text
 
 # Funzione di utilità per uso esterno
-def clean_webpage_content(content: str, max_threads=DEFAULT_MAX_THREADS, block_size=DEFAULT_BLOCK_SIZE, overlap=DEFAULT_OVERLAP, search_query: str = None) -> str:
+def html_to_text(content: str) -> str:
+    """
+    Pre-pulizia di una pagina HTML, senza chiamate al modello: rimuove gli elementi non
+    necessari e ne estrae il testo. È la parte di clean_webpage_content che impegna la CPU
+    e, non usando stato condiviso, può essere eseguita in un processo separato.
+    
+    Args:
+        content (str): Contenuto HTML o testo della pagina
+        
+    Returns:
+        str: Testo della pagina (il contenuto invariato se non è HTML)
+    """
+    # La regex si ferma alla prima occorrenza, senza creare una copia in minuscolo
+    if not _RE_HTML_MARKER.search(content):
+        return content
+    
+    text = _fast_html_to_text(content, _RE_STRIP_CLASSES_EXTENDED, body_only=False)
+    if text is not None:
+        return text
+    
+    soup = _parse_html(content)
+    
+    # Rimuovi elementi non necessari
+    _strip_elements(soup, STRIP_CLASSES_EXTENDED)
+    
+    # Estrai il testo principale
+    return soup.get_text(separator='\n', strip=True)
+
+def clean_webpage_content(content: str, max_threads=DEFAULT_MAX_THREADS, block_size=DEFAULT_BLOCK_SIZE, overlap=DEFAULT_OVERLAP, search_query: str = None, use_batch_api: bool = False) -> str:
     """
     Funzione di utilità per pulire il contenuto di una pagina web.
     
     Args:
         content (str): Contenuto HTML o testo della pagina
-        max_threads (int, optional): Numero massimo di thread paralleli
+        max_threads (int, optional): Numero massimo di richieste concorrenti verso OpenAI
         block_size (int, optional): Dimensione massima (in caratteri) di ciascun blocco
         overlap (int, optional): Sovrapposizione tra blocchi consecutivi
         search_query (str, optional): Query di ricerca o task per cui si sta pulendo il testo
+        use_batch_api (bool, optional): Se True, usa la Batch API di OpenAI per i contenuti con molti blocchi
         
     Returns:
         str: Contenuto pulito con solo le parti informative
     """
-    # Pre-pulizia con BeautifulSoup per ridurre la dimensione del contenuto
-    if '<html' in content.lower() or '<body' in content.lower():
-        soup = BeautifulSoup(content, 'html.parser')
-        
-        # Rimuovi elementi non necessari
-        for elem in soup.select('script, style, nav, header, footer, aside, .ads, .ad, .advertisement, .menu, .popup, .cookie'):
-            elem.extract()
-        
-        # Estrai il testo principale
-        content = soup.get_text(separator='\n', strip=True)
+    # Pre-pulizia dell'HTML per ridurre la dimensione del contenuto
+    content = html_to_text(content)
     
     # Se il contenuto è piccolo, elaboralo direttamente senza suddividerlo
     if len(content) < block_size * 2:
-        cleaner = ContentCleaner(max_threads=1)  # Un solo thread è sufficiente
-        return cleaner.clean_content(content, block_size=len(content), overlap=0, search_query=search_query)
+        cleaner = ContentCleaner(max_threads=1)  # Una sola richiesta alla volta è sufficiente
+        return cleaner.clean_content(content, block_size=len(content), overlap=0, search_query=search_query,
+                                     already_html_cleaned=True)
     
     # Altrimenti usa la versione ottimizzata con più blocchi
-    cleaner = ContentCleaner(max_threads=max_threads)
-    return cleaner.clean_content(content, block_size=block_size, overlap=overlap, search_query=search_query)
+    cleaner = ContentCleaner(max_threads=max_threads, use_batch_api=use_batch_api)
+    return cleaner.clean_content(content, block_size=block_size, overlap=overlap, search_query=search_query,
+                                 already_html_cleaned=True)
 
 # Test del cleaner
 if __name__ == "__main__":
     import sys
     from web_scraper import scrape_webpage
     
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
     if len(sys.argv) > 1:
         url = sys.argv[1]
         print(f"Scaricamento e pulizia del contenuto di: {url}")
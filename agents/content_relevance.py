@@ -1,26 +1,52 @@
 #!/usr/bin/env python3
 # agents/content_relevance.py
 
+import re
+import bisect
+import asyncio
 import openai
 import logging
+import threading
+import functools
 from typing import Dict, Any, Tuple, List, Optional
-import json
+import numpy as np
+import orjson
+from blake3 import blake3
+from cachetools import LRUCache
 
 # Import configurations
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import OPENAI_API_KEY, OPENAI_MODEL
+from config import OPENAI_MODEL, OPENAI_EMBEDDING_MODEL
+from agents.openai_client import client, create_async_client
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Logging is configured by the application entry point
 logger = logging.getLogger('content_relevance')
 
-# Configure OpenAI
-openai.api_key = OPENAI_API_KEY
+# Punti di interruzione delle sezioni: fine paragrafo (anche sovrapposti, come
+# li troverebbe rfind) e fine frase
+_PARAGRAPH_BREAK_RE = re.compile(r'(?=\n\n)')
+_SENTENCE_BREAK_RE = re.compile(r'\. ')
+
+# Numero massimo di sezioni valutate in parallelo
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Valutazioni già ottenute, indicizzate per modello, task e contenuto: le sezioni
+# ripetute tra pagine diverse (es. disclaimer) non vengono rivalutate
+RELEVANCE_CACHE_SIZE = 2048
+_relevance_cache = LRUCache(maxsize=RELEVANCE_CACHE_SIZE)
+_relevance_cache_lock = threading.Lock()
+
+# Interrompe la valutazione delle sezioni quando la rilevanza è già accertata
+DEFAULT_EARLY_EXIT_THRESHOLD = 0.9  # punteggio di una sezione oltre il quale fermarsi
+DEFAULT_MAX_RELEVANT_SECTIONS = 3   # sezioni rilevanti oltre le quali fermarsi
+
+# Prefiltro economico: sotto questa similarità coseno tra gli embedding del task e della
+# pagina il contenuto è chiaramente fuori tema e non serve la valutazione con il modello
+DEFAULT_SIMILARITY_THRESHOLD = 0.2
+SIMILARITY_MAX_CHARS = 20000  # caratteri della pagina usati per l'embedding
+TASK_EMBEDDING_CACHE_SIZE = 256
 
 class ContentRelevanceEvaluator:
     """
@@ -28,14 +54,24 @@ class ContentRelevanceEvaluator:
     Determina se il testo è utile per costruire una knowledge base per quel task.
     """
     
-    def __init__(self, model=OPENAI_MODEL):
+    def __init__(self, model=OPENAI_MODEL, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 early_exit_threshold: Optional[float] = DEFAULT_EARLY_EXIT_THRESHOLD,
+                 max_relevant_sections: Optional[int] = DEFAULT_MAX_RELEVANT_SECTIONS):
         """
         Inizializza l'evaluator di rilevanza.
         
         Args:
             model (str): Modello OpenAI da utilizzare
+            max_concurrency (int): Numero massimo di sezioni valutate in parallelo
+            early_exit_threshold (Optional[float]): Punteggio di una sezione che interrompe
+                                                    le valutazioni rimanenti (None per disattivare)
+            max_relevant_sections (Optional[int]): Numero di sezioni rilevanti che interrompe
+                                                   le valutazioni rimanenti (None per disattivare)
         """
         self.model = model
+        self.max_concurrency = max_concurrency
+        self.early_exit_threshold = early_exit_threshold
+        self.max_relevant_sections = max_relevant_sections
     
     def evaluate_relevance(self, task: str, content: str) -> Dict[str, Any]:
         """
@@ -56,6 +92,89 @@ class ContentRelevanceEvaluator:
                 "reason": "Task o contenuto mancante"
             }
         
+        cache_key = self._cache_key(task, content)
+        cached = self._cached_result(cache_key)
+        if cached is not None:
+            return cached
+        
+        try:
+            response = client.chat.completions.create(**self._relevance_request(task, content))
+            return self._parse_relevance(response.choices[0].message.content, cache_key)
+        except Exception as e:
+            return self._relevance_error(e)
+    
+    async def aevaluate_relevance(self, task: str, content: str, aclient: openai.AsyncOpenAI) -> Dict[str, Any]:
+        """
+        Versione asincrona di evaluate_relevance.
+        
+        Args:
+            task (str): Descrizione del task per cui si sta costruendo la knowledge base
+            content (str): Testo ripulito della pagina web da valutare
+            aclient (openai.AsyncOpenAI): Client asincrono da usare per la richiesta
+            
+        Returns:
+            Dict[str, Any]: Risultato della valutazione con punteggio di rilevanza e motivazione
+        """
+        if not content or not task:
+            return self.evaluate_relevance(task, content)
+        
+        cache_key = self._cache_key(task, content)
+        cached = self._cached_result(cache_key)
+        if cached is not None:
+            return cached
+        
+        try:
+            response = await aclient.chat.completions.create(**self._relevance_request(task, content))
+            return self._parse_relevance(response.choices[0].message.content, cache_key)
+        except Exception as e:
+            return self._relevance_error(e)
+    
+    def _cache_key(self, task: str, content: str) -> tuple:
+        """
+        Calcola la chiave della cache delle valutazioni.
+        
+        Args:
+            task (str): Descrizione del task
+            content (str): Testo da valutare
+            
+        Returns:
+            tuple: (modello, hash del task, hash del contenuto)
+        """
+        return (
+            self.model,
+            blake3(task.encode()).digest(length=16),
+            blake3(content.encode()).digest(length=16)
+        )
+    
+    def _cached_result(self, cache_key: tuple) -> Optional[Dict[str, Any]]:
+        """
+        Restituisce una copia della valutazione memorizzata, se presente.
+        
+        Args:
+            cache_key (tuple): Chiave calcolata da _cache_key
+            
+        Returns:
+            Optional[Dict[str, Any]]: Valutazione memorizzata o None
+        """
+        with _relevance_cache_lock:
+            cached = _relevance_cache.get(cache_key)
+        if cached is None:
+            return None
+        logger.info("Valutazione di rilevanza letta dalla cache")
+        # Copia: i chiamanti possono modificare il dizionario restituito
+        return dict(cached)
+    
+    def _relevance_request(self, task: str, content: str) -> Dict[str, Any]:
+        """
+        Costruisce i parametri della richiesta di valutazione della rilevanza.
+        
+        Args:
+            task (str): Descrizione del task per cui si sta costruendo la knowledge base
+            content (str): Testo ripulito della pagina web da valutare
+            
+        Returns:
+            Dict[str, Any]: Parametri per chat.completions.create
+        """
         # Tronca il contenuto se troppo lungo
         max_content_length = 8000  # Limite per evitare token troppo lunghi
         content_preview = content[:max_content_length]
@@ -84,59 +203,83 @@ class ContentRelevanceEvaluator:
         Valuta la rilevanza di questo contenuto rispetto al task specificato.
         """
         
-        try:
-            response = openai.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.3,
-                response_format={"type": "json_object"},
-                max_tokens=1024
-            )
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": user_message}
+            ],
+            "temperature": 0.3,
+            "response_format": {"type": "json_object"},
+            "max_tokens": 1024
+        }
+    
+    def _parse_relevance(self, result_text: str, cache_key: Optional[tuple] = None) -> Dict[str, Any]:
+        """
+        Interpreta la risposta JSON del modello e completa i campi mancanti.
+        Le valutazioni interpretate correttamente vengono memorizzate in cache.
+        
+        Args:
+            result_text (str): Contenuto della risposta del modello
+            cache_key (Optional[tuple]): Chiave con cui memorizzare il risultato
             
-            result_text = response.choices[0].message.content.strip()
+        Returns:
+            Dict[str, Any]: Risultato della valutazione normalizzato
+        """
+        try:
+            # orjson ignora da sé gli spazi iniziali e finali
+            result = orjson.loads(result_text)
             
-            try:
-                result = json.loads(result_text)
-                
-                # Assicurati che tutti i campi necessari siano presenti
-                if 'is_relevant' not in result:
-                    result['is_relevant'] = False
-                if 'relevance_score' not in result:
-                    result['relevance_score'] = 0.0
-                if 'reason' not in result:
-                    result['reason'] = "Nessuna motivazione fornita"
-                if 'key_points' not in result:
-                    result['key_points'] = []
-                    
-                # Normalizza il punteggio tra 0 e 1
-                result['relevance_score'] = max(0.0, min(1.0, float(result['relevance_score'])))
-                
-                logger.info(f"Valutazione completata: Rilevanza {result['relevance_score']:.2f}, Rilevante: {result['is_relevant']}")
-                return result
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"Errore nel parsing del risultato JSON: {e}")
-                # Fallback manuale
-                return {
-                    "is_relevant": False,
-                    "relevance_score": 0.0,
-                    "reason": f"Errore nell'analisi della risposta: {e}",
-                    "key_points": []
-                }
+            # Assicurati che tutti i campi necessari siano presenti
+            if 'is_relevant' not in result:
+                result['is_relevant'] = False
+            if 'relevance_score' not in result:
+                result['relevance_score'] = 0.0
+            if 'reason' not in result:
+                result['reason'] = "Nessuna motivazione fornita"
+            if 'key_points' not in result:
+                result['key_points'] = []
                 
-        except Exception as e:
-            logger.error(f"Errore durante la valutazione della rilevanza: {e}")
+            # Normalizza il punteggio tra 0 e 1
+            result['relevance_score'] = max(0.0, min(1.0, float(result['relevance_score'])))
+            
+            logger.info(f"Valutazione completata: Rilevanza {result['relevance_score']:.2f}, Rilevante: {result['is_relevant']}")
+            
+            if cache_key is not None:
+                with _relevance_cache_lock:
+                    _relevance_cache[cache_key] = dict(result)
+            return result
+            
+        except orjson.JSONDecodeError as e:
+            logger.error(f"Errore nel parsing del risultato JSON: {e}")
+            # Fallback manuale
             return {
                 "is_relevant": False,
                 "relevance_score": 0.0,
-                "reason": f"Errore durante la valutazione: {str(e)}",
+                "reason": f"Errore nell'analisi della risposta: {e}",
                 "key_points": []
             }
     
-    def evaluate_content_sections(self, task: str, content: str, section_size: int = 2000) -> Dict[str, Any]:
+    def _relevance_error(self, error: Exception) -> Dict[str, Any]:
+        """
+        Costruisce il risultato restituito quando la valutazione non va a buon fine.
+        
+        Args:
+            error (Exception): Errore sollevato durante la valutazione
+            
+        Returns:
+            Dict[str, Any]: Risultato di valutazione negativo con la motivazione
+        """
+        logger.error(f"Errore durante la valutazione della rilevanza: {error}")
+        return {
+            "is_relevant": False,
+            "relevance_score": 0.0,
+            "reason": f"Errore durante la valutazione: {str(error)}",
+            "key_points": []
+        }
+    
+    def evaluate_content_sections(self, task: str, content: str, section_size: int = 2000,
+                                  stop_on_first_relevant: bool = False) -> Dict[str, Any]:
         """
         Valuta la rilevanza di un contenuto lungo suddividendolo in sezioni.
         Utile per testi molto lunghi che supererebbero i limiti di token.
@@ -145,6 +288,8 @@ class ContentRelevanceEvaluator:
             task (str): Descrizione del task per cui si sta costruendo la knowledge base
             content (str): Testo ripulito della pagina web da valutare
             section_size (int): Dimensione di ciascuna sezione in caratteri
+            stop_on_first_relevant (bool): Se True, interrompe le valutazioni ancora in corso
+                                           non appena una sezione risulta rilevante
             
         Returns:
             Dict[str, Any]: Risultato della valutazione con sezioni rilevanti
@@ -161,10 +306,16 @@ class ContentRelevanceEvaluator:
         overall_relevant = False
         max_score = 0.0
         
-        # Valuta ciascuna sezione
-        for i, section in enumerate(sections):
-            logger.info(f"Valutazione sezione {i+1}/{len(sections)}")
-            result = self.evaluate_relevance(task, section)
+        # Valuta tutte le sezioni in parallelo
+        results = asyncio.run(self._evaluate_sections_async(task, sections, stop_on_first_relevant))
+        
+        skipped = results.count(None)
+        if skipped:
+            logger.info(f"{skipped}/{len(sections)} sezioni non valutate: rilevanza già accertata")
+        
+        for i, (section, result) in enumerate(zip(sections, results)):
+            if result is None:
+                continue
             
             section_results.append({
                 "section_index": i,
@@ -198,6 +349,65 @@ class ContentRelevanceEvaluator:
         
         return overall_result
     
+    async def _evaluate_sections_async(self, task: str, sections: List[str],
+                                       stop_on_first_relevant: bool = False) -> List[Optional[Dict[str, Any]]]:
+        """
+        Valuta le sezioni con richieste asincrone concorrenti, limitate a max_concurrency.
+        Le sezioni identiche vengono valutate una sola volta e il risultato è condiviso.
+        Le valutazioni rimanenti vengono annullate quando una sezione supera
+        early_exit_threshold o le sezioni rilevanti raggiungono max_relevant_sections.
+        
+        Args:
+            task (str): Descrizione del task per cui si sta costruendo la knowledge base
+            sections (List[str]): Sezioni del contenuto da valutare
+            stop_on_first_relevant (bool): Se True, annulla le valutazioni rimanenti alla
+                                           prima sezione rilevante
+            
+        Returns:
+            List[Optional[Dict[str, Any]]]: Risultati delle valutazioni, nello stesso ordine
+                                            delle sezioni (None per quelle non valutate)
+        """
+        keys = [blake3(section.encode()).digest() for section in sections]
+        unique_sections = dict(zip(keys, sections))
+        if len(unique_sections) < len(sections):
+            logger.info(f"{len(sections) - len(unique_sections)} sezioni duplicate valutate una sola volta")
+        
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def _evaluate(i: int, key: bytes, section: str) -> tuple:
+            async with semaphore:
+                logger.info(f"Valutazione sezione {i+1}/{len(unique_sections)}")
+                return key, await self.aevaluate_relevance(task, section, aclient)
+        
+        results = {}
+        relevant_count = 0
+        
+        # Il client asincrono è legato all'event loop: ne viene creato uno per esecuzione
+        async with create_async_client(self.max_concurrency) as aclient:
+            tasks = [
+                asyncio.ensure_future(_evaluate(i, key, section))
+                for i, (key, section) in enumerate(unique_sections.items())
+            ]
+            try:
+                for next_result in asyncio.as_completed(tasks):
+                    key, result = await next_result
+                    results[key] = result
+                    if result["is_relevant"]:
+                        relevant_count += 1
+                        if stop_on_first_relevant:
+                            break
+                    if self.early_exit_threshold is not None and result["relevance_score"] >= self.early_exit_threshold:
+                        break
+                    if self.max_relevant_sections is not None and relevant_count >= self.max_relevant_sections:
+                        break
+            finally:
+                # Annulla le valutazioni ancora in corso (nessuna se sono tutte completate)
+                for pending in tasks:
+                    pending.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        
+        return [results.get(key) for key in keys]
+    
     def _split_content(self, content: str, section_size: int) -> List[str]:
         """
         Divide il contenuto in sezioni di dimensioni gestibili.
@@ -212,19 +422,30 @@ class ContentRelevanceEvaluator:
         sections = []
         start = 0
         
+        # Calcola una sola volta le posizioni successive a ogni fine paragrafo e fine frase
+        paragraph_ends = [m.start() + 2 for m in _PARAGRAPH_BREAK_RE.finditer(content)]
+        sentence_ends = [m.end() for m in _SENTENCE_BREAK_RE.finditer(content)]
+        
+        def _last_break(break_ends: List[int], start: int, end: int) -> Optional[int]:
+            # Ultimo punto di interruzione entro end, purché oltre metà sezione
+            i = bisect.bisect_right(break_ends, end) - 1
+            if i >= 0 and break_ends[i] - 2 > start + section_size // 2:
+                return break_ends[i]
+            return None
+        
         while start < len(content):
             end = start + section_size
             
             # Se non siamo alla fine, cerca un punto di interruzione logico
             if end < len(content):
-                # Cerca il fine paragrafo più vicino
-                paragraph_end = content.rfind('\n\n', start, end)
-                sentence_end = content.rfind('. ', start, end)
-                
-                if paragraph_end > start + section_size // 2:
-                    end = paragraph_end + 2
-                elif sentence_end > start + section_size // 2:
-                    end = sentence_end + 2
+                # Cerca il fine paragrafo più vicino, altrimenti il fine frase
+                paragraph_end = _last_break(paragraph_ends, start, end)
+                if paragraph_end is not None:
+                    end = paragraph_end
+                else:
+                    sentence_end = _last_break(sentence_ends, start, end)
+                    if sentence_end is not None:
+                        end = sentence_end
             
             sections.append(content[start:end].strip())
             start = end
@@ -251,6 +472,49 @@ def evaluate_content_relevance(task: str, content: str, detailed: bool = False)
     else:
         return evaluator.evaluate_relevance(task, content)
 
+@functools.lru_cache(maxsize=TASK_EMBEDDING_CACHE_SIZE)
+def _task_embedding(task: str) -> np.ndarray:
+    """
+    Calcola l'embedding normalizzato di un task, una sola volta per tutte le pagine valutate.
+    
+    Args:
+        task (str): Descrizione del task
+        
+    Returns:
+        np.ndarray: Embedding normalizzato
+    """
+    response = client.embeddings.create(model=OPENAI_EMBEDDING_MODEL, input=task)
+    return _normalized(response.data[0].embedding)
+
+def _normalized(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def content_similarity(task: str, content: str) -> Optional[float]:
+    """
+    Calcola la similarità coseno tra gli embedding del task e del contenuto, come prefiltro
+    economico prima di evaluate_content_relevance.
+    
+    Args:
+        task (str): Descrizione del task per cui si sta costruendo la knowledge base
+        content (str): Testo ripulito della pagina web
+        
+    Returns:
+        Optional[float]: Similarità tra -1 e 1, o None in caso di errore
+    """
+    if not content:
+        return None
+    
+    try:
+        task_vector = _task_embedding(task)
+        response = client.embeddings.create(model=OPENAI_EMBEDDING_MODEL, input=content[:SIMILARITY_MAX_CHARS])
+    except Exception as e:
+        logger.warning(f"Errore nel calcolo della similarità tra task e contenuto: {e}")
+        return None
+    
+    return float(task_vector @ _normalized(response.data[0].embedding))
+
 def format_relevance_result(result: Dict[str, Any]) -> str:
     """
     Formatta il risultato della valutazione di rilevanza in un formato leggibile.
@@ -298,6 +562,11 @@ if __name__ == "__main__":
     from content_cleaner import clean_webpage_content
     from web_scraper import scrape_webpage
     
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
     if len(sys.argv) > 2:
         task = sys.argv[1]
         url = sys.argv[2]
@@ -1,7 +1,37 @@
 #!/usr/bin/env python3
 # agents/formatter.py
 
-from typing import List, Dict, Any
+import heapq
+import datetime
+from operator import itemgetter
+from typing import List, Dict, Any, Optional
+
+# Modelli delle righe ripetute per ogni elemento, analizzati una sola volta
+_SEARCH_ROW = (
+    "{i}. {title}\n"
+    "   URL: {url}\n"
+    "   Rilevanza titolo/descrizione: {rel_score:.2f}\n"
+    "   Rilevanza contenuto: {content_score:.2f}\n"
+)
+_RAG_SOURCE_ROW = (
+    "{i}. {title} (score: {score:.2f})\n"
+    "   URL: {url}\n"
+    "   Cache: {cache_file}\n"
+    "   Anteprima: {preview}\n\n"
+)
+_RAG_INDEX_ROW = (
+    "ID: {id}\n"
+    "Task: {task}\n"
+    "Data: {created_at}\n"
+    "Documenti: {num_documents}\n"
+    + "-" * 50 + "\n"
+)
+_CACHED_PAGE_ROW = (
+    "{i}. {url}\n"
+    "   File: {cache_file}\n"
+    "   Data: {date_str}\n"
+    "   Dimensione: {size_kb:.1f} KB\n\n"
+)
 
 def format_search_results(results: List[Dict[str, Any]]) -> str:
     """
@@ -16,7 +46,7 @@ def format_search_results(results: List[Dict[str, Any]]) -> str:
     if not results:
         return "Nessun risultato rilevante trovato."
         
-    formatted_text = f"Trovati {len(results)} risultati rilevanti:\n\n"
+    parts = [f"Trovati {len(results)} risultati rilevanti:\n\n"]
     
     for i, result in enumerate(results, 1):
         title = result.get('title', 'Titolo non disponibile')
@@ -26,21 +56,18 @@ def format_search_results(results: List[Dict[str, Any]]) -> str:
         content_eval = result.get('content_evaluation', {})
         content_score = content_eval.get('relevance_score', 0.0)
         
-        formatted_text += f"{i}. {title}\n"
-        formatted_text += f"   URL: {url}\n"
-        formatted_text += f"   Rilevanza titolo/descrizione: {rel_score:.2f}\n"
-        formatted_text += f"   Rilevanza contenuto: {content_score:.2f}\n"
+        parts.append(_SEARCH_ROW.format(i=i, title=title, url=url, rel_score=rel_score, content_score=content_score))
         
         # Aggiungi i punti chiave se disponibili
         key_points = content_eval.get('key_points', [])
         if key_points:
-            formatted_text += "   Punti chiave:\n"
+            parts.append("   Punti chiave:\n")
             for point in key_points:
-                formatted_text += f"   - {point}\n"
+                parts.append(f"   - {point}\n")
         
-        formatted_text += "\n"
+        parts.append("\n")
     
-    return formatted_text
+    return "".join(parts)
 
 def format_rag_query_result(result: Dict[str, Any]) -> str:
     """
@@ -55,25 +82,30 @@ def format_rag_query_result(result: Dict[str, Any]) -> str:
     if not result:
         return "Nessun risultato di query RAG disponibile."
         
-    formatted_text = "Risultato della Query RAG:\n"
-    formatted_text += "-" * 50 + "\n"
-    formatted_text += f"Risposta: {result.get('response', 'Nessuna risposta generata')}\n\n"
+    parts = ["Risultato della Query RAG:\n"]
+    parts.append("-" * 50 + "\n")
+    parts.append(f"Risposta: {result.get('response', 'Nessuna risposta generata')}\n\n")
     
     sources = result.get('sources', [])
     if sources:
-        formatted_text += f"Fonti utilizzate ({len(sources)}):\n\n"
+        parts.append(f"Fonti utilizzate ({len(sources)}):\n\n")
         
         for i, source in enumerate(sources, 1):
-            formatted_text += f"{i}. {source.get('title', 'Titolo non disponibile')} (score: {source.get('score', 0.0):.2f})\n"
-            formatted_text += f"   URL: {source.get('url', 'URL non disponibile')}\n"
-            formatted_text += f"   Cache: {source.get('cache_file', 'N/A')}\n"
-            content = source.get('content', '')
-            preview = (content[:150] + "...") if len(content) > 150 else content
-            formatted_text += f"   Anteprima: {preview}\n\n"
+            # Una sola slice: se contiene più di 150 caratteri il contenuto va troncato
+            head = source.get('content', '')[:151]
+            preview = head[:150] + "..." if len(head) > 150 else head
+            parts.append(_RAG_SOURCE_ROW.format(
+                i=i,
+                title=source.get('title', 'Titolo non disponibile'),
+                score=source.get('score', 0.0),
+                url=source.get('url', 'URL non disponibile'),
+                cache_file=source.get('cache_file', 'N/A'),
+                preview=preview
+            ))
     else:
-        formatted_text += "Nessuna fonte disponibile.\n"
+        parts.append("Nessuna fonte disponibile.\n")
         
-    return formatted_text
+    return "".join(parts)
 
 def format_rag_indices(indices: List[Dict[str, Any]]) -> str:
     """
@@ -88,23 +120,25 @@ def format_rag_indices(indices: List[Dict[str, Any]]) -> str:
     if not indices:
         return "Nessun indice RAG disponibile."
         
-    formatted_text = f"Indici RAG disponibili ({len(indices)}):\n\n"
+    parts = [f"Indici RAG disponibili ({len(indices)}):\n\n"]
     
     for idx in indices:
-        formatted_text += f"ID: {idx.get('id', 'N/A')}\n"
-        formatted_text += f"Task: {idx.get('task', 'N/A')}\n"
-        formatted_text += f"Data: {idx.get('created_at', 'N/A')}\n"
-        formatted_text += f"Documenti: {idx.get('num_documents', 0)}\n"
-        formatted_text += "-" * 50 + "\n"
+        parts.append(_RAG_INDEX_ROW.format(
+            id=idx.get('id', 'N/A'),
+            task=idx.get('task', 'N/A'),
+            created_at=idx.get('created_at', 'N/A'),
+            num_documents=idx.get('num_documents', 0)
+        ))
     
-    return formatted_text
+    return "".join(parts)
 
-def format_cached_pages(cached_pages: List[Dict[str, Any]]) -> str:
+def format_cached_pages(cached_pages: List[Dict[str, Any]], limit: Optional[int] = None) -> str:
     """
-    Formatta la lista di pagine in cache.
+    Formatta la lista di pagine in cache, dalla più recente.
     
     Args:
         cached_pages (List[Dict[str, Any]]): Lista di metadati delle pagine in cache
+        limit (Optional[int]): Numero massimo di pagine da mostrare (None per tutte)
         
     Returns:
         str: Testo formattato con le pagine in cache
@@ -112,22 +146,27 @@ def format_cached_pages(cached_pages: List[Dict[str, Any]]) -> str:
     if not cached_pages:
         return "Nessuna pagina in cache."
         
-    formatted_text = f"Pagine in cache ({len(cached_pages)}):\n\n"
+    parts = [f"Pagine in cache ({len(cached_pages)}):\n\n"]
+    
+    # Seleziona le pagine più recenti senza riordinare la lista del chiamante
+    pages = heapq.nlargest(limit or len(cached_pages), cached_pages, key=itemgetter('timestamp'))
     
-    # Ordina per timestamp (più recente prima)
-    cached_pages.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
+    fromtimestamp = datetime.datetime.fromtimestamp
+    date_format = "%Y-%m-%d %H:%M:%S"
     
-    for i, page in enumerate(cached_pages, 1):
+    for i, page in enumerate(pages, 1):
         url = page.get('url', 'URL non disponibile')
         timestamp = page.get('timestamp', 0)
         
         # Formatta il timestamp
-        import datetime
-        date_str = datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
-        
-        formatted_text += f"{i}. {url}\n"
-        formatted_text += f"   File: {page.get('cache_file', 'N/A')}\n"
-        formatted_text += f"   Data: {date_str}\n"
-        formatted_text += f"   Dimensione: {page.get('size', 0) / 1024:.1f} KB\n\n"
+        date_str = fromtimestamp(timestamp).strftime(date_format)
+        
+        parts.append(_CACHED_PAGE_ROW.format(
+            i=i,
+            url=url,
+            cache_file=page.get('cache_file', 'N/A'),
+            date_str=date_str,
+            size_kb=page.get('size', 0) / 1024
+        ))
     
-    return formatted_text
\ No newline at end of file
+    return "".join(parts)
\ No newline at end of file
@@ -19,16 +19,15 @@ def google_search(query: str, num_results: int = SEARCH_RESULTS_LIMIT) -> List[D
     results = []
     
     try:
-        # The search function returns links only
-        search_results = search(query, num_results=num_results, unique=True)
+        # Advanced mode parses title and description from the results page itself,
+        # so no additional request per link is needed
+        search_results = search(query, num_results=num_results, unique=True, advanced=True)
         
-        # For each link, add it to our results with a placeholder for title and description
-        # In a real implementation, you would need to fetch each page to get title and description
-        for link in search_results:
+        for result in search_results:
             results.append({
-                'title': f"Result for {query}",  # Basic placeholder
-                'link': link,
-                'description': "Description not available without additional scraping"
+                'title': result.title or f"Result for {query}",
+                'link': result.url,
+                'description': result.description or "Description not available"
             })
             
         return results
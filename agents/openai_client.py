@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# agents/openai_client.py
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+from config import OPENAI_API_KEY
+
+# Connessioni verso OpenAI mantenute aperte e riutilizzate tra le richieste
+MAX_CONNECTIONS = 128
+REQUEST_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+# Client sincrono condiviso da tutti gli agenti: un unico pool di connessioni
+# keep-alive evita un handshake TLS per ogni chiamata
+client = OpenAI(
+    api_key=OPENAI_API_KEY,
+    http_client=httpx.Client(
+        limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+        timeout=REQUEST_TIMEOUT
+    )
+)
+
+def create_async_client(max_connections: int = MAX_CONNECTIONS) -> AsyncOpenAI:
+    """
+    Crea un client asincrono con il proprio pool di connessioni.
+    Il client è legato all'event loop in cui viene usato: va creato all'interno
+    di ogni esecuzione asyncio (es. con async with) e non condiviso tra loop diversi.
+    
+    Args:
+        max_connections (int): Numero massimo di connessioni concorrenti
+        
+    Returns:
+        AsyncOpenAI: Client asincrono di OpenAI
+    """
+    return AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=REQUEST_TIMEOUT
+        )
+    )
\ No newline at end of file
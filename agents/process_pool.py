@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# agents/process_pool.py
+
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Processi worker condivisi da tutte le elaborazioni CPU-bound (testo HTML, pagine PDF)
+PROCESS_POOL_WORKERS = os.cpu_count() or 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Restituisce il pool di processi condiviso, creandolo al primo utilizzo.
+    I worker vengono avviati con forkserver (o spawn dove non è disponibile): il processo
+    principale esegue thread di Flask, dei logger e dei client HTTP, e una fork diretta
+    potrebbe copiare nei figli lock acquisiti da quei thread. Il pool resta attivo fino
+    all'uscita dell'interprete.
+    
+    Returns:
+        ProcessPoolExecutor: Pool di processi condiviso
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                _pool = ProcessPoolExecutor(
+                    max_workers=PROCESS_POOL_WORKERS,
+                    mp_context=multiprocessing.get_context(method)
+                )
+                atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+    return _pool
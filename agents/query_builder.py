@@ -1,10 +1,65 @@
 # agent/query_builder.py
 
+import os
+import sqlite3
+import logging
+import threading
+import orjson
+from blake3 import blake3
 from openai import OpenAI
-from config import OPENAI_API_KEY, OPENAI_MODEL
+from config import OPENAI_API_KEY, OPENAI_MODEL, CACHE_DIR
 
 client = OpenAI(api_key=OPENAI_API_KEY)
 
+logger = logging.getLogger('query_builder')
+
+# Query già generate, salvate su disco e indicizzate per modello e parametri della
+# richiesta: input identici non richiedono una nuova chiamata a OpenAI
+QUERY_CACHE_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    CACHE_DIR,
+    'query_builder.sqlite'
+)
+
+_cache_conn = None
+_cache_lock = threading.Lock()
+
+def _query_cache() -> sqlite3.Connection:
+    """
+    Apre (una sola volta per processo) il database della cache delle query.
+    Va chiamata tenendo _cache_lock.
+    """
+    global _cache_conn
+    if _cache_conn is None:
+        os.makedirs(os.path.dirname(QUERY_CACHE_FILE), exist_ok=True)
+        conn = sqlite3.connect(QUERY_CACHE_FILE, check_same_thread=False)
+        conn.execute("CREATE TABLE IF NOT EXISTS queries (key TEXT PRIMARY KEY, query TEXT NOT NULL)")
+        conn.commit()
+        _cache_conn = conn
+    return _cache_conn
+
+def _cache_key(task: str, context: str, previous_queries: list[str], temperature: float) -> str:
+    payload = orjson.dumps([OPENAI_MODEL, task, context, previous_queries, round(temperature, 2)])
+    return blake3(payload).hexdigest(16)
+
+def _cached_query(key: str) -> str | None:
+    try:
+        with _cache_lock:
+            row = _query_cache().execute("SELECT query FROM queries WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        logger.warning(f"Errore nella lettura della cache delle query: {e}")
+        return None
+
+def _store_query(key: str, query: str) -> None:
+    try:
+        with _cache_lock:
+            conn = _query_cache()
+            conn.execute("INSERT OR REPLACE INTO queries (key, query) VALUES (?, ?)", (key, query))
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.warning(f"Errore nella scrittura della cache delle query: {e}")
+
 def build_google_query(task: str, context: str = "", previous_queries: list[str] = None, temperature: float = 0.3) -> str:
     """
     Genera una query Google mirata, tenendo conto del contesto e delle query già usate.
@@ -12,6 +67,11 @@ def build_google_query(task: str, context: str = "", previous_queries: list[str]
     if previous_queries is None:
         previous_queries = []
 
+    key = _cache_key(task, context, previous_queries, temperature)
+    cached = _cached_query(key)
+    if cached is not None:
+        return cached
+
     system_prompt = """
     Sei un assistente esperto in ricerche online.
     Il tuo compito è trasformare un obiettivo specifico in una query ottimizzata per Google.
@@ -48,4 +108,6 @@ def build_google_query(task: str, context: str = "", previous_queries: list[str]
         temperature=temperature,
     )
 
-    return response.choices[0].message.content.strip()
+    query = response.choices[0].message.content.strip()
+    _store_query(key, query)
+    return query
@@ -2,32 +2,50 @@
 # agents/rag_storage.py
 
 import os
-import json
 import datetime
 import uuid
-import hashlib
+import atexit
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+import tempfile
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Iterator, Union, Collection
 import sys
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import orjson
+import aiofiles
+from cachetools import LRUCache
 
 try:
     from llama_index.core import (
         Document, 
         VectorStoreIndex, 
         StorageContext,
+        QueryBundle,
         load_index_from_storage,
         Settings
     )
     from llama_index.core.node_parser import SentenceSplitter
+    from llama_index.core.schema import MetadataMode
     from llama_index.embeddings.openai import OpenAIEmbedding
     from llama_index.core.vector_stores.simple import SimpleVectorStore
 except ImportError:
     logger = logging.getLogger('rag_storage')
     logger.warning("LlamaIndex non è installato. Esegui 'pip install llama-index llama-index-embeddings-openai llama-index-vector-stores-simple'")
 
+try:
+    import faiss
+    from llama_index.vector_stores.faiss import FaissVectorStore
+except ImportError:
+    faiss = None
+    logger = logging.getLogger('rag_storage')
+    logger.warning("FAISS non è installato, i nuovi indici useranno SimpleVectorStore. Esegui 'pip install faiss-cpu llama-index-vector-stores-faiss'")
+
 # Import configurations
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import OPENAI_API_KEY, OPENAI_EMBEDDING_MODEL, OPENAI_MODEL
+from agents.cache_handlers.file_handler import cache_file_name
 
 # Inizializza OpenAI client
 from openai import OpenAI
@@ -36,32 +54,128 @@ openai_client = OpenAI(api_key=OPENAI_API_KEY)
 # Configure logging
 logger = logging.getLogger('rag_storage')
 
+# Numero di chunk inviati in ogni richiesta di embedding
+EMBED_BATCH_SIZE = 100
+
+# Richieste di embedding eseguite in parallelo nel salvataggio asincrono
+MAX_CONCURRENT_EMBEDDINGS = 8
+
+# Dimensione degli embedding dei modelli OpenAI, necessaria per creare l'indice FAISS
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536
+}
+
+# Risposte alle query RAG già generate, indicizzate per indice, query e parametri:
+# una query ripetuta non richiede né retrieval né completamento
+QUERY_CACHE_SIZE = 256
+_query_cache = LRUCache(maxsize=QUERY_CACHE_SIZE)
+_query_cache_lock = threading.Lock()
+
+# Indici già caricati dal disco, indicizzati per directory: evitano di ricostruire
+# StorageContext e indice a ogni query. Ogni voce ricorda la data di modifica di
+# metadata.json, così un indice aggiornato da un altro processo viene ricaricato
+INDEX_CACHE_SIZE = 8
+_index_cache = LRUCache(maxsize=INDEX_CACHE_SIZE)  # directory -> (indice, metadati, mtime)
+_index_cache_lock = threading.Lock()
+
+# Gli indici in cache sono condivisi tra i thread: inserimenti, salvataggi e retrieval
+# sullo stesso indice avvengono sotto il suo lock (FAISS e docstore non sono thread-safe)
+_index_locks = {}  # directory dell'indice -> RLock
+
+# Prompt per la generazione delle risposte a partire dal contesto recuperato
+ANSWER_SYSTEM_PROMPT = "Sei un assistente di ricerca che risponde alle domande basandosi solo sui dati forniti."
+ANSWER_PROMPT_HEADER = """Basandoti sulle seguenti informazioni, rispondi alla domanda. 
+Includi solo fatti presenti nei dati forniti e non aggiungere informazioni non presenti.
+Se le informazioni fornite non sono sufficienti per rispondere, dillo chiaramente.
+
+INFORMAZIONI:
+"""
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+# Letture parallele dei metadati in list_rag_indices
+METADATA_READ_WORKERS = 16
+
+# Salvataggio differito degli aggiornamenti: gli indici modificati restano in memoria e
+# vengono scritti su disco dopo FLUSH_INTERVAL secondi o FLUSH_MAX_PENDING_UPDATES aggiornamenti
+FLUSH_INTERVAL = 30  # secondi
+FLUSH_MAX_PENDING_UPDATES = 10
+_dirty_indices = {}  # directory dell'indice -> [indice, metadati, aggiornamenti non salvati]
+_dirty_lock = threading.Lock()
+_flush_timer = None
+_flush_at_exit_registered = False
+
+# Similarità coseno oltre la quale una query è considerata equivalente a una già in cache
+SEMANTIC_CACHE_THRESHOLD = 0.97
+
+def _index_lock(index_dir: str) -> threading.RLock:
+    """
+    Restituisce il lock associato alla directory di un indice, creandolo al primo utilizzo.
+    
+    Args:
+        index_dir (str): Directory dell'indice
+        
+    Returns:
+        threading.RLock: Lock dell'indice
+    """
+    with _index_cache_lock:
+        lock = _index_locks.get(index_dir)
+        if lock is None:
+            lock = _index_locks[index_dir] = threading.RLock()
+        return lock
+
+def _metadata_mtime(metadata_file: str) -> Optional[float]:
+    try:
+        return os.stat(metadata_file).st_mtime
+    except OSError:
+        return None
+
+def _normalize(embedding: List[float]) -> np.ndarray:
+    """
+    Normalizza un embedding, così che il prodotto scalare sia la similarità coseno.
+    
+    Args:
+        embedding (List[float]): Embedding della query
+        
+    Returns:
+        np.ndarray: Embedding di norma unitaria
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
 class RAGStorage:
     """
     Gestore per il salvataggio e il recupero di dati in formato RAG (Retrieval-Augmented Generation)
     utilizzando LlamaIndex.
     """
     
-    def __init__(self, rag_dir="output/rag"):
+    def __init__(self, rag_dir="output/rag", semantic_cache_threshold: Optional[float] = SEMANTIC_CACHE_THRESHOLD):
         """
         Inizializza lo storage RAG.
         
         Args:
             rag_dir (str): Directory per il salvataggio degli indici RAG
+            semantic_cache_threshold (Optional[float]): Similarità oltre la quale riutilizzare la
+                                                        risposta di una query simile (None per disattivare)
         """
         self.rag_dir = os.path.join(
             os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
             rag_dir
         )
         os.makedirs(self.rag_dir, exist_ok=True)
+        self.semantic_cache_threshold = semantic_cache_threshold
         
         # Configura le impostazioni di LlamaIndex
         try:
             # Configura l'embedding model
             embed_model = OpenAIEmbedding(
                 api_key=OPENAI_API_KEY,
-                model=OPENAI_EMBEDDING_MODEL
+                model=OPENAI_EMBEDDING_MODEL,
+                embed_batch_size=EMBED_BATCH_SIZE
             )
+            self.embed_model = embed_model
             
             # Configura le impostazioni globali di LlamaIndex
             Settings.embed_model = embed_model
@@ -73,6 +187,23 @@ class RAGStorage:
             logger.error(f"Errore nell'inizializzazione di RAGStorage: {e}")
             self.is_initialized = False
     
+    def _create_vector_store(self) -> Tuple[Any, str]:
+        """
+        Crea il vector store di un nuovo indice: un indice FAISS a prodotto scalare esatto
+        (equivalente alla similarità coseno sugli embedding normalizzati di OpenAI) se
+        disponibile, altrimenti SimpleVectorStore.
+        
+        Returns:
+            Tuple[Any, str]: Vector store e tipo da registrare nei metadati dell'indice
+        """
+        if faiss is None:
+            return SimpleVectorStore(), "simple"
+        
+        embed_dim = EMBEDDING_DIMENSIONS.get(OPENAI_EMBEDDING_MODEL)
+        if embed_dim is None:
+            embed_dim = len(self.embed_model.get_text_embedding("dimensione"))
+        return FaissVectorStore(faiss_index=faiss.IndexFlatIP(embed_dim)), "faiss"
+    
     def save_results_as_rag(self, task: str, results: List[Dict[str, Any]], metadata: Dict[str, Any] = None) -> Optional[str]:
         """
         Salva i risultati di ricerca in un indice RAG.
@@ -99,39 +230,7 @@ class RAGStorage:
             index_dir = os.path.join(self.rag_dir, f"index_{rag_id}")
             
             # Crea documenti da risultati di ricerca
-            documents = []
-            cache_references = []
-            
-            for result in results:
-                if 'content' in result and result['content']:
-                    # Usa URL come ID univoco per il documento
-                    url = result.get('link', '')
-                    title = result.get('title', 'Titolo non disponibile')
-                    
-                    # Ottieni hash URL per riferimento alla cache
-                    url_hash = hashlib.md5(url.encode()).hexdigest()
-                    cache_file = f"{url_hash}.json"
-                    
-                    # Crea documento per l'indicizzazione
-                    doc = Document(
-                        text=result['content'],
-                        metadata={
-                            "source": "web",
-                            "url": url,
-                            "title": title,
-                            "relevance_score": result.get('relevance_score', 0.0),
-                            "content_relevance_score": result.get('content_evaluation', {}).get('relevance_score', 0.0),
-                            "cache_file": cache_file
-                        }
-                    )
-                    documents.append(doc)
-                    
-                    # Memorizza riferimenti alla cache
-                    cache_references.append({
-                        "url": url,
-                        "cache_file": cache_file,
-                        "title": title
-                    })
+            documents, cache_references = self._build_documents(results)
             
             if not documents:
                 logger.warning("Nessun documento valido da indicizzare")
@@ -140,12 +239,17 @@ class RAGStorage:
             # Crea indice con i documenti
             logger.info(f"Creazione indice RAG con {len(documents)} documenti")
             node_parser = SentenceSplitter(chunk_size=512, chunk_overlap=50)
-            vector_store = SimpleVectorStore()
+            vector_store, vector_store_type = self._create_vector_store()
             storage_context = StorageContext.from_defaults(vector_store=vector_store)
             
-            index = VectorStoreIndex.from_documents(
-                documents,
-                storage_context=storage_context
+            # Suddivide i documenti una sola volta: gli embedding dei nodi vengono
+            # calcolati a blocchi di EMBED_BATCH_SIZE invece che uno per richiesta
+            nodes = node_parser.get_nodes_from_documents(documents)
+            index = VectorStoreIndex(
+                nodes,
+                storage_context=storage_context,
+                embed_model=self.embed_model,
+                show_progress=False
             )
             
             # Salva indice su disco
@@ -153,15 +257,109 @@ class RAGStorage:
             
             # Salva metadati dell'indice
             metadata_file = os.path.join(index_dir, "metadata.json")
-            with open(metadata_file, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "id": rag_id,
-                    "task": task,
-                    "created_at": datetime.datetime.now().isoformat(),
-                    "num_documents": len(documents),
-                    "cache_references": cache_references,
-                    "metadata": metadata or {}
-                }, f, ensure_ascii=False, indent=2)
+            self._write_metadata(metadata_file, {
+                "id": rag_id,
+                "task": task,
+                "created_at": datetime.datetime.now().isoformat(),
+                "num_documents": len(documents),
+                "vector_store": vector_store_type,
+                "cache_references": cache_references,
+                "metadata": metadata or {}
+            })
+            
+            logger.info(f"Indice RAG salvato con ID: {rag_id}")
+            return rag_id
+            
+        except Exception as e:
+            logger.error(f"Errore durante il salvataggio dei risultati come RAG: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            return None
+    
+    async def asave_results_as_rag(self, task: str, results: List[Dict[str, Any]], metadata: Dict[str, Any] = None) -> Optional[str]:
+        """
+        Versione asincrona di save_results_as_rag: i blocchi di embedding vengono richiesti
+        in parallelo e il salvataggio dell'indice si sovrappone alla scrittura dei metadati.
+        
+        Args:
+            task (str): Il task di ricerca originale
+            results (List[Dict[str, Any]]): I risultati di ricerca trovati
+            metadata (Dict[str, Any]): Metadati aggiuntivi da salvare
+            
+        Returns:
+            Optional[str]: ID dell'indice RAG creato, o None in caso di errore
+        """
+        if not self.is_initialized:
+            logger.error("RAGStorage non inizializzato correttamente")
+            return None
+            
+        if not results:
+            logger.warning("Nessun risultato da salvare come RAG")
+            return None
+            
+        try:
+            # Genera ID univoco per questa collezione di risultati
+            rag_id = str(uuid.uuid4())[:8]
+            index_dir = os.path.join(self.rag_dir, f"index_{rag_id}")
+            
+            documents, cache_references = self._build_documents(results)
+            
+            if not documents:
+                logger.warning("Nessun documento valido da indicizzare")
+                return None
+            
+            logger.info(f"Creazione indice RAG con {len(documents)} documenti")
+            node_parser = SentenceSplitter(chunk_size=512, chunk_overlap=50)
+            nodes = node_parser.get_nodes_from_documents(documents)
+            
+            # Calcola gli embedding a blocchi, con più richieste in parallelo
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_EMBEDDINGS)
+            
+            async def _embed(batch: list) -> None:
+                texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+                async with semaphore:
+                    embeddings = await self.embed_model.aget_text_embedding_batch(texts)
+                for node, embedding in zip(batch, embeddings):
+                    node.embedding = embedding
+            
+            await asyncio.gather(*[
+                _embed(nodes[start:start + EMBED_BATCH_SIZE])
+                for start in range(0, len(nodes), EMBED_BATCH_SIZE)
+            ])
+            
+            # I nodi hanno già l'embedding: l'indice non effettua altre richieste
+            vector_store, vector_store_type = self._create_vector_store()
+            storage_context = StorageContext.from_defaults(vector_store=vector_store)
+            index = VectorStoreIndex(
+                nodes,
+                storage_context=storage_context,
+                embed_model=self.embed_model,
+                show_progress=False
+            )
+            
+            # Salva indice e metadati su disco in parallelo
+            os.makedirs(index_dir, exist_ok=True)
+            metadata_file = os.path.join(index_dir, "metadata.json")
+            metadata_json = orjson.dumps({
+                "id": rag_id,
+                "task": task,
+                "created_at": datetime.datetime.now().isoformat(),
+                "num_documents": len(documents),
+                "vector_store": vector_store_type,
+                "cache_references": cache_references,
+                "metadata": metadata or {}
+            }, option=orjson.OPT_INDENT_2)
+            
+            async def _write_metadata() -> None:
+                tmp_path = f"{metadata_file}.tmp"
+                async with aiofiles.open(tmp_path, 'wb') as f:
+                    await f.write(metadata_json)
+                os.replace(tmp_path, metadata_file)
+            
+            await asyncio.gather(
+                asyncio.to_thread(index.storage_context.persist, persist_dir=index_dir),
+                _write_metadata()
+            )
             
             logger.info(f"Indice RAG salvato con ID: {rag_id}")
             return rag_id
@@ -172,6 +370,61 @@ class RAGStorage:
             logger.error(traceback.format_exc())
             return None
     
+    def _build_documents(self, results: List[Dict[str, Any]],
+                         existing_urls: Collection[str] = ()) -> Tuple[List[Document], List[Dict[str, Any]]]:
+        """
+        Crea i documenti da indicizzare e i relativi riferimenti alla cache.
+        Gli URL ripetuti tra i risultati vengono indicizzati una sola volta.
+        
+        Args:
+            results (List[Dict[str, Any]]): Risultati di ricerca da indicizzare
+            existing_urls (Collection[str]): URL già presenti nell'indice, da saltare
+            
+        Returns:
+            Tuple[List[Document], List[Dict[str, Any]]]: Documenti e riferimenti alla cache
+        """
+        documents = []
+        cache_references = []
+        seen_urls = set(existing_urls)
+        
+        for result in results:
+            if 'content' in result and result['content']:
+                # Usa URL come ID univoco per il documento
+                url = result.get('link', '')
+                
+                if url in seen_urls:
+                    logger.debug(f"URL già presente nell'indice: {url}")
+                    continue
+                seen_urls.add(url)
+                    
+                title = result.get('title', 'Titolo non disponibile')
+                
+                # Ottieni hash URL per riferimento alla cache
+                cache_file = cache_file_name(url)
+                
+                # Crea documento per l'indicizzazione
+                doc = Document(
+                    text=result['content'],
+                    metadata={
+                        "source": "web",
+                        "url": url,
+                        "title": title,
+                        "relevance_score": result.get('relevance_score', 0.0),
+                        "content_relevance_score": result.get('content_evaluation', {}).get('relevance_score', 0.0),
+                        "cache_file": cache_file
+                    }
+                )
+                documents.append(doc)
+                
+                # Memorizza riferimenti alla cache
+                cache_references.append({
+                    "url": url,
+                    "cache_file": cache_file,
+                    "title": title
+                })
+        
+        return documents, cache_references
+    
     def load_rag_index(self, rag_id: str) -> Optional[Tuple[VectorStoreIndex, Dict[str, Any]]]:
         """
         Carica un indice RAG dal disco.
@@ -189,19 +442,39 @@ class RAGStorage:
         index_dir = os.path.join(self.rag_dir, f"index_{rag_id}")
         metadata_file = os.path.join(index_dir, "metadata.json")
         
-        if not os.path.exists(index_dir) or not os.path.exists(metadata_file):
-            logger.error(f"Indice RAG {rag_id} non trovato")
-            return None
-            
+        # Gli indici con aggiornamenti non ancora salvati vanno letti dalla memoria
+        with _dirty_lock:
+            dirty = _dirty_indices.get(index_dir)
+        if dirty is not None:
+            return dirty[0], dirty[1]
+        
+        with _index_cache_lock:
+            cached = _index_cache.get(index_dir)
+        # Un altro processo (es. la CLI) potrebbe aver aggiornato l'indice su disco
+        mtime = _metadata_mtime(metadata_file)
+        if cached is not None and cached[2] == mtime:
+            return cached[0], cached[1]
+        
         try:
-            # Carica metadati
-            with open(metadata_file, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
+            # Carica metadati (se manca la directory dell'indice manca anche il file)
+            try:
+                with open(metadata_file, 'rb') as f:
+                    metadata = orjson.loads(f.read())
+            except FileNotFoundError:
+                logger.error(f"Indice RAG {rag_id} non trovato")
+                return None
             
-            # Carica indice
-            storage_context = StorageContext.from_defaults(persist_dir=index_dir)
+            # Carica indice (gli indici senza tipo nei metadati usano SimpleVectorStore)
+            if metadata.get("vector_store") == "faiss":
+                vector_store = FaissVectorStore.from_persist_dir(index_dir)
+                storage_context = StorageContext.from_defaults(vector_store=vector_store, persist_dir=index_dir)
+            else:
+                storage_context = StorageContext.from_defaults(persist_dir=index_dir)
             index = load_index_from_storage(storage_context)
             
+            with _index_cache_lock:
+                _index_cache[index_dir] = (index, metadata, mtime)
+            
             return index, metadata
         except Exception as e:
             logger.error(f"Errore durante il caricamento dell'indice RAG {rag_id}: {e}")
@@ -224,6 +497,11 @@ class RAGStorage:
             logger.error("RAGStorage non inizializzato correttamente")
             return None
             
+        cache_key = self._query_cache_key(rag_id, query, similarity_top_k, relevance_threshold)
+        cached = self._cached_query(cache_key)
+        if cached is not None:
+            return cached
+            
         loaded = self.load_rag_index(rag_id)
         if not loaded:
             return None
@@ -231,69 +509,34 @@ class RAGStorage:
         index, metadata = loaded
         
         try:
-            # Crea query engine
-            query_engine = index.as_query_engine(similarity_top_k=similarity_top_k)
-            
-            # Esegui query per ottenere i nodi sorgenti
-            retriever_response = query_engine.retriever.retrieve(query)
-            
-            # Filtra i nodi sorgenti in base alla soglia di rilevanza
-            filtered_nodes = [node for node in retriever_response if node.score >= relevance_threshold]
-            
-            # Se non ci sono nodi sopra la soglia, considera i top 3 comunque
-            if not filtered_nodes and retriever_response:
-                filtered_nodes = sorted(retriever_response, key=lambda x: x.score, reverse=True)[:3]
-                logger.info(f"Nessun nodo sopra la soglia {relevance_threshold}, uso i top 3 disponibili")
-            
-            # Prepara le informazioni sulle fonti
-            sources = []
-            context_texts = []
-            
-            for node in filtered_nodes:
-                source_info = {
-                    "content": node.text,
-                    "score": node.score,
-                    "url": node.metadata.get("url", ""),
-                    "title": node.metadata.get("title", ""),
-                    "cache_file": node.metadata.get("cache_file", "")
-                }
-                sources.append(source_info)
-                context_texts.append(node.text)
+            query_embedding, cached = self._semantic_lookup(cache_key, query)
+            if cached is not None:
+                return cached
             
-            # Genera una risposta utilizzando direttamente OpenAI con OPENAI_MODEL
-            combined_context = "\n\n---\n\n".join(context_texts)
+            with _index_lock(os.path.join(self.rag_dir, f"index_{rag_id}")):
+                sources, context_texts = self._retrieve_sources(index, query, query_embedding, similarity_top_k, relevance_threshold)
+                task = metadata.get("task", "")
             
-            prompt = f"""Basandoti sulle seguenti informazioni, rispondi alla domanda. 
-Includi solo fatti presenti nei dati forniti e non aggiungere informazioni non presenti.
-Se le informazioni fornite non sono sufficienti per rispondere, dillo chiaramente.
-
-INFORMAZIONI:
-{combined_context}
-
-DOMANDA: {query}
-
-RISPOSTA:"""
-            print(prompt)
-
+            # Genera una risposta utilizzando direttamente OpenAI con OPENAI_MODEL
             logger.info(f"Generazione risposta con il modello {OPENAI_MODEL}")
             completion = openai_client.chat.completions.create(
                 model=OPENAI_MODEL,
-                messages=[
-                    {"role": "system", "content": "Sei un assistente di ricerca che risponde alle domande basandosi solo sui dati forniti."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._answer_messages(query, context_texts),
                 temperature=0.3
             )
             
             generated_response = completion.choices[0].message.content
             
-            return {
+            result = {
                 "query": query,
                 "response": generated_response,
                 "sources": sources,
-                "task": metadata.get("task", ""),
+                "task": task,
                 "rag_id": rag_id
             }
+            self._store_query(cache_key, query_embedding, result)
+            
+            return result
             
         except Exception as e:
             logger.error(f"Errore durante l'interrogazione dell'indice RAG {rag_id}: {e}")
@@ -301,6 +544,255 @@ RISPOSTA:"""
             logger.error(traceback.format_exc())
             return None
     
+    def query_rag_index_stream(self, rag_id: str, query: str, similarity_top_k: int = 5,
+                               relevance_threshold: float = 0.6) -> Iterator[Union[str, Dict[str, Any]]]:
+        """
+        Interroga un indice RAG restituendo la risposta man mano che viene generata.
+        
+        Args:
+            rag_id (str): ID dell'indice RAG da interrogare
+            query (str): Query di ricerca
+            similarity_top_k (int): Numero di risultati simili da restituire
+            relevance_threshold (float): Soglia minima di rilevanza per includere un risultato
+            
+        Returns:
+            Iterator[Union[str, Dict[str, Any]]]: Frammenti di testo della risposta seguiti da un
+                                                   dizionario finale nel formato di query_rag_index
+                                                   (nessun elemento in caso di errore)
+        """
+        if not self.is_initialized:
+            logger.error("RAGStorage non inizializzato correttamente")
+            return
+            
+        cache_key = self._query_cache_key(rag_id, query, similarity_top_k, relevance_threshold)
+        cached = self._cached_query(cache_key)
+        if cached is not None:
+            yield cached["response"]
+            yield cached
+            return
+            
+        loaded = self.load_rag_index(rag_id)
+        if not loaded:
+            return
+            
+        index, metadata = loaded
+        
+        try:
+            query_embedding, cached = self._semantic_lookup(cache_key, query)
+            if cached is not None:
+                yield cached["response"]
+                yield cached
+                return
+            
+            with _index_lock(os.path.join(self.rag_dir, f"index_{rag_id}")):
+                sources, context_texts = self._retrieve_sources(index, query, query_embedding, similarity_top_k, relevance_threshold)
+                task = metadata.get("task", "")
+            
+            logger.info(f"Generazione risposta in streaming con il modello {OPENAI_MODEL}")
+            stream = openai_client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=self._answer_messages(query, context_texts),
+                temperature=0.3,
+                stream=True
+            )
+            
+            response_parts = []
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    response_parts.append(delta)
+                    yield delta
+            
+            result = {
+                "query": query,
+                "response": "".join(response_parts),
+                "sources": sources,
+                "task": task,
+                "rag_id": rag_id
+            }
+            self._store_query(cache_key, query_embedding, result)
+            
+            yield result
+            
+        except Exception as e:
+            logger.error(f"Errore durante l'interrogazione in streaming dell'indice RAG {rag_id}: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+    
+    def _semantic_lookup(self, cache_key: tuple, query: str) -> Tuple[Optional[List[float]], Optional[Dict[str, Any]]]:
+        """
+        Calcola l'embedding della query e cerca in cache la risposta a una query simile.
+        L'embedding viene poi riutilizzato dal retriever, così è calcolato una sola volta.
+        
+        Args:
+            cache_key (tuple): Chiave calcolata da _query_cache_key
+            query (str): Query di ricerca
+            
+        Returns:
+            Tuple[Optional[List[float]], Optional[Dict[str, Any]]]: Embedding della query (None se la
+                                                                    cache semantica è disattivata) e
+                                                                    risposta memorizzata, se presente
+        """
+        if self.semantic_cache_threshold is None:
+            return None, None
+        query_embedding = self.embed_model.get_query_embedding(query)
+        return query_embedding, self._cached_query(cache_key, query_embedding)
+    
+    def _retrieve_sources(self, index: VectorStoreIndex, query: str, query_embedding: Optional[List[float]],
+                          similarity_top_k: int, relevance_threshold: float) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        Recupera dall'indice i nodi rilevanti per la query.
+        
+        Args:
+            index (VectorStoreIndex): Indice RAG da interrogare
+            query (str): Query di ricerca
+            query_embedding (Optional[List[float]]): Embedding già calcolato della query
+            similarity_top_k (int): Numero di risultati simili da restituire
+            relevance_threshold (float): Soglia minima di rilevanza per includere un risultato
+            
+        Returns:
+            Tuple[List[Dict[str, Any]], List[str]]: Informazioni sulle fonti e testi da usare come contesto
+        """
+        # Crea query engine
+        query_engine = index.as_query_engine(similarity_top_k=similarity_top_k)
+        
+        # Esegui query per ottenere i nodi sorgenti
+        retriever_response = query_engine.retriever.retrieve(
+            QueryBundle(query_str=query, embedding=query_embedding)
+        )
+        
+        # Filtra i nodi sorgenti in base alla soglia di rilevanza
+        filtered_nodes = [node for node in retriever_response if node.score >= relevance_threshold]
+        
+        # Se non ci sono nodi sopra la soglia, considera i top 3 comunque
+        if not filtered_nodes and retriever_response:
+            filtered_nodes = sorted(retriever_response, key=lambda x: x.score, reverse=True)[:3]
+            logger.info(f"Nessun nodo sopra la soglia {relevance_threshold}, uso i top 3 disponibili")
+        
+        # Prepara le informazioni sulle fonti
+        sources = []
+        context_texts = []
+        
+        for node in filtered_nodes:
+            source_info = {
+                "content": node.text,
+                "score": node.score,
+                "url": node.metadata.get("url", ""),
+                "title": node.metadata.get("title", ""),
+                "cache_file": node.metadata.get("cache_file", "")
+            }
+            sources.append(source_info)
+            context_texts.append(node.text)
+        
+        return sources, context_texts
+    
+    def _answer_messages(self, query: str, context_texts: List[str]) -> List[Dict[str, str]]:
+        """
+        Costruisce i messaggi per la generazione della risposta a partire dal contesto recuperato.
+        
+        Args:
+            query (str): Query di ricerca
+            context_texts (List[str]): Testi dei nodi recuperati
+            
+        Returns:
+            List[Dict[str, str]]: Messaggi per la chat completion
+        """
+        # Il prompt è composto con un'unica join, senza creare prima il contesto unito
+        parts = [ANSWER_PROMPT_HEADER]
+        for i, text in enumerate(context_texts):
+            if i:
+                parts.append(CONTEXT_SEPARATOR)
+            parts.append(text)
+        parts.append(f"\n\nDOMANDA: {query}\n\nRISPOSTA:")
+        prompt = "".join(parts)
+        logger.debug("Prompt: %s", prompt)
+        
+        return [
+            {"role": "system", "content": ANSWER_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _store_query(self, cache_key: tuple, query_embedding: Optional[List[float]], result: Dict[str, Any]) -> None:
+        """
+        Memorizza la risposta a una query nella cache.
+        
+        Args:
+            cache_key (tuple): Chiave calcolata da _query_cache_key
+            query_embedding (Optional[List[float]]): Embedding della query per la ricerca semantica
+            result (Dict[str, Any]): Risposta da memorizzare
+        """
+        normalized = _normalize(query_embedding) if query_embedding is not None else None
+        with _query_cache_lock:
+            _query_cache[cache_key] = (normalized, dict(result))
+    
+    def _query_cache_key(self, rag_id: str, query: str, similarity_top_k: int, relevance_threshold: float) -> tuple:
+        """
+        Calcola la chiave della cache delle query. La chiave include la data di modifica
+        di metadata.json: le risposte memorizzate prima che un altro processo (es. la CLI)
+        aggiornasse l'indice su disco non vengono più restituite.
+        
+        Args:
+            rag_id (str): ID dell'indice RAG interrogato
+            query (str): Query di ricerca
+            similarity_top_k (int): Numero di risultati simili richiesti
+            relevance_threshold (float): Soglia minima di rilevanza
+            
+        Returns:
+            tuple: (directory RAG, ID indice, query, top_k, soglia arrotondata, mtime dei metadati)
+        """
+        mtime = _metadata_mtime(os.path.join(self.rag_dir, f"index_{rag_id}", "metadata.json"))
+        return (self.rag_dir, rag_id, query, similarity_top_k, round(relevance_threshold, 3), mtime)
+    
+    def _cached_query(self, cache_key: tuple, query_embedding: Optional[List[float]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Restituisce la risposta memorizzata per la stessa query o, se viene fornito
+        l'embedding, per una query sufficientemente simile sullo stesso indice.
+        
+        Args:
+            cache_key (tuple): Chiave calcolata da _query_cache_key
+            query_embedding (Optional[List[float]]): Embedding della query per la ricerca semantica
+            
+        Returns:
+            Optional[Dict[str, Any]]: Copia della risposta memorizzata o None
+        """
+        with _query_cache_lock:
+            entry = _query_cache.get(cache_key)
+            
+            if entry is None and query_embedding is not None:
+                vector = _normalize(query_embedding)
+                best_score = self.semantic_cache_threshold
+                for key in list(_query_cache):
+                    # Confronta solo query sulla stessa versione dell'indice e con gli stessi parametri
+                    if key[:2] != cache_key[:2] or key[3:] != cache_key[3:]:
+                        continue
+                    candidate = _query_cache[key]
+                    if candidate[0] is None:
+                        continue
+                    score = float(np.dot(vector, candidate[0]))
+                    if score >= best_score:
+                        best_score = score
+                        entry = candidate
+        
+        if entry is None:
+            return None
+        logger.info(f"Risposta alla query letta dalla cache per l'indice RAG {cache_key[1]}")
+        # Copia: i chiamanti possono modificare il dizionario restituito
+        return dict(entry[1], query=cache_key[2])
+    
+    def _invalidate_query_cache(self, rag_id: str) -> None:
+        """
+        Rimuove dalla cache le risposte di un indice che è stato modificato.
+        
+        Args:
+            rag_id (str): ID dell'indice RAG aggiornato
+        """
+        with _query_cache_lock:
+            stale = [key for key in _query_cache if key[:2] == (self.rag_dir, rag_id)]
+            for key in stale:
+                del _query_cache[key]
+    
     def list_rag_indices(self) -> List[Dict[str, Any]]:
         """
         Elenca tutti gli indici RAG disponibili.
@@ -308,24 +800,148 @@ RISPOSTA:"""
         Returns:
             List[Dict[str, Any]]: Lista di metadati degli indici RAG
         """
-        indices = []
+        # scandir fornisce il tipo di ogni voce senza una stat per file
+        try:
+            with os.scandir(self.rag_dir) as entries:
+                metadata_files = [
+                    os.path.join(entry.path, "metadata.json")
+                    for entry in entries
+                    if entry.name.startswith("index_") and entry.is_dir()
+                ]
+        except FileNotFoundError:
+            return []
         
-        if os.path.exists(self.rag_dir):
-            for dirname in os.listdir(self.rag_dir):
-                if dirname.startswith("index_"):
-                    metadata_file = os.path.join(self.rag_dir, dirname, "metadata.json")
-                    
-                    if os.path.exists(metadata_file):
-                        try:
-                            with open(metadata_file, 'r', encoding='utf-8') as f:
-                                metadata = json.load(f)
-                                indices.append(metadata)
-                        except Exception as e:
-                            logger.error(f"Errore nella lettura dei metadati dell'indice {dirname}: {e}")
-        
-        return indices
+        if not metadata_files:
+            return []
+        
+        # Le letture sono indipendenti: eseguendole in parallelo la latenza di I/O si sovrappone
+        with ThreadPoolExecutor(max_workers=min(METADATA_READ_WORKERS, len(metadata_files))) as executor:
+            return [metadata for metadata in executor.map(self._read_metadata, metadata_files) if metadata]
+    
+    def flush(self, rag_id: Optional[str] = None) -> bool:
+        """
+        Salva su disco gli aggiornamenti differiti degli indici RAG.
+        
+        Args:
+            rag_id (Optional[str]): ID dell'indice da salvare (None per tutti gli indici in sospeso)
+            
+        Returns:
+            bool: True se tutti i salvataggi sono riusciti, False altrimenti
+        """
+        global _flush_timer
+        with _dirty_lock:
+            if rag_id is None:
+                index_dirs = list(_dirty_indices)
+                # Gli aggiornamenti successivi pianificano un nuovo salvataggio
+                _flush_timer = None
+            else:
+                index_dirs = [os.path.join(self.rag_dir, f"index_{rag_id}")]
+        
+        success = True
+        for index_dir in index_dirs:
+            # La voce viene prelevata sotto il lock dell'indice: un aggiornamento fallito
+            # la rimuove prima che un salvataggio possa scrivere l'indice modificato a metà
+            with _index_lock(index_dir):
+                with _dirty_lock:
+                    entry = _dirty_indices.pop(index_dir, None)
+                if entry is None:
+                    continue
+                
+                index, metadata, _ = entry
+                try:
+                    self._persist_index(index_dir, index, metadata)
+                except Exception as e:
+                    logger.error(f"Errore durante il salvataggio dell'indice RAG in {index_dir}: {e}")
+                    # Resta in sospeso per il prossimo salvataggio
+                    with _dirty_lock:
+                        _dirty_indices.setdefault(index_dir, [index, metadata, 0])
+                    success = False
+        return success
+    
+    def _mark_dirty(self, index_dir: str, index: VectorStoreIndex, metadata: Dict[str, Any]) -> bool:
+        """
+        Registra un aggiornamento non ancora salvato e pianifica il salvataggio differito.
+        
+        Args:
+            index_dir (str): Directory dell'indice aggiornato
+            index (VectorStoreIndex): Indice aggiornato in memoria
+            metadata (Dict[str, Any]): Metadati aggiornati dell'indice
+            
+        Returns:
+            bool: True se gli aggiornamenti in sospeso vanno salvati subito
+        """
+        global _flush_timer, _flush_at_exit_registered
+        with _dirty_lock:
+            entry = _dirty_indices.setdefault(index_dir, [index, metadata, 0])
+            entry[2] += 1
+            if entry[2] >= FLUSH_MAX_PENDING_UPDATES:
+                return True
+            
+            if _flush_timer is None or not _flush_timer.is_alive():
+                _flush_timer = threading.Timer(FLUSH_INTERVAL, self.flush)
+                _flush_timer.daemon = True
+                _flush_timer.start()
+            if not _flush_at_exit_registered:
+                atexit.register(self.flush)
+                _flush_at_exit_registered = True
+        return False
+    
+    def _persist_index(self, index_dir: str, index: VectorStoreIndex, metadata: Dict[str, Any]) -> None:
+        """
+        Salva su disco un indice RAG e i relativi metadati.
+        
+        Args:
+            index_dir (str): Directory dell'indice
+            index (VectorStoreIndex): Indice da salvare
+            metadata (Dict[str, Any]): Metadati dell'indice
+        """
+        index.storage_context.persist(persist_dir=index_dir)
+        self._write_metadata(os.path.join(index_dir, "metadata.json"), metadata)
+    
+    def _write_metadata(self, metadata_file: str, metadata: Dict[str, Any]) -> None:
+        """
+        Scrive il file dei metadati di un indice RAG in modo atomico: i dati serializzati
+        vanno in un file temporaneo che poi sostituisce quello esistente, così
+        un'interruzione durante la scrittura non lascia l'indice con metadati corrotti.
+        
+        Args:
+            metadata_file (str): Percorso del file metadata.json
+            metadata (Dict[str, Any]): Metadati da salvare
+        """
+        data = orjson.dumps(metadata, option=orjson.OPT_INDENT_2)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(metadata_file), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, metadata_file)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    
+    def _read_metadata(self, metadata_file: str) -> Optional[Dict[str, Any]]:
+        """
+        Legge il file dei metadati di un indice RAG.
+        
+        Args:
+            metadata_file (str): Percorso del file metadata.json
+            
+        Returns:
+            Optional[Dict[str, Any]]: Metadati dell'indice, o None se assenti o non leggibili
+        """
+        try:
+            with open(metadata_file, 'rb') as f:
+                return orjson.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            dirname = os.path.basename(os.path.dirname(metadata_file))
+            logger.error(f"Errore nella lettura dei metadati dell'indice {dirname}: {e}")
+            return None
 
-    def update_rag_index(self, rag_id: str, task: str, new_results: List[Dict[str, Any]]) -> bool:
+    def update_rag_index(self, rag_id: str, task: str, new_results: List[Dict[str, Any]], persist: bool = True) -> bool:
         """
         Aggiorna un indice RAG esistente con nuovi risultati.
         
@@ -333,6 +949,8 @@ RISPOSTA:"""
             rag_id (str): ID dell'indice RAG da aggiornare
             task (str): Il task di ricerca associato ai nuovi risultati
             new_results (List[Dict[str, Any]]): I nuovi risultati di ricerca da aggiungere
+            persist (bool): Se False il salvataggio su disco viene differito e accorpato con
+                            gli aggiornamenti successivi (vedi flush)
             
         Returns:
             bool: True se l'aggiornamento è riuscito, False altrimenti
@@ -345,93 +963,74 @@ RISPOSTA:"""
             logger.warning("Nessun risultato da aggiungere al RAG")
             return False
             
-        # Verifica se l'indice esiste già
-        loaded = self.load_rag_index(rag_id)
-        if not loaded:
-            logger.info(f"L'indice RAG {rag_id} non esiste, ne verrà creato uno nuovo")
-            new_rag_id = self.save_results_as_rag(task, new_results)
-            return new_rag_id == rag_id
-            
-        index, metadata = loaded
         index_dir = os.path.join(self.rag_dir, f"index_{rag_id}")
         
-        try:
-            # Crea documenti da nuovi risultati di ricerca
-            documents = []
-            existing_cache_references = metadata.get("cache_references", [])
-            existing_urls = {ref.get("url", "") for ref in existing_cache_references}
-            new_cache_references = []
-            
-            for result in new_results:
-                if 'content' in result and result['content']:
-                    # Usa URL come ID univoco per il documento
-                    url = result.get('link', '')
-                    
-                    # Salta i risultati già presenti nell'indice (basati sull'URL)
-                    if url in existing_urls:
-                        logger.debug(f"URL già presente nell'indice: {url}")
-                        continue
-                        
-                    title = result.get('title', 'Titolo non disponibile')
-                    
-                    # Ottieni hash URL per riferimento alla cache
-                    url_hash = hashlib.md5(url.encode()).hexdigest()
-                    cache_file = f"{url_hash}.json"
-                    
-                    # Crea documento per l'indicizzazione
-                    doc = Document(
-                        text=result['content'],
-                        metadata={
-                            "source": "web",
-                            "url": url,
-                            "title": title,
-                            "relevance_score": result.get('relevance_score', 0.0),
-                            "content_relevance_score": result.get('content_evaluation', {}).get('relevance_score', 0.0),
-                            "cache_file": cache_file
-                        }
-                    )
-                    documents.append(doc)
-                    
-                    # Memorizza riferimenti alla cache
-                    new_cache_references.append({
-                        "url": url,
-                        "cache_file": cache_file,
-                        "title": title
-                    })
-            
-            if not documents:
-                logger.warning("Nessun nuovo documento valido da aggiungere all'indice")
-                return True  # Consideriamo questo un successo (nessuna modifica necessaria)
-            
-            # Aggiorna indice con i nuovi documenti
-            logger.info(f"Aggiunta di {len(documents)} nuovi documenti all'indice RAG {rag_id}")
-            node_parser = SentenceSplitter(chunk_size=512, chunk_overlap=50)
-            
-            # Aggiungiamo i nuovi documenti all'indice esistente
-            for doc in documents:
-                index.insert(doc)
+        # L'indice in cache è condiviso: l'aggiornamento esclude retrieval e salvataggi concorrenti
+        with _index_lock(index_dir):
+            # Verifica se l'indice esiste già
+            loaded = self.load_rag_index(rag_id)
+            if not loaded:
+                logger.info(f"L'indice RAG {rag_id} non esiste, ne verrà creato uno nuovo")
+                new_rag_id = self.save_results_as_rag(task, new_results)
+                return new_rag_id == rag_id
                 
-            # Salva indice aggiornato su disco
-            index.storage_context.persist(persist_dir=index_dir)
+            index, metadata = loaded
             
-            # Aggiorna e salva metadati dell'indice
-            metadata["cache_references"].extend(new_cache_references)
-            metadata["num_documents"] = metadata.get("num_documents", 0) + len(documents)
-            metadata["updated_at"] = datetime.datetime.now().isoformat()
-            metadata["task"] = f"{metadata.get('task', '')} + {task}"
-            
-            metadata_file = os.path.join(index_dir, "metadata.json")
-            with open(metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=2)
-            
-            logger.info(f"Indice RAG {rag_id} aggiornato con successo")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Errore durante l'aggiornamento dell'indice RAG {rag_id}: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
-            return False
+            try:
+                # Crea documenti da nuovi risultati di ricerca, saltando quelli già presenti
+                # nell'indice (basati sull'URL)
+                existing_cache_references = metadata.get("cache_references", [])
+                existing_urls = {ref.get("url", "") for ref in existing_cache_references}
+                documents, new_cache_references = self._build_documents(new_results, existing_urls)
+                
+                if not documents:
+                    logger.warning("Nessun nuovo documento valido da aggiungere all'indice")
+                    return True  # Consideriamo questo un successo (nessuna modifica necessaria)
+                
+                # Aggiorna indice con i nuovi documenti
+                logger.info(f"Aggiunta di {len(documents)} nuovi documenti all'indice RAG {rag_id}")
+                node_parser = SentenceSplitter(chunk_size=512, chunk_overlap=50)
+                
+                # Aggiungiamo i nuovi documenti all'indice esistente in un'unica operazione,
+                # così gli embedding di tutti i nodi vengono calcolati a blocchi
+                index.insert_nodes(node_parser.get_nodes_from_documents(documents))
+                
+                # Aggiorna metadati dell'indice
+                metadata["cache_references"].extend(new_cache_references)
+                metadata["num_documents"] = metadata.get("num_documents", 0) + len(documents)
+                metadata["updated_at"] = datetime.datetime.now().isoformat()
+                metadata["task"] = f"{metadata.get('task', '')} + {task}"
+                
+                # Salva indice e metadati su disco, subito o insieme ai prossimi aggiornamenti
+                if persist:
+                    self._persist_index(index_dir, index, metadata)
+                    with _dirty_lock:
+                        _dirty_indices.pop(index_dir, None)
+                elif self._mark_dirty(index_dir, index, metadata):
+                    self.flush(rag_id)
+                
+                # Le risposte memorizzate non tengono conto dei nuovi documenti
+                self._invalidate_query_cache(rag_id)
+                
+                # L'indice e i metadati in cache sono stati aggiornati sul posto
+                mtime = _metadata_mtime(os.path.join(index_dir, "metadata.json"))
+                with _index_cache_lock:
+                    _index_cache[index_dir] = (index, metadata, mtime)
+                
+                logger.info(f"Indice RAG {rag_id} aggiornato con successo")
+                return True
+                
+            except Exception as e:
+                # L'indice in memoria potrebbe essere stato modificato solo in parte: non va
+                # più restituito né salvato (si perdono anche gli aggiornamenti differiti)
+                with _index_cache_lock:
+                    _index_cache.pop(index_dir, None)
+                with _dirty_lock:
+                    _dirty_indices.pop(index_dir, None)
+                logger.error(f"Errore durante l'aggiornamento dell'indice RAG {rag_id}: {e}")
+                import traceback
+                logger.error(traceback.format_exc())
+                return False
             
     def get_or_create_unified_rag(self, rag_id: str) -> Optional[str]:
         """
@@ -455,7 +1054,7 @@ RISPOSTA:"""
             os.makedirs(index_dir, exist_ok=True)
             
             # Crea un indice vuoto
-            vector_store = SimpleVectorStore()
+            vector_store, vector_store_type = self._create_vector_store()
             storage_context = StorageContext.from_defaults(vector_store=vector_store)
             index = VectorStoreIndex([], storage_context=storage_context)
             
@@ -464,17 +1063,17 @@ RISPOSTA:"""
             
             # Salva metadati dell'indice
             metadata_file = os.path.join(index_dir, "metadata.json")
-            with open(metadata_file, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "id": rag_id,
-                    "task": "Indice RAG unificato",
-                    "created_at": datetime.datetime.now().isoformat(),
-                    "num_documents": 0,
-                    "cache_references": [],
-                    "metadata": {
-                        "type": "unified"
-                    }
-                }, f, ensure_ascii=False, indent=2)
+            self._write_metadata(metadata_file, {
+                "id": rag_id,
+                "task": "Indice RAG unificato",
+                "created_at": datetime.datetime.now().isoformat(),
+                "num_documents": 0,
+                "vector_store": vector_store_type,
+                "cache_references": [],
+                "metadata": {
+                    "type": "unified"
+                }
+            })
             
             logger.info(f"Indice RAG unificato creato con ID: {rag_id}")
             return rag_id
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# agents/relevance_cache.py
+
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+
+from config import OPENAI_EMBEDDING_MODEL
+from agents.openai_client import client
+
+logger = logging.getLogger('relevance_cache')
+
+# Numero massimo di valutazioni memorizzate (le meno usate di recente vengono sostituite)
+MAX_CACHE_ENTRIES = 10000
+
+# Similarità coseno oltre la quale una coppia (query, risultato) è considerata già valutata
+SIMILARITY_THRESHOLD = 0.95
+
+class RelevanceCache:
+    """
+    Cache semantica dei punteggi di rilevanza: ogni coppia (query, risultato) è rappresentata
+    dal suo embedding normalizzato e una nuova coppia riusa il punteggio della più simile
+    se la similarità coseno supera la soglia.
+    """
+    
+    def __init__(self, max_entries: int = MAX_CACHE_ENTRIES, threshold: float = SIMILARITY_THRESHOLD):
+        """
+        Inizializza la cache.
+        
+        Args:
+            max_entries (int): Numero massimo di valutazioni memorizzate
+            threshold (float): Similarità minima per riutilizzare un punteggio
+        """
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._vectors = None  # matrice (max_entries, dimensione), allocata al primo inserimento
+        self._scores = np.zeros(max_entries, dtype=np.float32)
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._size = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+    
+    def lookup(self, vectors: np.ndarray) -> List[Optional[float]]:
+        """
+        Cerca i punteggi memorizzati per un insieme di embedding con un unico prodotto matriciale.
+        
+        Args:
+            vectors (np.ndarray): Embedding normalizzati, uno per riga
+            
+        Returns:
+            List[Optional[float]]: Punteggio memorizzato per ciascun embedding, o None se assente
+        """
+        with self._lock:
+            if not self._size:
+                return [None] * len(vectors)
+            
+            similarities = vectors @ self._vectors[:self._size].T
+            best = similarities.argmax(axis=1)
+            
+            scores = []
+            for row, slot in enumerate(best):
+                if similarities[row, slot] >= self.threshold:
+                    self._clock += 1
+                    self._last_used[slot] = self._clock
+                    scores.append(float(self._scores[slot]))
+                else:
+                    scores.append(None)
+            return scores
+    
+    def add(self, vectors: np.ndarray, scores: List[float]) -> None:
+        """
+        Memorizza i punteggi calcolati, sostituendo le voci meno usate di recente se la cache è piena.
+        
+        Args:
+            vectors (np.ndarray): Embedding normalizzati, uno per riga
+            scores (List[float]): Punteggi corrispondenti
+        """
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vectors.shape[1]), dtype=np.float32)
+            
+            for vector, score in zip(vectors, scores):
+                if self._size < self.max_entries:
+                    slot = self._size
+                    self._size += 1
+                else:
+                    slot = int(self._last_used.argmin())
+                self._clock += 1
+                self._vectors[slot] = vector
+                self._scores[slot] = score
+                self._last_used[slot] = self._clock
+
+_cache = RelevanceCache()
+
+def _cache_text(query: str, result: Dict[str, Any]) -> str:
+    return f"{query}||{result.get('title', '')}||{result.get('description', '')}"
+
+def embed_results(query: str, results: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+    """
+    Calcola con un'unica richiesta gli embedding normalizzati delle coppie (query, risultato).
+    
+    Args:
+        query (str): La query di ricerca
+        results (List[Dict[str, Any]]): Risultati di ricerca
+        
+    Returns:
+        Optional[np.ndarray]: Embedding uno per riga, o None in caso di errore
+    """
+    try:
+        response = client.embeddings.create(
+            model=OPENAI_EMBEDDING_MODEL,
+            input=[_cache_text(query, result) for result in results]
+        )
+    except Exception as e:
+        logger.warning(f"Errore nel calcolo degli embedding per la cache di rilevanza: {e}")
+        return None
+    
+    vectors = np.asarray([item.embedding for item in response.data], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def get_cached_scores(query: str, results: List[Dict[str, Any]]) -> Tuple[List[Optional[float]], Optional[np.ndarray]]:
+    """
+    Restituisce i punteggi già noti per i risultati e i loro embedding, da passare
+    a store_scores per i risultati valutati successivamente.
+    
+    Args:
+        query (str): La query di ricerca
+        results (List[Dict[str, Any]]): Risultati di ricerca
+        
+    Returns:
+        Tuple[List[Optional[float]], Optional[np.ndarray]]: Punteggi memorizzati (None se assenti)
+                                                             ed embedding dei risultati
+    """
+    if not results:
+        return [], None
+    
+    vectors = embed_results(query, results)
+    if vectors is None:
+        return [None] * len(results), None
+    
+    return _cache.lookup(vectors), vectors
+
+def store_scores(vectors: Optional[np.ndarray], scores: List[float]) -> None:
+    """
+    Memorizza i punteggi calcolati per gli embedding restituiti da get_cached_scores.
+    
+    Args:
+        vectors (Optional[np.ndarray]): Embedding dei risultati valutati
+        scores (List[float]): Punteggi corrispondenti
+    """
+    if vectors is None or not len(scores):
+        return
+    _cache.add(vectors, scores)
\ No newline at end of file
@@ -1,44 +1,450 @@
 # agents/relevance_filter.py
 
-import openai
-from typing import List, Dict, Any, Optional
-from config import OPENAI_API_KEY, OPENAI_MODEL
+import re
+import heapq
+import importlib.util
+import asyncio
+import functools
+import logging
+import threading
+import numpy as np
+import orjson
+from operator import itemgetter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, TYPE_CHECKING
+from config import OPENAI_MODEL, OPENAI_EMBEDDING_MODEL
+from agents.openai_client import client
+from agents.relevance_cache import get_cached_scores, store_scores
 
-# Configure OpenAI
-openai.api_key = OPENAI_API_KEY
+# tiktoken e sentence-transformers (che carica torch) sono importati solo quando servono,
+# per non rallentare l'avvio
+if TYPE_CHECKING:
+    import tiktoken
+    from sentence_transformers import SentenceTransformer
+
+# Numero massimo di risultati valutati in parallelo
+DEFAULT_MAX_CONCURRENCY = 16
+
+# Le valutazioni con OpenAI richieste entro questa finestra (in secondi) vengono raggruppate,
+# salvo che se ne accumulino prima COALESCE_FLUSH_SIZE
+COALESCE_WINDOW = 0.05
+COALESCE_FLUSH_SIZE = 10
+COALESCE_MAX_BATCH = 20  # risultati massimi per prompt
+
+# Numero di valutazioni identiche (query, titolo, descrizione, URL) memorizzate
+SCORE_CACHE_SIZE = 4096
+
+# Token disponibili per prompt e risposta di una valutazione in batch, lasciando
+# margine per la formattazione dei messaggi
+MODEL_CONTEXT_TOKENS = 128000
+BATCH_PROMPT_MAX_TOKENS = MODEL_CONTEXT_TOKENS - 500
+
+# Limite di output dei modelli OpenAI correnti
+MODEL_MAX_OUTPUT_TOKENS = 16384
+
+# Token di risposta riservati a ciascun punteggio (es. "0.85, ") e all'oggetto JSON che li contiene
+BATCH_TOKENS_PER_SCORE = 6
+BATCH_RESPONSE_OVERHEAD = 20
+
+# Risultati massimi per gruppo, perché i punteggi rientrino nel limite di output
+BATCH_MAX_RESULTS = (MODEL_MAX_OUTPUT_TOKENS - BATCH_RESPONSE_OVERHEAD) // BATCH_TOKENS_PER_SCORE
+
+# Parole senza contenuto ignorate dal filtro lessicale (italiano e inglese)
+_STOPWORDS = frozenset("""
+a ad al allo ai agli all alla alle anche che chi ci come con col cosa da dal dallo dai dagli dall dalla dalle
+del dello dei degli dell della delle di e ed gli i il in l la le lo ma mi ne nel nello nei negli nell nella
+nelle non o per più quale quali quando se si sono su sul sullo sui sugli sull sulla sulle tra fra un una uno
+è
+about an and are as at be by for from how in is it of on or that the this to was what when where which who
+why will with
+""".split())
+_RE_WORDS = re.compile(r"\w+")
+
+# Modello locale usato per il punteggio di rilevanza basato sulla similarità degli embedding
+LOCAL_EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+LOCAL_ENCODE_BATCH_SIZE = 64
+
+_local_model = None
+_local_model_lock = threading.Lock()
+_local_model_warned = False
+
+def _get_local_model() -> Optional["SentenceTransformer"]:
+    """
+    Restituisce il modello sentence-transformers, importando la libreria e caricando
+    il modello al primo utilizzo.
+    
+    Returns:
+        Optional[SentenceTransformer]: Modello di embedding condiviso, o None se
+        sentence-transformers non è installato
+    """
+    global _local_model, _local_model_warned
+    if _local_model is None:
+        with _local_model_lock:
+            if _local_model is None:
+                if importlib.util.find_spec("sentence_transformers") is None:
+                    if not _local_model_warned:
+                        _local_model_warned = True
+                        logging.getLogger('relevance_filter').warning("sentence-transformers non è installato, la rilevanza verrà valutata con OpenAI. Esegui 'pip install sentence-transformers'")
+                    return None
+                
+                from sentence_transformers import SentenceTransformer
+                _local_model = SentenceTransformer(LOCAL_EMBEDDING_MODEL)
+    return _local_model
+
+def embedding_relevance_scores(search_results: List[Dict[str, Any]], query: str) -> np.ndarray:
+    """
+    Calcola localmente la rilevanza dei risultati come similarità coseno tra la query
+    e il testo di titolo e descrizione, codificati in un'unica chiamata al modello.
+    
+    Args:
+        search_results (List[Dict[str, Any]]): Risultati di ricerca da valutare
+        query (str): La query di ricerca originale
+        
+    Returns:
+        np.ndarray: Punteggi tra 0 e 1 nello stesso ordine dei risultati
+    """
+    texts = [f"{result.get('title', '')} {result.get('description', '')}" for result in search_results]
+    vectors = _get_local_model().encode(
+        [query] + texts,
+        batch_size=LOCAL_ENCODE_BATCH_SIZE,
+        normalize_embeddings=True,
+        convert_to_numpy=True
+    )
+    
+    # Gli embedding sono normalizzati: il prodotto scalare è la similarità coseno, riportata da [-1, 1] a [0, 1]
+    return (vectors[1:] @ vectors[0] + 1) / 2
+
+def embedding_batch_scores(search_results: List[Dict[str, Any]], query: str) -> Optional[np.ndarray]:
+    """
+    Calcola la rilevanza dei risultati come similarità coseno tra gli embedding OpenAI della query
+    e di titolo e descrizione, ottenuti tutti con una sola richiesta.
+    
+    Args:
+        search_results (List[Dict[str, Any]]): Risultati di ricerca da valutare
+        query (str): La query di ricerca originale
+        
+    Returns:
+        Optional[np.ndarray]: Punteggi tra 0 e 1 nello stesso ordine dei risultati, o None in caso di errore
+    """
+    inputs = [query] + [f"{result.get('title', '')}\n{result.get('description', '')}" for result in search_results]
+    try:
+        response = client.embeddings.create(model=OPENAI_EMBEDDING_MODEL, input=inputs)
+    except Exception as e:
+        print(f"Errore nel calcolo degli embedding dei risultati: {e}")
+        return None
+    
+    vectors = np.asarray([item.embedding for item in response.data], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    
+    # Stessa scala di embedding_relevance_scores: similarità coseno riportata da [-1, 1] a [0, 1]
+    return (vectors[1:] @ vectors[0] + 1) / 2
 
 def filter_relevant_results(search_results: List[Dict[str, Any]], 
                            query: str, 
-                           threshold: float = 0.7) -> List[Dict[str, Any]]:
+                           threshold: float = 0.7,
+                           max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                           use_llm: bool = False,
+                           top_k: Optional[int] = None,
+                           prefilter: bool = False) -> List[Dict[str, Any]]:
     """
-    Filtra i risultati di ricerca in base alla loro rilevanza rispetto alla query originale usando OpenAI.
+    Filtra i risultati di ricerca in base alla loro rilevanza rispetto alla query originale.
+    Per impostazione predefinita la rilevanza è la similarità degli embedding calcolata localmente;
+    con use_llm le valutazioni dei singoli risultati vengono chieste a OpenAI in parallelo.
     
     Args:
         search_results (List[Dict[str, Any]]): Lista di risultati di ricerca da google_search
         query (str): La query di ricerca originale
         threshold (float): Punteggio minimo di rilevanza (0-1) per includere i risultati
+        max_concurrency (int): Numero massimo di valutazioni contemporanee con OpenAI
+        use_llm (bool): Se valutare la rilevanza con OpenAI invece che con il modello locale
+        top_k (Optional[int]): Se indicato, restituisce solo i top_k risultati più rilevanti tra quelli sopra la soglia
+        prefilter (bool): Se scartare senza valutarli i risultati che non hanno parole in comune con la query.
+                          Da attivare solo se query e risultati sono nella stessa lingua: un risultato
+                          in inglese per una query in italiano può essere rilevante senza parole in comune
         
     Returns:
         List[Dict[str, Any]]: Lista filtrata di risultati di ricerca rilevanti
     """
+    # I risultati con punteggio lessicale nullo non supererebbero una soglia positiva
+    if prefilter and threshold > 0:
+        search_results = [
+            result for result in search_results
+            if _lexical_floor(query, f"{result.get('title', '')} {result.get('description', '')}") is None
+        ]
+    
     if not search_results:
         return []
     
+    if use_llm or _get_local_model() is None:
+        scores = _llm_relevance_scores(search_results, query, max_concurrency)
+    else:
+        scores = embedding_relevance_scores(search_results, query).tolist()
+    
     filtered_results = []
     
-    for result in search_results:
-        relevance_score = evaluate_result_relevance(result, query)
+    for result, relevance_score in zip(search_results, scores):
+        # I risultati sotto la soglia vengono scartati senza modificarli
+        if relevance_score < threshold:
+            continue
         
         # Aggiungi il punteggio di rilevanza al risultato
         result['relevance_score'] = relevance_score
-        
-        if relevance_score >= threshold:
-            filtered_results.append(result)
+        filtered_results.append(result)
     
     # Ordina per punteggio di rilevanza (dal più alto)
-    filtered_results.sort(key=lambda x: x['relevance_score'], reverse=True)
+    if top_k is not None:
+        return heapq.nlargest(top_k, filtered_results, key=itemgetter('relevance_score'))
+    filtered_results.sort(key=itemgetter('relevance_score'), reverse=True)
     return filtered_results
 
+def _content_words(text: str) -> set:
+    return {word for word in _RE_WORDS.findall(text.lower()) if word not in _STOPWORDS}
+
+def _lexical_floor(query: str, text: str) -> Optional[float]:
+    """
+    Filtro lessicale economico: un risultato che non contiene nessuna parola significativa
+    della query è considerato irrilevante senza interpellare il modello.
+    
+    Args:
+        query (str): La query di ricerca originale
+        text (str): Titolo e descrizione del risultato
+        
+    Returns:
+        Optional[float]: 0.0 se il risultato è certamente irrilevante, None se va valutato
+    """
+    query_words = _content_words(query)
+    if not query_words:
+        return None
+    
+    overlap = len(query_words & _content_words(text)) / len(query_words)
+    return 0.0 if overlap == 0 else None
+
+def _llm_relevance_scores(search_results: List[Dict[str, Any]], query: str, max_concurrency: int) -> List[float]:
+    """
+    Valuta la rilevanza dei risultati con OpenAI, riusando i punteggi in cache per query simili.
+    
+    Args:
+        search_results (List[Dict[str, Any]]): Risultati di ricerca da valutare
+        query (str): La query di ricerca originale
+        max_concurrency (int): Numero massimo di valutazioni contemporanee
+        
+    Returns:
+        List[float]: Punteggi tra 0 e 1 nello stesso ordine dei risultati
+    """
+    # Solo i risultati senza un punteggio in cache per query simili vengono inviati al modello
+    scores, vectors = get_cached_scores(query, search_results)
+    pending = [i for i, score in enumerate(scores) if score is None]
+    
+    if pending:
+        new_scores = asyncio.run(_evaluate_results_async([search_results[i] for i in pending], query, max_concurrency))
+        _merge_scores(scores, vectors, pending, new_scores)
+    
+    # Valore predefinito di rilevanza neutra per le valutazioni fallite
+    return [0.5 if score is None else score for score in scores]
+
+def _merge_scores(scores: List[Optional[float]], vectors, pending: List[int], new_scores: List[Optional[float]]) -> None:
+    """
+    Inserisce i punteggi appena calcolati tra quelli letti dalla cache e li memorizza.
+    
+    Args:
+        scores (List[Optional[float]]): Punteggi di tutti i risultati, aggiornati sul posto
+        vectors (Optional[np.ndarray]): Embedding dei risultati restituiti da get_cached_scores
+        pending (List[int]): Indici dei risultati valutati dal modello
+        new_scores (List[Optional[float]]): Punteggi calcolati per i risultati in pending
+    """
+    for i, score in zip(pending, new_scores):
+        scores[i] = score
+    
+    # Le valutazioni fallite non vengono memorizzate
+    evaluated = [(i, score) for i, score in zip(pending, new_scores) if score is not None]
+    if vectors is not None and evaluated:
+        store_scores(vectors[[i for i, _ in evaluated]], [score for _, score in evaluated])
+
+# Prompt della valutazione di un singolo risultato: solo il messaggio utente cambia tra le chiamate
+_SYSTEM_MSG = (
+    "Sei un'IA che valuta la rilevanza dei risultati di ricerca.\n"
+    "Analizza il titolo, la descrizione e l'URL del risultato di ricerca, e determina se è rilevante per la query originale.\n"
+    "Valuta la rilevanza su una scala da 0 a 1, dove:\n"
+    "- 0 significa completamente irrilevante\n"
+    "- 0.5 significa parzialmente rilevante\n"
+    "- 1 significa altamente rilevante\n"
+    "Restituisci il punteggio di rilevanza come numero decimale nel campo s."
+)
+_SYSTEM_ENTRY = {"role": "system", "content": _SYSTEM_MSG}
+_USER_TEMPLATE = (
+    "Query originale: {q}\n\n"
+    "Risultato di ricerca da valutare:\n"
+    "Titolo: {t}\n"
+    "Descrizione: {d}\n"
+    "URL: {u}\n\n"
+    "Punteggio di rilevanza (da 0 a 1):"
+)
+
+# Output strutturato: il modello può rispondere solo con {"s": <numero>}, senza testo da interpretare
+_SCORE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "relevance_score",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"s": {"type": "number"}},
+            "required": ["s"],
+            "additionalProperties": False
+        }
+    }
+}
+
+# Prompt di sistema della valutazione in batch
+_BATCH_SYSTEM_MSG = (
+    "Valuta la rilevanza di ogni risultato di ricerca rispetto alla query originale.\n"
+    "Assegna un punteggio di rilevanza a ciascun risultato su una scala da 0 a 1, dove:\n"
+    "- 0 significa completamente irrilevante\n"
+    "- 0.5 significa parzialmente rilevante\n"
+    "- 1 significa altamente rilevante\n\n"
+    "Restituisci solo un array JSON di punteggi. Esempio: [0.8, 0.3, 0.9]"
+)
+
+# Messaggio utente della valutazione in batch ({r} riceve i blocchi dei risultati)
+_BATCH_USER_TEMPLATE = """
+    Query originale: {q}
+    
+    Risultati di ricerca da valutare:
+    {r}
+    
+    Per favore restituisci un array JSON di punteggi di rilevanza (da 0 a 1) per ciascun risultato, in ordine:
+    """
+
+class RelevanceCoalescer:
+    """
+    Raggruppa le valutazioni di rilevanza richieste a breve distanza l'una dall'altra, anche da
+    chiamanti diversi: le richieste in attesa con la stessa query vengono valutate con un unico
+    prompt multi-risultato.
+    """
+    
+    def __init__(self, 
+                window: float = COALESCE_WINDOW, 
+                flush_size: int = COALESCE_FLUSH_SIZE, 
+                max_batch: int = COALESCE_MAX_BATCH,
+                max_workers: int = DEFAULT_MAX_CONCURRENCY):
+        """
+        Inizializza il coalescer. Il thread di raccolta viene avviato alla prima richiesta.
+        
+        Args:
+            window (float): Secondi di attesa per raccogliere altre richieste
+            flush_size (int): Numero di richieste in attesa che fa partire subito un batch
+            max_batch (int): Numero massimo di risultati per prompt
+            max_workers (int): Numero massimo di prompt inviati contemporaneamente
+        """
+        self.window = window
+        self.flush_size = flush_size
+        self.max_batch = max_batch
+        
+        # Contatori per valutare l'efficacia del raggruppamento
+        self.total_requests = 0
+        self.batched_requests = 0
+        
+        self._pending = []
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='relevance')
+        self._thread = None
+    
+    def submit(self, query: str, result: Dict[str, Any]) -> Future:
+        """
+        Accoda la valutazione di un risultato.
+        
+        Args:
+            query (str): La query di ricerca originale
+            result (Dict[str, Any]): Un risultato di ricerca con titolo, link e descrizione
+            
+        Returns:
+            Future: Future risolto con il punteggio tra 0 e 1, o None se la valutazione è fallita
+        """
+        future = Future()
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, name='relevance-coalescer', daemon=True)
+                self._thread.start()
+            
+            self._pending.append((query, result, future))
+            self.total_requests += 1
+            if len(self._pending) == 1 or len(self._pending) >= self.flush_size:
+                self._condition.notify()
+        return future
+    
+    async def score(self, query: str, result: Dict[str, Any]) -> Optional[float]:
+        """
+        Versione awaitable di submit.
+        
+        Args:
+            query (str): La query di ricerca originale
+            result (Dict[str, Any]): Un risultato di ricerca con titolo, link e descrizione
+            
+        Returns:
+            Optional[float]: Punteggio tra 0 e 1, o None se la valutazione è fallita
+        """
+        return await asyncio.wrap_future(self.submit(query, result))
+    
+    def _flush_loop(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                
+                # Attende altre richieste per la durata della finestra, salvo che siano già sufficienti
+                if len(self._pending) < self.flush_size:
+                    self._condition.wait(self.window)
+                pending, self._pending = self._pending, []
+            
+            groups = {}
+            for query, result, future in pending:
+                groups.setdefault(query, []).append((result, future))
+            
+            for query, items in groups.items():
+                for start in range(0, len(items), self.max_batch):
+                    self._executor.submit(self._score_batch, query, items[start:start + self.max_batch])
+    
+    def _score_batch(self, query: str, items: List[Tuple[Dict[str, Any], Future]]) -> None:
+        results = [result for result, _ in items]
+        try:
+            if len(results) == 1:
+                scores = [_score_result(results[0], query)]
+            else:
+                scores = _batch_scores(results, query)
+                with self._condition:
+                    self.batched_requests += len(results)
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+        
+        for (_, future), score in zip(items, scores):
+            future.set_result(score)
+
+_coalescer = RelevanceCoalescer()
+
+async def _evaluate_results_async(search_results: List[Dict[str, Any]], query: str, max_concurrency: int) -> List[Optional[float]]:
+    """
+    Valuta la rilevanza di più risultati in parallelo tramite il coalescer, limitando le richieste contemporanee.
+    
+    Args:
+        search_results (List[Dict[str, Any]]): Risultati di ricerca da valutare
+        query (str): La query di ricerca originale
+        max_concurrency (int): Numero massimo di valutazioni contemporanee
+        
+    Returns:
+        List[Optional[float]]: Punteggi di rilevanza nello stesso ordine dei risultati (None se la valutazione è fallita)
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def _bounded(result: Dict[str, Any]) -> Optional[float]:
+        async with semaphore:
+            return await _coalescer.score(query, result)
+    
+    return await asyncio.gather(*[_bounded(result) for result in search_results])
+
 def evaluate_result_relevance(result: Dict[str, Any], query: str) -> float:
     """
     Valuta la rilevanza di un risultato di ricerca rispetto alla query utilizzando OpenAI.
@@ -50,58 +456,97 @@ def evaluate_result_relevance(result: Dict[str, Any], query: str) -> float:
     Returns:
         float: Punteggio di rilevanza tra 0 (irrilevante) e 1 (altamente rilevante)
     """
-    title = result.get('title', '')
-    description = result.get('description', '')
-    url = result.get('link', '')
+    (cached,), vectors = get_cached_scores(query, [result])
+    if cached is not None:
+        return cached
+    
+    score = _score_result(result, query)
+    if score is None:
+        return 0.5  # Valore predefinito di rilevanza neutra in caso di errore
     
-    # Prepara il prompt per OpenAI
-    system_message = """
-    Sei un'IA che valuta la rilevanza dei risultati di ricerca. 
-    Analizza il titolo, la descrizione e l'URL del risultato di ricerca, e determina se è rilevante per la query originale.
-    Valuta la rilevanza su una scala da 0 a 1, dove:
-    - 0 significa completamente irrilevante
-    - 0.5 significa parzialmente rilevante
-    - 1 significa altamente rilevante
-    Restituisci solo un numero decimale che rappresenta il punteggio di rilevanza.
+    store_scores(vectors, [score])
+    return score
+
+def _score_result(result: Dict[str, Any], query: str) -> Optional[float]:
     """
+    Richiede al modello il punteggio di rilevanza di un risultato, senza consultare la cache.
     
-    user_message = f"""
-    Query originale: {query}
+    Args:
+        result (Dict[str, Any]): Un risultato di ricerca con titolo, link e descrizione
+        query (str): La query di ricerca originale
+        
+    Returns:
+        Optional[float]: Punteggio tra 0 e 1, o None se la valutazione è fallita
+    """
+    try:
+        return _score_llm(query, result.get('title', ''), result.get('description', ''), result.get('link', ''))
+    except Exception as e:
+        print(f"Errore nella valutazione della rilevanza: {e}")
+        return None
+
+@functools.lru_cache(maxsize=SCORE_CACHE_SIZE)
+def _score_llm(query: str, title: str, description: str, url: str) -> float:
+    """
+    Richiede al modello il punteggio di rilevanza di un risultato. Le valutazioni riuscite
+    vengono memorizzate, quelle fallite sollevano un'eccezione e non vengono memorizzate.
     
-    Risultato di ricerca da valutare:
-    Titolo: {title}
-    Descrizione: {description}
-    URL: {url}
+    Args:
+        query (str): La query di ricerca originale
+        title (str): Titolo del risultato
+        description (str): Descrizione del risultato
+        url (str): URL del risultato
+        
+    Returns:
+        float: Punteggio tra 0 e 1
+    """
+    response = client.chat.completions.create(**_relevance_request(query, title, description, url))
+    score = _parse_relevance_score(response.choices[0].message.content)
+    if score is None:
+        raise ValueError("risposta del modello non interpretabile")
+    return score
+
+def _relevance_request(query: str, title: str, description: str, url: str) -> Dict[str, Any]:
+    """
+    Costruisce i parametri della richiesta di valutazione di un risultato.
     
-    Punteggio di rilevanza (da 0 a 1):
+    Args:
+        query (str): La query di ricerca originale
+        title (str): Titolo del risultato
+        description (str): Descrizione del risultato
+        url (str): URL del risultato
+        
+    Returns:
+        Dict[str, Any]: Parametri per chat.completions.create
     """
+    user_message = _USER_TEMPLATE.format(q=query, t=title, d=description, u=url)
     
-    try:
-        response = openai.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=0.3,
-            max_tokens=5
-        )
+    return {
+        "model": OPENAI_MODEL,
+        "messages": [_SYSTEM_ENTRY, {"role": "user", "content": user_message}],
+        "temperature": 0.3,
+        "response_format": _SCORE_RESPONSE_FORMAT,
+        "max_tokens": 10
+    }
+
+def _parse_relevance_score(content: str) -> Optional[float]:
+    """
+    Estrae il punteggio di rilevanza dalla risposta del modello.
+    
+    Args:
+        content (str): Testo della risposta
         
-        # Estrai il punteggio di rilevanza dalla risposta
-        score_text = response.choices[0].message.content.strip()
-        try:
-            # Prova a interpretare il punteggio come numero decimale
-            relevance_score = float(score_text)
-            # Assicurati che il punteggio sia tra 0 e 1
-            relevance_score = max(0.0, min(1.0, relevance_score))
-            return relevance_score
-        except ValueError:
-            print(f"Errore nell'interpretazione del punteggio di rilevanza: {score_text}")
-            return 0.5  # Valore predefinito di rilevanza neutra in caso di errore
-            
-    except Exception as e:
-        print(f"Errore nella valutazione della rilevanza: {e}")
-        return 0.5  # Valore predefinito di rilevanza neutra in caso di errore
+    Returns:
+        Optional[float]: Punteggio tra 0 e 1, o None se la risposta non è interpretabile
+    """
+    try:
+        # La risposta è vincolata allo schema {"s": <numero>}
+        relevance_score = float(orjson.loads(content)["s"])
+        # Assicurati che il punteggio sia tra 0 e 1
+        relevance_score = max(0.0, min(1.0, relevance_score))
+        return relevance_score
+    except (orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+        print(f"Errore nell'interpretazione del punteggio di rilevanza: {content}")
+        return None
 
 def batch_evaluate_relevance(search_results: List[Dict[str, Any]], 
                            query: str) -> List[Dict[str, Any]]:
@@ -118,57 +563,107 @@ def batch_evaluate_relevance(search_results: List[Dict[str, Any]],
     if not search_results:
         return []
     
-    # Prepara il prompt combinato
-    system_message = """
-    Valuta la rilevanza di ogni risultato di ricerca rispetto alla query originale.
-    Assegna un punteggio di rilevanza a ciascun risultato su una scala da 0 a 1, dove:
-    - 0 significa completamente irrilevante
-    - 0.5 significa parzialmente rilevante
-    - 1 significa altamente rilevante
+    # Solo i risultati senza un punteggio in cache per query simili vengono inviati al modello
+    scores, vectors = get_cached_scores(query, search_results)
+    pending = [i for i, score in enumerate(scores) if score is None]
     
-    Restituisci solo un array JSON di punteggi. Esempio: [0.8, 0.3, 0.9]
+    if pending:
+        new_scores = _batch_scores([search_results[i] for i in pending], query)
+        _merge_scores(scores, vectors, pending, new_scores)
+    
+    for result, score in zip(search_results, scores):
+        # Valore predefinito di rilevanza neutra per le valutazioni fallite
+        result['relevance_score'] = 0.5 if score is None else score
+    
+    return search_results
+
+@functools.lru_cache(maxsize=8)
+def _encoding(model: str) -> 'tiktoken.Encoding':
     """
+    Restituisce il tokenizer del modello, o quello dei modelli recenti se il nome non è noto.
     
-    search_results_text = ""
-    for i, result in enumerate(search_results):
-        title = result.get('title', '')
-        description = result.get('description', '')
-        url = result.get('link', '')
+    Args:
+        model (str): Nome del modello OpenAI
         
-        search_results_text += f"""
-        Risultato {i+1}:
-        Titolo: {title}
-        Descrizione: {description}
-        URL: {url}
+    Returns:
+        tiktoken.Encoding: Tokenizer da usare per contare i token
+    """
+    import tiktoken
+    
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def _result_block(index: int, result: Dict[str, Any]) -> str:
+    get = result.get
+    return f"\nRisultato {index}:\nTitolo: {get('title', '')}\nDescrizione: {get('description', '')}\nURL: {get('link', '')}\n"
+
+def _batch_scores(search_results: List[Dict[str, Any]], query: str) -> List[Optional[float]]:
+    """
+    Richiede al modello i punteggi di più risultati, senza consultare la cache. I risultati vengono
+    divisi in gruppi il cui prompt rientra nel contesto del modello, valutati con una chiamata ciascuno.
+    
+    Args:
+        search_results (List[Dict[str, Any]]): Risultati di ricerca da valutare
+        query (str): La query di ricerca originale
         
-        """
+    Returns:
+        List[Optional[float]]: Punteggi nello stesso ordine dei risultati (None se la valutazione è fallita)
+    """
+    encoding = _encoding(OPENAI_MODEL)
+    fixed_prompt = _BATCH_SYSTEM_MSG + _BATCH_USER_TEMPLATE.format(q=query, r="")
+    budget = BATCH_PROMPT_MAX_TOKENS - len(encoding.encode_ordinary(fixed_prompt)) - BATCH_RESPONSE_OVERHEAD
     
-    user_message = f"""
-    Query originale: {query}
+    # Riempie ogni gruppo finché prompt e risposta restano entro il budget
+    # e i punteggi entro il limite di output
+    chunks = []
+    current, used = [], 0
+    for i, result in enumerate(search_results, 1):
+        tokens = len(encoding.encode_ordinary(_result_block(i, result))) + BATCH_TOKENS_PER_SCORE
+        if current and (used + tokens > budget or len(current) >= BATCH_MAX_RESULTS):
+            chunks.append(current)
+            current, used = [], 0
+        current.append(result)
+        used += tokens
+    chunks.append(current)
     
-    Risultati di ricerca da valutare:
-    {search_results_text}
+    return [score for chunk in chunks for score in _batch_chunk_scores(chunk, query)]
+
+def _batch_chunk_scores(search_results: List[Dict[str, Any]], query: str) -> List[Optional[float]]:
+    """
+    Richiede al modello i punteggi di un gruppo di risultati con una singola chiamata.
+    Se la risposta non è interpretabile ripiega sulla valutazione individuale.
     
-    Per favore restituisci un array JSON di punteggi di rilevanza (da 0 a 1) per ciascun risultato, in ordine:
+    Args:
+        search_results (List[Dict[str, Any]]): Risultati di ricerca da valutare
+        query (str): La query di ricerca originale
+        
+    Returns:
+        List[Optional[float]]: Punteggi nello stesso ordine dei risultati (None se la valutazione è fallita)
     """
+    # Prepara il prompt combinato
+    search_results_text = "".join([_result_block(i, result) for i, result in enumerate(search_results, 1)])
+    
+    user_message = _BATCH_USER_TEMPLATE.format(q=query, r=search_results_text)
     
     try:
-        response = openai.chat.completions.create(
+        response = client.chat.completions.create(
             model=OPENAI_MODEL,
             messages=[
-                {"role": "system", "content": system_message},
+                {"role": "system", "content": _BATCH_SYSTEM_MSG},
                 {"role": "user", "content": user_message}
             ],
             temperature=0.3,
             response_format={"type": "json_object"},
-            max_tokens=100
+            max_tokens=min(BATCH_TOKENS_PER_SCORE * len(search_results) + BATCH_RESPONSE_OVERHEAD,
+                           MODEL_MAX_OUTPUT_TOKENS)
         )
         
         # Estrai i punteggi di rilevanza dalla risposta
-        import json
         try:
             response_content = response.choices[0].message.content.strip()
-            scores_data = json.loads(response_content)
+            scores_data = orjson.loads(response_content)
             
             # Controlla se abbiamo ottenuto una lista di punteggi o un dizionario con una chiave scores
             if isinstance(scores_data, dict) and 'scores' in scores_data:
@@ -184,33 +679,31 @@ def batch_evaluate_relevance(search_results: List[Dict[str, Any]],
                 else:
                     # Se non possiamo trovare una lista corrispondente, ripieghiamo sulla valutazione individuale
                     print("Impossibile analizzare i punteggi di rilevanza in batch, ripiego sulla valutazione individuale")
-                    return [evaluate_result_relevance(result, query) for result in search_results]
+                    return [_score_result(result, query) for result in search_results]
             
-            # Aggiungi i punteggi ai risultati
-            for i, result in enumerate(search_results):
-                if i < len(scores):
-                    try:
-                        score = float(scores[i])
-                        # Assicurati che il punteggio sia tra 0 e 1
-                        result['relevance_score'] = max(0.0, min(1.0, score))
-                    except (ValueError, TypeError):
-                        result['relevance_score'] = 0.5
-                else:
-                    result['relevance_score'] = 0.5
-                    
-            return search_results
-                
-        except json.JSONDecodeError:
+            # Converti i punteggi dei risultati
+            parsed_scores = []
+            for i in range(len(search_results)):
+                try:
+                    # Assicurati che il punteggio sia tra 0 e 1
+                    parsed_scores.append(max(0.0, min(1.0, float(scores[i]))))
+                except (IndexError, ValueError, TypeError):
+                    parsed_scores.append(None)
+            
+            return parsed_scores
+        
+        except orjson.JSONDecodeError:
             print(f"Errore nell'analisi della risposta JSON: {response_content}")
             # Ripiego sulla valutazione individuale
-            return [evaluate_result_relevance(result, query) for result in search_results]
-            
+            return [_score_result(result, query) for result in search_results]
+    
     except Exception as e:
         print(f"Errore nella valutazione in batch: {e}")
         # Ripiego sulla valutazione individuale
-        return [evaluate_result_relevance(result, query) for result in search_results]
+        return [_score_result(result, query) for result in search_results]
 
-def search_and_filter(query: str, num_results: int = None, threshold: float = 0.7, use_batch: bool = True) -> List[Dict[str, Any]]:
+def search_and_filter(query: str, num_results: int = None, threshold: float = 0.7, use_batch: bool = True, use_llm: bool = False,
+                      top_k: Optional[int] = None) -> List[Dict[str, Any]]:
     """
     Esegue una ricerca Google e filtra i risultati in base alla loro rilevanza rispetto alla query.
     
@@ -219,6 +712,9 @@ def search_and_filter(query: str, num_results: int = None, threshold: float = 0.
         num_results (int, optional): Numero massimo di risultati di ricerca da restituire prima del filtraggio
         threshold (float, optional): Punteggio minimo di rilevanza (0-1) per includere i risultati
         use_batch (bool, optional): Se utilizzare la valutazione in batch (più efficiente) o la valutazione individuale
+        use_llm (bool, optional): Se valutare la rilevanza con il modello di chat invece che con gli embedding
+        top_k (int, optional): Numero massimo di risultati restituiti. A differenza di num_results, che limita
+                               i risultati di ricerca da valutare, si applica dopo il filtro sulla soglia
         
     Returns:
         List[Dict[str, Any]]: Lista filtrata di risultati di ricerca rilevanti
@@ -231,17 +727,26 @@ def search_and_filter(query: str, num_results: int = None, threshold: float = 0.
     if not search_results:
         return []
     
-    # Valuta e filtra i risultati
-    if use_batch:
-        # Più efficiente per risultati multipli
+    # Valutazione individuale: filter_relevant_results restituisce i risultati già ordinati
+    if not use_batch:
+        return filter_relevant_results(search_results, query, threshold, use_llm=use_llm, top_k=top_k)
+    
+    # Più efficiente per risultati multipli: una sola richiesta di embedding per tutti i risultati
+    scores = None if use_llm else embedding_batch_scores(search_results, query)
+    if scores is None:
         results_with_scores = batch_evaluate_relevance(search_results, query)
         filtered_results = [r for r in results_with_scores if r.get('relevance_score', 0) >= threshold]
     else:
-        # Valutazione individuale
-        filtered_results = filter_relevant_results(search_results, query, threshold)
+        filtered_results = []
+        for result, score in zip(search_results, scores.tolist()):
+            if score >= threshold:
+                result['relevance_score'] = score
+                filtered_results.append(result)
     
     # Ordina per punteggio di rilevanza (dal più alto)
-    filtered_results.sort(key=lambda x: x.get('relevance_score', 0), reverse=True)
+    if top_k is not None:
+        return heapq.nlargest(top_k, filtered_results, key=itemgetter('relevance_score'))
+    filtered_results.sort(key=itemgetter('relevance_score'), reverse=True)
     return filtered_results
 
 def format_filtered_results(filtered_results: List[Dict[str, Any]]) -> str:
@@ -266,5 +771,5 @@ def format_filtered_results(filtered_results: List[Dict[str, Any]]) -> str:
         formatted_text += f"   Link: {result['link']}\n"
         formatted_text += f"   {result['description']}\n"
         formatted_text += f"   Punteggio di Rilevanza: {result.get('relevance_score', 'N/A'):.2f}\n\n"
-        
+    
     return formatted_text
\ No newline at end of file
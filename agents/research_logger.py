@@ -2,7 +2,12 @@
 # agents/research_logger.py
 
 import os
+import queue
+import atexit
+import threading
 import logging
+import logging.handlers
+from collections import OrderedDict
 from typing import Optional
 import sys
 from datetime import datetime
@@ -10,6 +15,74 @@ from datetime import datetime
 # Base directory for log files
 LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'output')
 
+# Formatter condiviso da tutti i file di log delle ricerche
+_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# La directory dei log viene creata una sola volta per processo
+_log_dir_ready = False
+
+# Prefisso dei logger delle ricerche: il resto del nome è l'ID della ricerca
+LOGGER_PREFIX = "research."
+
+# File di log tenuti aperti contemporaneamente dal listener condiviso
+MAX_OPEN_LOG_FILES = 32
+
+class _ResearchFileRouter(logging.Handler):
+    """
+    Handler del listener condiviso: scrive ogni record nel file della ricerca indicata
+    dal nome del logger, tenendo aperti solo i file usati più di recente.
+    """
+    
+    def __init__(self, max_open_files: int = MAX_OPEN_LOG_FILES):
+        super().__init__()
+        self.max_open_files = max_open_files
+        self._files = OrderedDict()  # ID della ricerca -> FileHandler
+    
+    def emit(self, record: logging.LogRecord) -> None:
+        research_id = record.name[len(LOGGER_PREFIX):]
+        file_handler = self._files.get(research_id)
+        if file_handler is None:
+            # I file chiusi vengono riaperti in append alla ricerca successiva
+            file_handler = logging.FileHandler(os.path.join(LOG_DIR, f"{research_id}.log"))
+            file_handler.setFormatter(_FORMATTER)
+            self._files[research_id] = file_handler
+            if len(self._files) > self.max_open_files:
+                _, oldest = self._files.popitem(last=False)
+                oldest.close()
+        else:
+            self._files.move_to_end(research_id)
+        file_handler.emit(record)
+    
+    def close(self) -> None:
+        for file_handler in self._files.values():
+            file_handler.close()
+        self._files.clear()
+        super().close()
+
+# Un'unica coda e un unico thread scrivono i log di tutte le ricerche
+_log_queue = None
+_log_queue_lock = threading.Lock()
+
+def _get_log_queue() -> queue.SimpleQueue:
+    """
+    Restituisce la coda dei log condivisa, avviando il listener al primo utilizzo.
+    
+    Returns:
+        queue.SimpleQueue: Coda in cui i logger delle ricerche accodano i record
+    """
+    global _log_queue
+    if _log_queue is None:
+        with _log_queue_lock:
+            if _log_queue is None:
+                router = _ResearchFileRouter()
+                log_queue = queue.SimpleQueue()
+                listener = logging.handlers.QueueListener(log_queue, router)
+                listener.start()
+                atexit.register(router.close)
+                atexit.register(listener.stop)
+                _log_queue = log_queue
+    return _log_queue
+
 # Mantieni traccia degli handler aggiunti a ciascun logger
 _logger_handlers = {}
 
@@ -43,25 +116,43 @@ class ResearchLogger:
         Args:
             research_id (str): ID della ricerca per cui creare il logger
         """
+        global _log_dir_ready
+        
         self.research_id = research_id
         self.log_file_path = os.path.join(LOG_DIR, f"{research_id}.log")
-        os.makedirs(LOG_DIR, exist_ok=True)
+        if not _log_dir_ready:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            _log_dir_ready = True
         
         # Configura il logger Python standard
-        self.logger = logging.getLogger(f"research.{research_id}")
+        self.logger = logging.getLogger(f"{LOGGER_PREFIX}{research_id}")
         self.logger.setLevel(logging.INFO)
         
+        # Metodi del logger standard, usati direttamente da chi sostituisce o duplica altri logger
+        self._log_methods = {
+            'info': self.logger.info,
+            'warning': self.logger.warning,
+            'error': self.logger.error,
+            'debug': self.logger.debug,
+            'critical': self.logger.critical
+        }
+        
+        # Il logger è già configurato con l'handler di questa ricerca
+        handlers = self.logger.handlers
+        if len(handlers) == 1 and getattr(handlers[0], '_research_id', None) == research_id:
+            return
+        
         # Rimuovi handler esistenti per evitare duplicati
-        if self.logger.handlers:
+        if handlers:
             self.logger.handlers = []
         
-        # Crea un file handler
-        file_handler = logging.FileHandler(self.log_file_path)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(formatter)
+        # I chiamanti si limitano ad accodare i record: la scrittura su file avviene in background
+        # nel thread condiviso da tutte le ricerche
+        queue_handler = logging.handlers.QueueHandler(_get_log_queue())
+        queue_handler._research_id = research_id
         
         # Aggiungi l'handler al logger
-        self.logger.addHandler(file_handler)
+        self.logger.addHandler(queue_handler)
         
     def info(self, message: str):
         """Logga un messaggio informativo"""
@@ -106,6 +197,7 @@ class PrintToLogRedirector:
         self.research_id = research_id
         self.logger = get_research_logger(research_id)
         self.original_stdout = sys.stdout
+        self._local = threading.local()  # riga parziale di ciascun thread
         
     def __enter__(self):
         """Avvia la redirezione"""
@@ -114,20 +206,30 @@ class PrintToLogRedirector:
         
     def __exit__(self, exc_type, exc_val, exc_tb):
         """Ripristina lo stdout originale"""
+        self.flush()
         sys.stdout = self.original_stdout
         
     def write(self, message):
-        """Intercetta le chiamate write() e le reindirizza al logger"""
-        # Gestisci le nuove linee e altri caratteri speciali
-        if message and not message.isspace():
-            message = message.rstrip()
-            if message:  # Se non è una stringa vuota dopo il rstrip
-                self.logger.info(message)
+        """Intercetta le chiamate write() e le reindirizza al logger, una riga alla volta"""
+        # print scrive testo e newline separatamente: i frammenti si accumulano fino a fine riga
+        buf = getattr(self._local, 'buf', '') + message
+        if '\n' in buf:
+            lines = buf.split('\n')
+            for line in lines[:-1]:
+                line = line.rstrip()
+                if line:  # Salta le righe vuote
+                    self.logger.info(line)
+            buf = lines[-1]
+        self._local.buf = buf
         # Passa comunque il messaggio allo stdout originale
         self.original_stdout.write(message)
         
     def flush(self):
-        """Implementa flush per compatibilità"""
+        """Registra l'eventuale riga incompleta del thread corrente e svuota lo stdout originale"""
+        buf = getattr(self._local, 'buf', '').rstrip()
+        self._local.buf = ''
+        if buf:
+            self.logger.info(buf)
         self.original_stdout.flush()
 
 # Handler di log specializzato che duplica i messaggi di log al logger della ricerca
@@ -145,14 +247,15 @@ class ResearchLogHandler(logging.Handler):
         msg = self.format(record)
         
         # Invia il messaggio al logger della ricerca con il livello appropriato
+        log_methods = self.research_logger._log_methods
         if record.levelno >= logging.ERROR:
-            self.research_logger.error(msg)
+            log_methods['error'](msg)
         elif record.levelno >= logging.WARNING:
-            self.research_logger.warning(msg)
+            log_methods['warning'](msg)
         elif record.levelno >= logging.INFO:
-            self.research_logger.info(msg)
+            log_methods['info'](msg)
         elif record.levelno >= logging.DEBUG:
-            self.research_logger.debug(msg)
+            log_methods['debug'](msg)
 
 # Funzione per reindirizzare i log di un modulo al logger della ricerca
 def redirect_module_logs_to_research(module_name: str, research_id: str):
@@ -298,11 +401,8 @@ def replace_module_logger(module_name: str, research_id: str):
     
     # Hack: sostituisci i metodi di logging del logger originale con quelli del research logger
     # Questo fa sì che qualsiasi chiamata al logger originale venga reindirizzata al logger della ricerca
-    original_logger.info = lambda msg, *args, **kwargs: research_logger.info(msg)
-    original_logger.warning = lambda msg, *args, **kwargs: research_logger.warning(msg)
-    original_logger.error = lambda msg, *args, **kwargs: research_logger.error(msg)
-    original_logger.debug = lambda msg, *args, **kwargs: research_logger.debug(msg)
-    original_logger.critical = lambda msg, *args, **kwargs: research_logger.critical(msg)
+    for name, method in research_logger._log_methods.items():
+        setattr(original_logger, name, method)
     
     # Imposta il livello di logging uguale a quello originale
     original_logger.setLevel(original_level)
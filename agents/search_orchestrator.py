@@ -2,21 +2,28 @@
 # agents/search_orchestrator.py
 
 import os
+import asyncio
+import re
+import functools
 import logging
 import sys
+from dataclasses import dataclass
 from typing import List, Dict, Any, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
 # Import modules
 from agents.query_builder import build_google_query
 from agents.google_search import google_search
-from agents.relevance_filter import evaluate_result_relevance
-from agents.web_scraper import scrape_webpage
-from agents.content_cleaner import clean_webpage_content
-from agents.content_relevance import evaluate_content_relevance
-from agents.content_cache import ContentCache
+from agents.relevance_filter import batch_evaluate_relevance
+from agents.web_scraper import scrape_webpage, ascrape_webpage, create_async_http_client
+from agents.content_cleaner import clean_webpage_content, html_to_text
+from agents.content_relevance import evaluate_content_relevance, content_similarity, DEFAULT_SIMILARITY_THRESHOLD
+from agents.content_cache import ContentCache, MEMORY_CACHE_MAX_CHARS, CACHE_TTL
 from agents.rag_storage import RAGStorage
 from agents.formatter import format_search_results
 from agents.research_logger import get_research_logger, CompleteAgentOutputRedirector
+from agents.openai_client import client
+from agents.process_pool import get_process_pool
 
 # Import configurations
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -37,6 +44,84 @@ logging.basicConfig(
 )
 logger = logging.getLogger('search_orchestrator')
 
+# Numero massimo di risultati di ricerca elaborati contemporaneamente in un ciclo
+DEFAULT_MAX_CONCURRENCY = 5
+
+# Caratteri massimi del contenuto inviato al modello per un riassunto
+SUMMARY_MAX_CONTENT_CHARS = 10000
+
+# Parametri di tracciamento che non cambiano la risorsa indicata da un URL
+_RE_TRACKING_PARAM = re.compile(r"^(utm_|fbclid$|gclid$)", re.IGNORECASE)
+
+def _canonicalize(url: str) -> str:
+    """
+    Riduce un URL a una forma canonica, così che varianti della stessa risorsa
+    vengano riconosciute come già visitate.
+    
+    Args:
+        url (str): URL da normalizzare
+        
+    Returns:
+        str: URL senza frammento né parametri di tracciamento, con schema e host in minuscolo
+    """
+    parts = urlsplit(url.strip())
+    query = urlencode([(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                       if not _RE_TRACKING_PARAM.match(key)])
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ''))
+
+@dataclass(slots=True)
+class SearchResult:
+    """
+    Risultato di ricerca elaborato dall'orchestratore. Più compatto di un dizionario,
+    viene convertito con to_dict nel formato restituito da search.
+    """
+    title: str
+    link: str
+    description: str
+    relevance_score: float = 0.0
+    content: Optional[str] = None
+    content_evaluation: Optional[Dict[str, Any]] = None
+    rag_id: Optional[str] = None
+    
+    @classmethod
+    def from_dict(cls, result: Dict[str, Any]) -> 'SearchResult':
+        """
+        Crea un risultato a partire da un risultato di google_search già valutato.
+        
+        Args:
+            result (Dict[str, Any]): Risultato con titolo, link, descrizione e punteggio di rilevanza
+            
+        Returns:
+            SearchResult: Il risultato corrispondente
+        """
+        return cls(
+            title=result.get('title', ''),
+            link=result.get('link', ''),
+            description=result.get('description', ''),
+            relevance_score=result.get('relevance_score', 0.0)
+        )
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Converte il risultato nel dizionario usato da RAGStorage, formatter e CLI.
+        
+        Returns:
+            Dict[str, Any]: Il risultato come dizionario
+        """
+        result = {
+            'title': self.title,
+            'link': self.link,
+            'description': self.description,
+            'relevance_score': self.relevance_score
+        }
+        if self.content is not None:
+            result['content'] = self.content
+            result['content_evaluation'] = self.content_evaluation
+        if self.rag_id is not None:
+            result['metadata'] = {'rag_id': self.rag_id}
+        return result
+
 class SearchOrchestrator:
     """
     Orchestratore che gestisce il processo di ricerca, scaricamento e valutazione di contenuti web
@@ -48,7 +133,12 @@ class SearchOrchestrator:
                 max_search_cycles: int = MAX_SEARCH_CYCLES,
                 link_relevance_threshold: float = LINK_RELEVANCE_THRESHOLD,
                 content_relevance_threshold: float = CONTENT_RELEVANCE_THRESHOLD,
-                cache_dir: str = CACHE_DIR):
+                cache_dir: str = CACHE_DIR,
+                max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                content_similarity_threshold: Optional[float] = DEFAULT_SIMILARITY_THRESHOLD,
+                max_cache_chars: int = MEMORY_CACHE_MAX_CHARS,
+                cache_ttl: Optional[float] = CACHE_TTL,
+                disk_cache_ttl: Optional[float] = None):
         """
         Inizializza l'orchestratore di ricerca.
         
@@ -58,15 +148,26 @@ class SearchOrchestrator:
             link_relevance_threshold (float): Punteggio minimo per considerare un risultato di ricerca rilevante
             content_relevance_threshold (float): Punteggio minimo per considerare il contenuto di una pagina rilevante
             cache_dir (str): Directory per la cache dei contenuti scaricati
+            max_concurrency (int): Numero massimo di risultati elaborati contemporaneamente
+            content_similarity_threshold (Optional[float]): Similarità minima tra gli embedding del task
+                                                            e della pagina per valutarne il contenuto
+                                                            con il modello (None per disattivare)
+            max_cache_chars (int): Dimensione massima (in caratteri) dei contenuti tenuti in memoria
+            cache_ttl (Optional[float]): Età massima in secondi dei contenuti in memoria (None per nessun limite)
+            disk_cache_ttl (Optional[float]): Età massima in secondi dei contenuti su disco, oltre la quale
+                                              le pagine vengono scaricate di nuovo (None per nessun limite)
         """
         self.max_relevant_results = max_relevant_results
         self.max_search_cycles = max_search_cycles
         self.link_relevance_threshold = link_relevance_threshold
         self.content_relevance_threshold = content_relevance_threshold
         self.cache_dir = cache_dir
+        self.max_concurrency = max_concurrency
+        self.content_similarity_threshold = content_similarity_threshold
         
         # Inizializza il gestore della cache
-        self.content_cache = ContentCache(cache_dir=cache_dir)
+        self.content_cache = ContentCache(cache_dir=cache_dir, max_memory_chars=max_cache_chars,
+                                          ttl=cache_ttl, disk_ttl=disk_cache_ttl)
         
         # Inizializza RAGStorage per salvare i risultati
         try:
@@ -81,18 +182,56 @@ class SearchOrchestrator:
             return relevant_results[0]['metadata']['rag_id']
         return None
         
-    def search(self, task: str, save_as_rag: bool = True, research_id: str = None) -> List[Dict[str, Any]]: 
+    def search(self, task: str, save_as_rag: bool = True, research_id: str = None,
+               max_relevant_results: Optional[int] = None,
+               max_search_cycles: Optional[int] = None) -> List[Dict[str, Any]]: 
         """
         Esegue il processo di ricerca completo per un task specifico.
+        Wrapper sincrono di asearch.
         
         Args:
             task (str): Il task di ricerca
             save_as_rag (bool): Se True, salva i risultati in formato RAG
             research_id (str): ID della ricerca a cui associare i log
+            max_relevant_results (Optional[int]): Se specificato, sostituisce per questa ricerca
+                                                  il numero massimo di risultati rilevanti
+            max_search_cycles (Optional[int]): Se specificato, sostituisce per questa ricerca
+                                               il numero massimo di cicli di ricerca
             
         Returns:
             List[Dict[str, Any]]: Lista di risultati rilevanti con contenuti
         """
+        return asyncio.run(self.asearch(task, save_as_rag=save_as_rag, research_id=research_id,
+                                        max_relevant_results=max_relevant_results,
+                                        max_search_cycles=max_search_cycles))
+    
+    async def asearch(self, task: str, save_as_rag: bool = True, research_id: str = None,
+                      max_relevant_results: Optional[int] = None,
+                      max_search_cycles: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Esegue il processo di ricerca completo per un task specifico.
+        I cicli di ricerca accodano i risultati in una coda limitata, elaborata in parallelo da
+        max_concurrency worker: il ciclo successivo parte mentre i worker elaborano gli ultimi
+        risultati. La ricerca termina quando sono stati trovati max_relevant_results risultati
+        rilevanti o quando i cicli sono esauriti e tutti i risultati sono stati elaborati.
+        
+        Args:
+            task (str): Il task di ricerca
+            save_as_rag (bool): Se True, salva i risultati in formato RAG
+            research_id (str): ID della ricerca a cui associare i log
+            max_relevant_results (Optional[int]): Se specificato, sostituisce per questa ricerca
+                                                  il numero massimo di risultati rilevanti
+            max_search_cycles (Optional[int]): Se specificato, sostituisce per questa ricerca
+                                               il numero massimo di cicli di ricerca
+            
+        Returns:
+            List[Dict[str, Any]]: Lista di risultati rilevanti con contenuti
+        """
+        if max_relevant_results is None:
+            max_relevant_results = self.max_relevant_results
+        if max_search_cycles is None:
+            max_search_cycles = self.max_search_cycles
+        
         # Usa il logger della ricerca se disponibile
         research_logger = None
         log_redirect = None
@@ -105,115 +244,104 @@ class SearchOrchestrator:
         else:
             logger.info(f"Avvio ricerca per il task: {task}")
         
+        # Un unico client HTTP per tutti i download della ricerca: le connessioni
+        # verso gli stessi host vengono riutilizzate tra risultati e cicli
+        http_client = create_async_http_client()
+        
         try:
             relevant_results = []  # Risultati finali rilevanti
-            visited_urls = set()  # URL già visitati
+            visited_urls = set()  # URL già visitati, in forma canonica
             previous_queries = []  # Query già utilizzate
+            scraper = functools.partial(ascrape_webpage, http_client)
             
-            # Esegui fino a max_search_cycles cicli di ricerca
-            for cycle in range(1, self.max_search_cycles + 1):
-                if research_logger:
-                    research_logger.info(f"Ciclo di ricerca {cycle}/{self.max_search_cycles}")
-                else:
-                    logger.info(f"Ciclo di ricerca {cycle}/{self.max_search_cycles}")
-                
-                # 1. Genera una nuova query basata sul task
-                query = build_google_query(task, previous_queries=previous_queries)
-                previous_queries.append(query)
-                if research_logger:
-                    research_logger.info(f"Query generata: {query}")
-                else:
-                    logger.info(f"Query generata: {query}")
-                
-                # 2. Esegui la ricerca su Google
-                search_results = google_search(query)
-                if not search_results:
-                    if research_logger:
-                        research_logger.warning(f"Nessun risultato trovato per la query: {query}")
-                    else:
-                        logger.warning(f"Nessun risultato trovato per la query: {query}")
-                    continue
-                    
-                if research_logger:
-                    research_logger.info(f"Trovati {len(search_results)} risultati di ricerca")
-                else:
-                    logger.info(f"Trovati {len(search_results)} risultati di ricerca")
-                
-                # 3. Valuta la rilevanza dei risultati di ricerca
-                for result in search_results:
-                    url = result.get('link')
-                    
-                    # Salta URL già visitati
-                    if url in visited_urls:
+            # I risultati da elaborare passano per una coda limitata servita da max_concurrency worker:
+            # quando è piena il producer attende, così i cicli successivi partono solo man mano che
+            # i worker si liberano
+            result_queue = asyncio.Queue(maxsize=self.max_concurrency)
+            enough_results = asyncio.Event()
+            
+            async def _worker():
+                while True:
+                    result = await result_queue.get()
+                    try:
+                        # Raggiunto il numero di risultati, la coda viene solo svuotata
+                        if not enough_results.is_set():
+                            await self._process_result(result, task, scraper, relevant_results,
+                                                       max_relevant_results, research_logger)
+                            if len(relevant_results) >= max_relevant_results:
+                                enough_results.set()
+                    except Exception as e:
+                        # Un errore su un risultato non deve fermare il worker
                         if research_logger:
-                            research_logger.info(f"URL già visitato, saltato: {url}")
+                            research_logger.error(f"Errore durante l'elaborazione dell'URL {result.link}: {e}")
                         else:
-                            logger.info(f"URL già visitato, saltato: {url}")
-                        continue
-                    
-                    # Aggiungi agli URL visitati
-                    visited_urls.add(url)
+                            logger.error(f"Errore durante l'elaborazione dell'URL {result.link}: {e}")
+                    finally:
+                        result_queue.task_done()
+            
+            async def _produce():
+                # Esegui fino a max_search_cycles cicli di ricerca, finché i risultati non bastano
+                for cycle in range(1, max_search_cycles + 1):
+                    if enough_results.is_set():
+                        return
                     
-                    # Valuta la rilevanza del risultato rispetto al task
-                    relevance_score = evaluate_result_relevance(result, task)
-                    result['relevance_score'] = relevance_score
+                    search_results = await self._search_cycle(task, cycle, max_search_cycles,
+                                                              previous_queries, research_logger)
                     
-                    # Se il punteggio di rilevanza è sufficiente, scarica e valuta il contenuto
-                    if relevance_score >= self.link_relevance_threshold:
-                        if research_logger:
-                            research_logger.info(f"Risultato rilevante trovato (score: {relevance_score:.2f}): {url}")
-                        else:
-                            logger.info(f"Risultato rilevante trovato (score: {relevance_score:.2f}): {url}")
+                    # Accoda i risultati non ancora visitati e sufficientemente rilevanti
+                    for result in search_results:
+                        if enough_results.is_set():
+                            return
                         
-                        try:
-                            # 4. Scarica il contenuto della pagina web (o usa la cache)
-                            content = self.content_cache.get_content(url, scraper_func=scrape_webpage)
-                            
-                            # 5. Pulisci il contenuto, passando anche la query di ricerca come contesto
-                            clean_content = clean_webpage_content(content, search_query=task)
-                            
-                            # 6. Valuta la rilevanza del contenuto rispetto al task
-                            content_evaluation = evaluate_content_relevance(task, clean_content, detailed=True)
-                            
-                            # Se il contenuto è rilevante, aggiungilo ai risultati
-                            if (content_evaluation['is_relevant'] and 
-                                content_evaluation['relevance_score'] >= self.content_relevance_threshold):
-                                
-                                # Aggiungi i risultati della valutazione del contenuto
-                                result['content'] = clean_content
-                                result['content_evaluation'] = content_evaluation
-                                
-                                relevant_results.append(result)
-                                if research_logger:
-                                    research_logger.info(f"Contenuto rilevante aggiunto ai risultati (score: {content_evaluation['relevance_score']:.2f}): {url}")
-                                else:
-                                    logger.info(f"Contenuto rilevante aggiunto ai risultati (score: {content_evaluation['relevance_score']:.2f}): {url}")
-                                
-                                # Se abbiamo raggiunto il numero desiderato di risultati rilevanti, termina
-                                if len(relevant_results) >= self.max_relevant_results:
-                                    if research_logger:
-                                        research_logger.info(f"Raggiunto il numero massimo di risultati rilevanti ({self.max_relevant_results})")
-                                    else:
-                                        logger.info(f"Raggiunto il numero massimo di risultati rilevanti ({self.max_relevant_results})")
-                                    break
-                            else:
-                                if research_logger:
-                                    research_logger.info(f"Contenuto non rilevante (score: {content_evaluation['relevance_score']:.2f}): {url}")
-                                else:
-                                    logger.info(f"Contenuto non rilevante (score: {content_evaluation['relevance_score']:.2f}): {url}")
+                        url = result.get('link')
+                        if not url:
+                            continue
                         
-                        except Exception as e:
+                        # Salta URL già visitati, anche nello stesso ciclo o in una forma diversa
+                        canonical_url = _canonicalize(url)
+                        if canonical_url in visited_urls:
                             if research_logger:
-                                research_logger.error(f"Errore durante l'elaborazione dell'URL {url}: {e}")
+                                research_logger.info(f"URL già visitato, saltato: {url}")
                             else:
-                                logger.error(f"Errore durante l'elaborazione dell'URL {url}: {e}")
+                                logger.info(f"URL già visitato, saltato: {url}")
+                            continue
+                        
+                        # Aggiungi agli URL visitati
+                        visited_urls.add(canonical_url)
+                        
+                        # Solo i risultati sopra la soglia vengono scaricati e valutati
+                        relevance_score = result['relevance_score']
+                        if relevance_score < self.link_relevance_threshold:
+                            continue
+                        
+                        if research_logger:
+                            research_logger.info(f"Risultato rilevante trovato (score: {relevance_score:.2f}): {url}")
+                        else:
+                            logger.info(f"Risultato rilevante trovato (score: {relevance_score:.2f}): {url}")
+                        await result_queue.put(SearchResult.from_dict(result))
+            
+            workers = [asyncio.create_task(_worker()) for _ in range(self.max_concurrency)]
+            producer = asyncio.create_task(_produce())
+            enough_waiter = asyncio.create_task(enough_results.wait())
+            
+            try:
+                # Termina quando i cicli sono esauriti o quando i risultati bastano
+                await asyncio.wait([producer, enough_waiter], return_when=asyncio.FIRST_COMPLETED)
+                if producer.done():
+                    producer.result()  # Propaga gli errori della ricerca
                 
-                # Se questo è l'ultimo ciclo o abbiamo trovato almeno alcuni risultati, termina
-                if cycle == self.max_search_cycles or len(relevant_results) > 0:
-                    break
+                # I worker completano i risultati in corso; raggiunto il limite, i restanti vengono scartati
+                await result_queue.join()
+            finally:
+                # Un ciclo di ricerca ancora in corso viene abbandonato: il thread della richiesta
+                # termina da solo, ma i suoi risultati non vengono accodati
+                pending_tasks = workers + [producer, enough_waiter]
+                for pending_task in pending_tasks:
+                    pending_task.cancel()
+                await asyncio.gather(*pending_tasks, return_exceptions=True)
                     
             # Ordina i risultati per punteggio di rilevanza del contenuto
-            relevant_results.sort(key=lambda x: x['content_evaluation']['relevance_score'], reverse=True)
+            relevant_results.sort(key=lambda x: x.content_evaluation['relevance_score'], reverse=True)
             
             if research_logger:
                 research_logger.info(f"Ricerca completata. Trovati {len(relevant_results)} risultati rilevanti.")
@@ -222,7 +350,8 @@ class SearchOrchestrator:
             
             # Salva i risultati in formato RAG se richiesto
             if save_as_rag and self.rag_storage and relevant_results:
-                rag_id = self.rag_storage.save_results_as_rag(task, relevant_results)
+                rag_id = await asyncio.to_thread(self.rag_storage.save_results_as_rag, task,
+                                                 [result.to_dict() for result in relevant_results])
                 if rag_id:
                     if research_logger:
                         research_logger.info(f"Risultati salvati come RAG con ID: {rag_id}")
@@ -231,17 +360,147 @@ class SearchOrchestrator:
                     
                     # Aggiungi l'ID RAG ai metadati dei risultati
                     for result in relevant_results:
-                        if 'metadata' not in result:
-                            result['metadata'] = {}
-                        result['metadata']['rag_id'] = rag_id
+                        result.rag_id = rag_id
             
-            return relevant_results
+            return [result.to_dict() for result in relevant_results]
         finally:
+            await http_client.aclose()
+            
             # Chiudi il redirector se aperto
             if log_redirect:
                 log_redirect.__exit__(None, None, None)
     
-    def summarize_content(self, url_or_content: str, is_url: bool = True, research_id: str = None) -> str:
+    async def _search_cycle(self, task: str, cycle: int, max_search_cycles: int,
+                            previous_queries: List[str], research_logger=None) -> List[Dict[str, Any]]:
+        """
+        Genera la query di un ciclo di ricerca, esegue la ricerca su Google e valuta
+        la rilevanza di tutti i risultati con un'unica richiesta al modello.
+        
+        Args:
+            task (str): Il task di ricerca
+            cycle (int): Numero del ciclo
+            max_search_cycles (int): Numero massimo di cicli della ricerca
+            previous_queries (List[str]): Query già utilizzate, aggiornata con quella generata
+            research_logger (ResearchLogger, optional): Logger della ricerca
+            
+        Returns:
+            List[Dict[str, Any]]: Risultati di ricerca con il punteggio di rilevanza
+                                  (vuota se la ricerca non ha prodotto risultati)
+        """
+        if research_logger:
+            research_logger.info(f"Ciclo di ricerca {cycle}/{max_search_cycles}")
+        else:
+            logger.info(f"Ciclo di ricerca {cycle}/{max_search_cycles}")
+        
+        # 1. Genera una nuova query basata sul task
+        query = await asyncio.to_thread(build_google_query, task, previous_queries=list(previous_queries))
+        previous_queries.append(query)
+        if research_logger:
+            research_logger.info(f"Query generata: {query}")
+        else:
+            logger.info(f"Query generata: {query}")
+        
+        # 2. Esegui la ricerca su Google
+        search_results = await asyncio.to_thread(google_search, query)
+        if not search_results:
+            if research_logger:
+                research_logger.warning(f"Nessun risultato trovato per la query: {query}")
+            else:
+                logger.warning(f"Nessun risultato trovato per la query: {query}")
+            return []
+            
+        if research_logger:
+            research_logger.info(f"Trovati {len(search_results)} risultati di ricerca")
+        else:
+            logger.info(f"Trovati {len(search_results)} risultati di ricerca")
+        
+        # 3. Valuta la rilevanza dei risultati rispetto al task
+        return await asyncio.to_thread(batch_evaluate_relevance, search_results, task)
+    
+    async def _process_result(self, result: SearchResult, task: str,
+                              scraper, relevant_results: List[SearchResult], max_relevant_results: int,
+                              research_logger=None) -> None:
+        """
+        Scarica, pulisce e valuta il contenuto di un risultato di ricerca rilevante.
+        Le operazioni bloccanti vengono eseguite in thread separati; i risultati rilevanti
+        vengono aggiunti a relevant_results.
+        
+        Args:
+            result (SearchResult): Risultato di ricerca già valutato da elaborare
+            task (str): Il task di ricerca
+            scraper (callable): Coroutine che scarica il contenuto di un URL
+            relevant_results (List[SearchResult]): Risultati rilevanti trovati finora
+            max_relevant_results (int): Numero di risultati rilevanti oltre il quale fermarsi
+            research_logger (ResearchLogger, optional): Logger della ricerca
+        """
+        url = result.link
+        
+        # Le altre elaborazioni potrebbero aver già trovato abbastanza risultati
+        if len(relevant_results) >= max_relevant_results:
+            return
+        
+        try:
+            # Scarica il contenuto della pagina web (o usa la cache)
+            content = await self.content_cache.get_content_async(url, async_scraper_func=scraper)
+            
+            # Estrai il testo dall'HTML nel pool di processi condiviso, così da non bloccare
+            # sotto il GIL gli altri download in corso, poi puliscilo con il modello
+            # passando anche la query di ricerca come contesto
+            text = await asyncio.get_running_loop().run_in_executor(get_process_pool(), html_to_text, content)
+            clean_content = await asyncio.to_thread(clean_webpage_content, text, search_query=task)
+            if clean_content:
+                # Riusato da summarize_content con lo stesso task senza ripulire di nuovo la pagina
+                await asyncio.to_thread(self.content_cache.save_clean_content, url, task, clean_content)
+            
+            # Scarta senza valutazione dettagliata i contenuti chiaramente fuori tema
+            if self.content_similarity_threshold is not None:
+                similarity = await asyncio.to_thread(content_similarity, task, clean_content)
+                if similarity is not None and similarity < self.content_similarity_threshold:
+                    if research_logger:
+                        research_logger.info(f"Contenuto scartato dal prefiltro (similarità: {similarity:.2f}): {url}")
+                    else:
+                        logger.info(f"Contenuto scartato dal prefiltro (similarità: {similarity:.2f}): {url}")
+                    return
+            
+            # Valuta la rilevanza del contenuto rispetto al task
+            content_evaluation = await asyncio.to_thread(evaluate_content_relevance, task, clean_content, detailed=True)
+            
+            # Se il contenuto è rilevante, aggiungilo ai risultati
+            if (content_evaluation['is_relevant'] and 
+                content_evaluation['relevance_score'] >= self.content_relevance_threshold):
+                
+                if len(relevant_results) >= max_relevant_results:
+                    return
+                
+                # Aggiungi i risultati della valutazione del contenuto
+                result.content = clean_content
+                result.content_evaluation = content_evaluation
+                
+                relevant_results.append(result)
+                if research_logger:
+                    research_logger.info(f"Contenuto rilevante aggiunto ai risultati (score: {content_evaluation['relevance_score']:.2f}): {url}")
+                else:
+                    logger.info(f"Contenuto rilevante aggiunto ai risultati (score: {content_evaluation['relevance_score']:.2f}): {url}")
+                
+                if len(relevant_results) >= max_relevant_results:
+                    if research_logger:
+                        research_logger.info(f"Raggiunto il numero massimo di risultati rilevanti ({max_relevant_results})")
+                    else:
+                        logger.info(f"Raggiunto il numero massimo di risultati rilevanti ({max_relevant_results})")
+            else:
+                if research_logger:
+                    research_logger.info(f"Contenuto non rilevante (score: {content_evaluation['relevance_score']:.2f}): {url}")
+                else:
+                    logger.info(f"Contenuto non rilevante (score: {content_evaluation['relevance_score']:.2f}): {url}")
+        
+        except Exception as e:
+            if research_logger:
+                research_logger.error(f"Errore durante l'elaborazione dell'URL {url}: {e}")
+            else:
+                logger.error(f"Errore durante l'elaborazione dell'URL {url}: {e}")
+    
+    def summarize_content(self, url_or_content: str, is_url: bool = True, research_id: str = None,
+                          search_query: str = None) -> str:
         """
         Crea un riassunto del contenuto di una pagina utilizzando OpenAI.
         
@@ -249,6 +508,9 @@ class SearchOrchestrator:
             url_or_content (str): URL o contenuto diretto da riassumere
             is_url (bool): Se True, il primo argomento è un URL, altrimenti è già il contenuto
             research_id (str): ID della ricerca a cui associare i log
+            search_query (str): Query di ricerca con cui ripulire la pagina (predefinita: l'URL).
+                                Con il task di una ricerca viene riusato il contenuto ripulito
+                                durante la ricerca stessa
             
         Returns:
             str: Riassunto del contenuto
@@ -263,11 +525,16 @@ class SearchOrchestrator:
             log_redirect.__enter__()
         
         try:
-            # Se è un URL, ottieni il contenuto (dalla cache se disponibile)
+            # Se è un URL, usa il contenuto già ripulito se disponibile, altrimenti
+            # ottieni il contenuto (dalla cache se disponibile) e puliscilo
             if is_url:
-                content = self.content_cache.get_content(url_or_content, scraper_func=scrape_webpage)
-                # Pulisci il contenuto
-                content = clean_webpage_content(content, search_query=url_or_content if is_url else None)
+                search_query = search_query or url_or_content
+                content = self.content_cache.get_clean_content(url_or_content, search_query)
+                if content is None:
+                    content = self.content_cache.get_content(url_or_content, scraper_func=scrape_webpage)
+                    content = clean_webpage_content(content, search_query=search_query)
+                    if content:
+                        self.content_cache.save_clean_content(url_or_content, search_query, content)
             else:
                 content = url_or_content
             
@@ -277,17 +544,16 @@ class SearchOrchestrator:
             
             try:
                 # Tronca il contenuto se troppo lungo per il prompt
-                max_content_length = 10000
-                if len(content) > max_content_length:
-                    content = content[:max_content_length] + "\n...[contenuto troncato]..."
+                original_length = len(content)
+                if original_length > SUMMARY_MAX_CONTENT_CHARS:
+                    content = content[:SUMMARY_MAX_CONTENT_CHARS] + "\n...[contenuto troncato]..."
                     if research_logger:
-                        research_logger.info(f"Contenuto troncato da {len(content)} a {max_content_length} caratteri per il riassunto")
+                        research_logger.info(f"Contenuto troncato da {original_length} a {SUMMARY_MAX_CONTENT_CHARS} caratteri per il riassunto")
                     else:
-                        logger.info(f"Contenuto troncato da {len(content)} a {max_content_length} caratteri per il riassunto")
-                
-                # Usa OpenAI per generare un riassunto
-                import openai
+                        logger.info(f"Contenuto troncato da {original_length} a {SUMMARY_MAX_CONTENT_CHARS} caratteri per il riassunto")
                 
+                # Usa OpenAI per generare un riassunto, con il client condiviso
+                # che mantiene aperte le connessioni tra una richiesta e l'altra
                 system_message = """
                 Sei un'IA specializzata nel riassumere contenuti web.
                 Crea un riassunto conciso ma informativo del testo fornito, evidenziando:
@@ -301,7 +567,7 @@ class SearchOrchestrator:
                 
                 user_message = f"Ecco il contenuto da riassumere:\n\n{content}"
                 
-                response = openai.chat.completions.create(
+                response = client.chat.completions.create(
                     model=OPENAI_MODEL,
                     messages=[
                         {"role": "system", "content": system_message},
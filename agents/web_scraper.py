@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 # agents/web_scraper.py
 
+import re
 import time
+import asyncio
 import logging
+import httpx
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
@@ -16,6 +19,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger('web_scraper')
 
+# User agent per simulare un browser normale
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+# Limiti del client HTTP con cui si scaricano direttamente le pagine statiche
+HTTP_MAX_CONNECTIONS = 32
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 16
+HTTP_TIMEOUT = 15
+
+# Con meno testo visibile di così la pagina è probabilmente generata via JavaScript
+MIN_STATIC_TEXT_CHARS = 500
+
+_RE_INVISIBLE = re.compile(r'<(script|style|noscript|template)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_RE_TAGS = re.compile(r'<[^>]+>')
+
 class WebScraper:
     """
     Agente per scaricare il contenuto di una pagina web utilizzando Selenium.
@@ -57,7 +74,7 @@ class WebScraper:
         chrome_options.add_argument("--disable-popup-blocking")
         
         # User agent per simulare un browser normale
-        chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+        chrome_options.add_argument(f"--user-agent={USER_AGENT}")
         
         try:
             service = Service(ChromeDriverManager().install())
@@ -166,6 +183,55 @@ def scrape_webpage(url, headless=True, timeout=30):
     scraper = WebScraper(headless=headless, timeout=timeout)
     return scraper.get_page_content(url)
 
+def create_async_http_client() -> httpx.AsyncClient:
+    """
+    Crea il client HTTP asincrono da condividere tra i download di una ricerca: mantiene
+    aperte le connessioni verso gli stessi host e usa HTTP/2 quando il server lo supporta.
+    Il client è legato all'event loop in cui viene usato.
+    
+    Returns:
+        httpx.AsyncClient: Client HTTP asincrono
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        follow_redirects=True,
+        timeout=HTTP_TIMEOUT,
+        headers={'User-Agent': USER_AGENT},
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS)
+    )
+
+def _visible_text_length(html: str) -> int:
+    # Caratteri non vuoti fuori da tag, script e stili
+    return sum(map(len, _RE_TAGS.sub(' ', _RE_INVISIBLE.sub(' ', html)).split()))
+
+async def ascrape_webpage(client: httpx.AsyncClient, url: str, headless=True, timeout=30) -> str:
+    """
+    Scarica una pagina web con il client HTTP condiviso, senza avviare un browser.
+    Ripiega su Selenium se la pagina non è scaricabile direttamente o se il suo
+    contenuto è generato via JavaScript.
+    
+    Args:
+        client (httpx.AsyncClient): Client HTTP condiviso
+        url (str): URL della pagina da scaricare
+        headless (bool, optional): Se True, l'eventuale browser viene avviato in modalità headless
+        timeout (int, optional): Timeout in secondi per il caricamento della pagina nel browser
+        
+    Returns:
+        str: HTML della pagina o contenuto testuale restituito dal browser
+    """
+    try:
+        response = await client.get(url)
+        if response.status_code == 200 and 'html' in response.headers.get('content-type', ''):
+            html = response.text
+            if _visible_text_length(html) >= MIN_STATIC_TEXT_CHARS:
+                logger.info(f"Pagina scaricata direttamente: {url}")
+                return html
+        logger.info(f"Contenuto statico non disponibile per {url}, utilizzo il browser")
+    except httpx.HTTPError as e:
+        logger.warning(f"Errore nel download diretto di {url}: {e}. Utilizzo il browser")
+    
+    return await asyncio.to_thread(scrape_webpage, url, headless, timeout)
+
 # Test dello scraper
 if __name__ == "__main__":
     import sys